@@ -26,6 +26,40 @@ import jhbuild.frontends
 from jhbuild.errors import UsageError, FatalError, CommandError
 from jhbuild.commands import Command, BuildCommand, register_command
 from jhbuild.utils import uprint, N_, _
+from jhbuild.utils import criticalpath
+from jhbuild.utils.buildhistory import format_duration
+
+
+def update_modules(config, module_list, module_set):
+    '''Check out or update the modules of module_list, up to update_jobs
+    of them at the same time, and print the outcome for each module.'''
+    config.build_targets = ['checkout']
+    config.nonetwork = False
+    config.module_jobs = config.update_jobs
+
+    build = jhbuild.frontends.get_buildscript(config, module_list, module_set=module_set)
+    # updating a module does not require its dependencies to be updated
+    build.independent_modules = True
+    rc = build.build()
+
+    results = build.module_results
+    if len(module_list) > 1:
+        uprint(_('Summary:'))
+        width = max(len(module.name) for module in module_list)
+        for module in module_list:
+            if module.name not in results:
+                status = _('skipped')
+            elif results[module.name] is None:
+                status = _('updated')
+            else:
+                error = results[module.name]
+                status = _('failed: %s') % (error.args[0] if error.args else error)
+            uprint('  %-*s %s' % (width, module.name, status))
+    failed = len([x for x in results.values() if x is not None])
+    if failed:
+        uprint(_('%(failed)d of %(total)d modules could not be updated') % {
+                'failed': failed, 'total': len(module_list)})
+    return rc
 
 
 class cmd_update(Command):
@@ -51,6 +85,9 @@ class cmd_update(Command):
             make_option('--ignore-suggests',
                         action='store_true', dest='ignore_suggests', default=False,
                         help=_('ignore all soft-dependencies')),
+            make_option('-j', '--jobs', metavar='N',
+                        action='store', dest='update_jobs', type='int', default=None,
+                        help=_('update up to N modules at the same time')),
             ])
 
     def run(self, config, options, args, help=None):
@@ -66,12 +103,7 @@ class cmd_update(Command):
             if not module_list:
                 raise FatalError(_('%s not in module list') % options.startat)
 
-        # don't actually perform build ...
-        config.build_targets = ['checkout']
-        config.nonetwork = False
-
-        build = jhbuild.frontends.get_buildscript(config, module_list, module_set=module_set)
-        return build.build()
+        return update_modules(config, module_list, module_set)
 
 register_command(cmd_update)
 
@@ -87,6 +119,9 @@ class cmd_updateone(Command):
             make_option('-D', metavar='DATE-SPEC',
                         action='store', dest='sticky_date', default=None,
                         help=_('set a sticky date when checking out modules')),
+            make_option('-j', '--jobs', metavar='N',
+                        action='store', dest='update_jobs', type='int', default=None,
+                        help=_('update up to N modules at the same time')),
             ])
 
     def run(self, config, options, args, help=None):
@@ -100,12 +135,7 @@ class cmd_updateone(Command):
         if not module_list:
             self.parser.error(_('This command requires a module parameter.'))
 
-        # don't actually perform build ...
-        config.build_targets = ['checkout']
-        config.nonetwork = False
-
-        build = jhbuild.frontends.get_buildscript(config, module_list, module_set=module_set)
-        return build.build()
+        return update_modules(config, module_list, module_set)
 
 register_command(cmd_updateone)
 
@@ -221,6 +251,12 @@ class cmd_build(BuildCommand):
             make_option('--nodeps',
                         action='store_false', dest='check_sysdeps', default=None,
                         help=_('ignore missing system dependencies')),
+            make_option('--module-jobs', metavar='N',
+                        action='store', dest='module_jobs', type='int', default=None,
+                        help=_('build up to N independent modules at the same time')),
+            make_option('--prefetch', metavar='N',
+                        action='store', dest='prefetch_modules', type='int', default=None,
+                        help=_('check out the next N modules in the background')),
             ])
 
     def run(self, config, options, args, help=None):
@@ -456,6 +492,9 @@ class cmd_list(Command):
             make_option('-a', '--all-modules',
                         action='store_true', dest='list_all_modules', default=False,
                         help=_('list all modules, not only those that would be built')),
+            make_option('--critical-path',
+                        action='store_true', dest='critical_path', default=False,
+                        help=_('list the modules on the estimated critical path')),
             ])
 
     def run(self, config, options, args, help=None):
@@ -480,6 +519,17 @@ class cmd_list(Command):
             if not module_list:
                 raise FatalError(_('%s not in module list') % options.startat)
 
+        if options.critical_path:
+            module_list = list(module_list)
+            durations = criticalpath.get_durations(config, module_list)
+            paths = criticalpath.get_critical_paths(module_list, durations)
+            for name in criticalpath.get_critical_path(paths):
+                uprint('%-30s %10s' % (name, format_duration(durations[name])))
+            if paths:
+                uprint(_('Total estimated time: %s') %
+                       format_duration(max(x[0] for x in paths.values())))
+            return
+
         for mod in module_list:
             if options.show_rev:
                 rev = mod.get_revision()
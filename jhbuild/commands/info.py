@@ -24,6 +24,7 @@ from optparse import make_option
 import jhbuild.moduleset
 import jhbuild.frontends
 from jhbuild.utils import uprint, N_, _
+from jhbuild.utils import revisioncache
 from jhbuild.errors import FatalError
 from jhbuild.commands import Command, register_command
 from jhbuild.modtypes import MetaModule
@@ -38,7 +39,7 @@ class cmd_info(Command):
     doc = N_('Display information about one or more modules')
 
     name = 'info'
-    usage_args = N_('[ modules ... ]')
+    usage_args = N_('[ options ... ] [ modules ... ]')
 
     def __init__(self):
         Command.__init__(self, [
@@ -47,40 +48,53 @@ class cmd_info(Command):
                         help=_('only display information for installed modules. '
                                'This will not list system dependencies. If one or more '
                                'module names are specified and at least one module is '
-                               'not installed, then the command will return 1.'))
+                               'not installed, then the command will return 1.')),
+            make_option('-j', '--jobs', metavar='N',
+                        action='store', dest='jobs', type='int', default=None,
+                        help=_('inspect up to N checkouts at the same time')),
             ])
 
     def run(self, config, options, args, help=None):
         module_set = jhbuild.moduleset.load(config)
         packagedb = module_set.packagedb
 
+        rc = 0
         if args:
             # module names present
-            all_installed = True
+            modules = []
             for modname in args:
                 try:
                     module = module_set.get_module(modname, ignore_case = True)
                 except KeyError:
                     raise FatalError(_('unknown module %s') % modname)
-                package_entry = packagedb.get(module.name)
-                installed = package_entry is not None
-                all_installed = all_installed and installed
-                if (options.installed and installed) or not options.installed:
-                    self.show_info(module, packagedb, module_set)
-            if options.installed and not all_installed:
-                return 1
+                installed = packagedb.get(module.name) is not None
+                if not installed and options.installed:
+                    rc = 1
+                else:
+                    modules.append(module)
         else:
             # no module names given
-            for module in module_set.modules.values():
-                package_entry = packagedb.get(module.name)
-                if options.installed:
-                    if package_entry is not None:
-                        self.show_info(module, packagedb, module_set)
-                else:
-                    # no installed option selected, simply show all modules
-                    self.show_info(module, packagedb, module_set)
-
-    def show_info(self, module, packagedb, module_set):
+            modules = list(module_set.modules.values())
+            if options.installed:
+                modules = [module for module in modules
+                           if packagedb.get(module.name) is not None]
+
+        # the version control tools are run for several modules at the
+        # same time, the information is then displayed in order
+        tree_ids = revisioncache.get_tree_ids(config, modules, options.jobs)
+        requiredby = {}
+        before = {}
+        for mod in module_set.modules.values():
+            for dep in set(mod.dependencies):
+                requiredby.setdefault(dep, []).append(mod.name)
+            for dep in set(mod.after):
+                before.setdefault(dep, []).append(mod.name)
+        for module, tree_id in zip(modules, tree_ids):
+            self.show_info(module, packagedb, tree_id,
+                           requiredby.get(module.name), before.get(module.name))
+        return rc
+
+    def show_info(self, module, packagedb, tree_id, requiredby, before):
         package_entry = packagedb.get(module.name)
 
         uprint(_('Name:'), module.name)
@@ -119,11 +133,8 @@ class cmd_info(Command):
         elif isinstance(module.branch, TarballBranch):
             uprint(_('URL:'), module.branch.module)
             uprint(_('Version:'), module.branch.version)
-        try:
-            tree_id = module.branch.tree_id()
+        if tree_id is not None:
             uprint(_('Tree-ID:'), tree_id)
-        except (NotImplementedError, AttributeError):
-            pass
         try:
             source_dir = module.branch.srcdir
             uprint(_('Sourcedir:'), source_dir)
@@ -133,16 +144,12 @@ class cmd_info(Command):
         # dependencies
         if module.dependencies:
             uprint(_('Requires:'), ', '.join(module.dependencies))
-        requiredby = [ mod.name for mod in module_set.modules.values()
-                       if module.name in mod.dependencies ]
         if requiredby:
             uprint(_('Required by:'), ', '.join(requiredby))
         if module.suggests:
             uprint(_('Suggests:'), ', '.join(module.suggests))
         if module.after:
             uprint(_('After:'), ', '.join(module.after))
-        before = [ mod.name for mod in module_set.modules.values()
-                   if module.name in mod.after ]
         if before:
             uprint(_('Before:'), ', '.join(before))
 
@@ -0,0 +1,56 @@
+# jhbuild - a tool to ease building collections of source packages
+# Copyright (C) 2026  The jhbuild authors
+#
+#   mirror.py: manage the checkouts of the DVCS mirror
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import os
+
+import jhbuild.moduleset
+from jhbuild.commands import Command, register_command
+from jhbuild.errors import CommandError, UsageError
+from jhbuild.utils import uprint, N_, _
+from jhbuild.versioncontrol.git import GitBranch
+
+
+class cmd_mirror(Command):
+    doc = N_('Manage the checkouts borrowing objects from the DVCS mirror')
+
+    name = 'mirror'
+    usage_args = N_('dissociate [ modules ... ]')
+
+    def run(self, config, options, args, help=None):
+        if not args or args[0] != 'dissociate':
+            raise UsageError(_('the dissociate subcommand is expected'))
+        module_set = jhbuild.moduleset.load(config)
+        module_list = module_set.get_module_list(args[1:] or config.modules,
+                                                 config.skip)
+        rc = 0
+        for module in module_list:
+            branch = getattr(module, 'branch', None)
+            if not isinstance(branch, GitBranch):
+                continue
+            if not os.path.exists(branch.get_checkoutdir()):
+                continue
+            try:
+                if branch.dissociate():
+                    uprint(_('%s no longer borrows objects from the mirror') % module.name)
+            except CommandError as e:
+                uprint(_('%(module)s: %(error)s') % {'module': module.name, 'error': e})
+                rc = 1
+        return rc
+
+register_command(cmd_mirror)
@@ -0,0 +1,50 @@
+# jhbuild - a tool to ease building collections of source packages
+# Copyright (C) 2026  The jhbuild authors
+#
+#   owner.py: find the modules that installed a file
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import os
+
+import jhbuild.moduleset
+from jhbuild.commands import Command, register_command
+from jhbuild.errors import FatalError
+from jhbuild.utils import uprint, N_, _
+
+
+class cmd_owner(Command):
+    doc = N_('Display the modules that installed files')
+
+    name = 'owner'
+    usage_args = N_('path...')
+
+    def run(self, config, options, args, help=None):
+        if not args:
+            self.parser.error(_('This command requires a path parameter.'))
+
+        packagedb = jhbuild.moduleset.ModuleSet(config=config).packagedb
+        paths = [os.path.abspath(x) for x in args]
+        owners = packagedb.find_owners(paths)
+        missing = []
+        for arg, path in zip(args, paths):
+            if path in owners:
+                uprint('%s: %s' % (arg, ', '.join(owners[path])))
+            else:
+                missing.append(arg)
+        if missing:
+            raise FatalError(_('not installed by any module: %s') % ', '.join(missing))
+
+register_command(cmd_owner)
@@ -59,23 +59,25 @@ class cmd_rdepends(Command):
         modules = module_set.get_full_module_list(skip=dependencies_list)
         modules = modules[[x.name for x in modules].index(modname)+1:]
 
-        # iterate over remaining modules, and print those with modname as dep;
-        # this is totally inefficient as a complete dependency list is computed
-        # for each module.
-        seen_modules = []
+        # print the remaining modules that depend on modname, in build order
+        if options.direct:
+            rdepends = module_set.get_reverse_dependencies(
+                    [modname], include_suggests=False, direct=True)
+        else:
+            rdepends = module_set.get_reverse_dependencies([modname])
+        seen_modules = set()
         for module in modules:
+            if module.name not in rdepends:
+                continue
             if options.direct:
-                if modname in module.dependencies:
-                    uprint(module.name)
+                uprint(module.name)
             else:
-                module_list = module_set.get_module_list([module.name])
-                if modname in [x.name for x in module_list]:
-                    seen_modules.append(module.name)
-                    deps = ''
-                    if options.dependencies:
-                        dependencies = [x for x in module.dependencies if x in seen_modules]
-                        if dependencies:
-                            deps = '[' + ','.join(dependencies) + ']'
-                    uprint(module.name, deps)
+                seen_modules.add(module.name)
+                deps = ''
+                if options.dependencies:
+                    dependencies = [x for x in module.dependencies if x in seen_modules]
+                    if dependencies:
+                        deps = '[' + ','.join(dependencies) + ']'
+                uprint(module.name, deps)
 
 register_command(cmd_rdepends)
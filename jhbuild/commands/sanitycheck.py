@@ -105,11 +105,6 @@ class cmd_sanitycheck(Command):
         except CommandError:
             uprint(_('Could not find the Perl module %s (usually part of package \'libxml-parser-perl\' or \'perl-XML-Parser\')') % perlmod)
 
-        # check for a downloading util:
-        if not (inpath('curl', os.environ['PATH'].split(os.pathsep)) or
-                inpath('wget', os.environ['PATH'].split(os.pathsep))):
-            uprint(_('curl or wget not found'))
-
         # check for git:
         if not inpath('git', os.environ['PATH'].split(os.pathsep)):
             uprint(_('%s not found') % 'git')
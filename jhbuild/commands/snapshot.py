@@ -19,26 +19,35 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+from optparse import make_option
+
 import jhbuild.moduleset
 from jhbuild.commands import Command, register_command
-from jhbuild.utils import N_, bprint
+from jhbuild.utils import N_, _, bprint
+from jhbuild.utils import revisioncache
 from jhbuild.utils.sxml import sxml, sxml_to_string
 
 
 class cmd_snapshot(Command):
     doc = N_('Print out a moduleset for the exact versions that are checked out')
     name = 'snapshot'
-    
+    usage_args = N_('[ options ... ] [ modules ... ]')
+
     def __init__(self):
-        Command.__init__(self)
+        Command.__init__(self, [
+            make_option('-j', '--jobs', metavar='N',
+                        action='store', dest='jobs', type='int', default=None,
+                        help=_('inspect up to N checkouts at the same time')),
+            ])
 
     def run(self, config, options, args, help=None):
         module_set = jhbuild.moduleset.load(config)
         module_list = module_set.get_module_list(args or config.modules,
                                                  config.skip)
+        tree_ids = revisioncache.get_tree_ids(config, module_list, options.jobs)
         meta = [m for m in module_list if m.type == 'meta']
-        checked_out_mods = [m for m in module_list
-                            if getattr(m, 'branch', None) and m.branch.tree_id()]
+        checked_out_mods = [m for m, tree_id in zip(module_list, tree_ids)
+                            if tree_id]
         checked_out_repos = []
 
         for mod in checked_out_mods:
@@ -0,0 +1,140 @@
+# jhbuild - a tool to ease building collections of source packages
+# Copyright (C) 2026  The jhbuild authors
+#
+#   stats.py: report on the build history
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import time
+from optparse import make_option
+
+from jhbuild.commands import Command, register_command
+from jhbuild.errors import FatalError
+from jhbuild.utils import uprint, N_, _
+from jhbuild.utils.buildhistory import BuildHistory, get_filename, is_build, \
+             format_duration
+
+
+def get_latest_runs(records):
+    '''Return a dictionary mapping each module to the records of its
+    phases in the latest run it was built in (not only checked out).'''
+    runs = {}
+    for record in records:
+        runs.setdefault((record['module'], record['run']), []).append(record)
+    latest = {}
+    for (module, run), run_records in sorted(runs.items(), key=lambda x: x[0][1]):
+        if is_build(run_records):
+            latest[module] = run_records
+    return latest
+
+
+def get_regressions(records, threshold, min_seconds=10):
+    '''Return a list of (previous, latest) records of the phases whose
+    latest successful run took threshold percent longer than the
+    previous one (and at least min_seconds more).'''
+    history = {}
+    for record in records:
+        if record['status'] == 0:
+            history.setdefault((record['module'], record['phase']), []).append(record)
+    regressions = []
+    for key, phase_records in history.items():
+        if len(phase_records) < 2:
+            continue
+        previous, latest = phase_records[-2:]
+        if (latest['wall'] - previous['wall'] >= min_seconds and
+                latest['wall'] >= previous['wall'] * (1 + threshold / 100.0)):
+            regressions.append((previous, latest))
+    regressions.sort(key=lambda x: x[0]['wall'] - x[1]['wall'])
+    return regressions
+
+
+def format_run(run):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(run))
+
+
+class cmd_stats(Command):
+    doc = N_('Report on the time taken by the builds')
+
+    name = 'stats'
+    usage_args = N_('[ options ... ] [ modules ... ]')
+
+    def __init__(self):
+        Command.__init__(self, [
+            make_option('-n', '--count', metavar='COUNT',
+                        action='store', type='int', dest='count', default=10,
+                        help=_('number of modules and phases to display')),
+            make_option('--threshold', metavar='PERCENT',
+                        action='store', type='int', dest='threshold', default=25,
+                        help=_('slow down, in percent, reported as a regression')),
+            ])
+
+    def run(self, config, options, args, help=None):
+        history = BuildHistory(get_filename(config))
+        records = history.read()
+        if not records:
+            raise FatalError(_('no build history in %s') % history.filename)
+
+        if args:
+            for module in args:
+                self.show_trend(module, [x for x in records if x['module'] == module])
+            return
+
+        latest = get_latest_runs(records)
+        uprint(_('Slowest modules (latest build):'))
+        totals = sorted(((sum(x['wall'] for x in phases), module)
+                         for module, phases in latest.items()), reverse=True)
+        for wall, module in totals[:options.count]:
+            cpu = sum(x['cpu'] for x in latest[module])
+            uprint('  %-30s %10s  %s' % (module, format_duration(wall),
+                                         _('(%s CPU)') % format_duration(cpu)))
+
+        uprint()
+        uprint(_('Slowest phases (latest build):'))
+        phases = sorted((record for module_records in latest.values()
+                         for record in module_records),
+                        key=lambda x: x['wall'], reverse=True)
+        for record in phases[:options.count]:
+            uprint('  %-30s %-12s %10s' % (record['module'], record['phase'],
+                                           format_duration(record['wall'])))
+
+        regressions = get_regressions(records, options.threshold)
+        if regressions:
+            uprint()
+            uprint(_('Regressions:'))
+            for previous, latest_record in regressions[:options.count]:
+                uprint('  %-30s %-12s %10s -> %s' % (
+                        latest_record['module'], latest_record['phase'],
+                        format_duration(previous['wall']),
+                        format_duration(latest_record['wall'])))
+
+    def show_trend(self, module, records):
+        if not records:
+            uprint(_('%s: no build recorded') % module)
+            return
+        uprint('%s:' % module)
+        runs = {}
+        for record in records:
+            runs.setdefault(record['run'], []).append(record)
+        for run, phases in sorted(runs.items()):
+            revision = ([x['revision'] for x in phases if x.get('revision')] or [''])[-1]
+            failed = any(x['status'] != 0 for x in phases)
+            uprint('  %s %-12s %10s  %s%s' % (
+                    format_run(run), revision[:12],
+                    format_duration(sum(x['wall'] for x in phases)),
+                    ' '.join('%s=%s' % (x['phase'], format_duration(x['wall']))
+                             for x in phases),
+                    _(' (failed)') if failed else ''))
+
+register_command(cmd_stats)
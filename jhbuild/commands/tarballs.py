@@ -0,0 +1,67 @@
+# jhbuild - a tool to ease building collections of source packages
+# Copyright (C) 2026  The jhbuild authors
+#
+#   tarballs.py: manage the tarball store
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from optparse import make_option
+
+import jhbuild.moduleset
+from jhbuild.commands import Command, register_command
+from jhbuild.errors import FatalError, UsageError
+from jhbuild.utils import uprint, N_, _
+from jhbuild.utils.tarballstore import TarballStore
+
+
+def get_referenced_hashes(module_set):
+    '''Return the hashes of the tarballs of the modules of module_set.'''
+    hashes = set()
+    for module in module_set.modules.values():
+        source_hash = getattr(getattr(module, 'branch', None), 'source_hash', None)
+        if source_hash:
+            hashes.add(source_hash)
+    return hashes
+
+
+class cmd_tarballs(Command):
+    doc = N_('Manage the store of shared tarballs')
+
+    name = 'tarballs'
+    usage_args = N_('gc [ options ... ]')
+
+    def __init__(self):
+        Command.__init__(self, [
+            make_option('--size', metavar='MIB',
+                        action='store', dest='size', type='int', default=None,
+                        help=_('remove tarballs until the store fits in MIB MiB')),
+            ])
+
+    def run(self, config, options, args, help=None):
+        if args != ['gc']:
+            raise UsageError(_('the gc subcommand is expected'))
+        store = TarballStore.create(config)
+        if store is None:
+            raise FatalError(_('the tarball store is not enabled (see tarball_store)'))
+
+        module_set = jhbuild.moduleset.load(config)
+        max_size = None
+        if options.size is not None:
+            max_size = options.size * 1024 * 1024
+        removed, removed_size = store.gc(get_referenced_hashes(module_set), max_size)
+        uprint(_('Removed %(count)d tarballs (%(size).1f MiB)') % {
+                'count': removed, 'size': removed_size / 2.0**20})
+
+register_command(cmd_tarballs)
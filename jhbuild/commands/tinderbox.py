@@ -71,7 +71,10 @@ class cmd_tinderbox(BuildCommand):
                         help=_('build even if policy says not to')),
             make_option('--nodeps',
                         action='store_false', dest='check_sysdeps', default=None,
-                        help=_('ignore missing system dependencies'))
+                        help=_('ignore missing system dependencies')),
+            make_option('--module-jobs', metavar='N',
+                        action='store', dest='module_jobs', type='int', default=None,
+                        help=_('build up to N independent modules at the same time')),
             ])
 
     def run(self, config, options, args, help=None):
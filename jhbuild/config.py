@@ -31,6 +31,7 @@ import logging
 from jhbuild.environment import setup_env, setup_env_defaults, addpath
 from jhbuild.errors import FatalError
 from jhbuild.utils import execfile, sysid, _
+from jhbuild.utils import compilercache
 
 if sys.platform.startswith('win'):
     # For munging paths for MSYS's benefit
@@ -58,13 +59,22 @@ _known_keys = [ 'moduleset', 'modules', 'skip', 'tags', 'prefix',
                 'progress_bar', 'module_extra_env',
                 'use_local_modulesets', 'ignore_suggests', 'modulesets_dir',
                 'mirror_policy', 'module_mirror_policy', 'dvcs_mirror_dir',
+                'dvcs_mirror_alternates',
                 'shallow_clone', 'build_targets', 'cmakeargs', 'module_cmakeargs',
                 'mesonargs', 'module_mesonargs',
                 'print_command_pattern', 'static_analyzer',
                 'module_static_analyzer', 'static_analyzer_template',
                 'static_analyzer_outputdir', 'check_sysdeps', 'system_prefix',
                 'help_website', 'conditions', 'extra_prefixes',
-                'disable_Werror', 'xdg_cache_home', 'exit_on_error'
+                'disable_Werror', 'xdg_cache_home', 'exit_on_error',
+                'module_jobs', 'jobserver', 'update_jobs',
+                'max_connections', 'max_host_connections', 'prefetch_modules',
+                'moduleset_cache', 'packagedb_backend',
+                'install_conflict_policy', 'install_preserve_unchanged',
+                'artifact_cache', 'artifact_cache_dir', 'artifact_cache_size',
+                'compiler_cache', 'compiler_cache_dir', 'compiler_cache_size',
+                'build_history', 'module_scheduling',
+                'tarball_store', 'tarball_store_dir', 'tarball_store_size',
               ]
 
 env_prepends = {}
@@ -254,6 +264,8 @@ class Config:
                          'tinderbox_outputdir', 'tarballdir', 'copy_dir',
                          'modulesets_dir',
                          'dvcs_mirror_dir', 'static_analyzer_outputdir',
+                         'artifact_cache_dir', 'compiler_cache_dir',
+                         'tarball_store_dir',
                          'prefix'):
             if config.get(path_key):
                 config[path_key] = os.path.expanduser(config[path_key])
@@ -282,6 +294,23 @@ class Config:
         if seen_copy_mode and not self.copy_dir:
             raise FatalError(_('copy mode requires copy_dir to be set'))
 
+        if self.install_conflict_policy not in ('warn', 'error'):
+            raise FatalError(_('invalid install conflict policy: %s') %
+                             self.install_conflict_policy)
+
+        if self.packagedb_backend not in ('files', 'sqlite'):
+            raise FatalError(_('invalid package database backend: %s') %
+                             self.packagedb_backend)
+
+        if self.module_scheduling not in ('list', 'critical-path'):
+            raise FatalError(_('invalid module scheduling: %s') %
+                             self.module_scheduling)
+
+        if self.compiler_cache not in (None,) + compilercache.PROGRAMS:
+            raise FatalError(_('invalid compiler cache: %s') % self.compiler_cache)
+        if self.compiler_cache:
+            os.environ.update(compilercache.get_environment(self))
+
         if not os.path.exists(self.modulesets_dir):
             if self.use_local_modulesets:
                 logging.warning(
@@ -302,6 +331,13 @@ class Config:
                 not os.path.isabs(self.tinderbox_outputdir)):
             raise FatalError(_('%s must be an absolute path') %
                              'tinderbox_outputdir')
+        for key in ('module_jobs', 'update_jobs', 'max_connections',
+                    'max_host_connections'):
+            value = getattr(self, key)
+            if not isinstance(value, int) or value < 1:
+                raise FatalError(_('%s must be a positive integer') % key)
+        if not isinstance(self.prefetch_modules, int) or self.prefetch_modules < 0:
+            raise FatalError(_('%s must be a non-negative integer') % 'prefetch_modules')
 
     def get_original_environment(self):
         return self._orig_environ
@@ -395,6 +431,18 @@ class Config:
             self.quiet_mode = True
         if hasattr(options, 'force_policy') and options.force_policy:
             self.build_policy = 'all'
+        if hasattr(options, 'module_jobs') and options.module_jobs is not None:
+            if options.module_jobs < 1:
+                raise FatalError(_('%s must be a positive integer') % '--module-jobs')
+            self.module_jobs = options.module_jobs
+        if hasattr(options, 'prefetch_modules') and options.prefetch_modules is not None:
+            if options.prefetch_modules < 0:
+                raise FatalError(_('%s must be a non-negative integer') % '--prefetch')
+            self.prefetch_modules = options.prefetch_modules
+        if hasattr(options, 'update_jobs') and options.update_jobs is not None:
+            if options.update_jobs < 1:
+                raise FatalError(_('%s must be a positive integer') % '--jobs')
+            self.update_jobs = options.update_jobs
         if hasattr(options, 'min_age') and options.min_age:
             try:
                 self.min_age = time.time() - parse_relative_time(options.min_age)
@@ -21,19 +21,171 @@
 import os
 import logging
 import subprocess
+import threading
+import concurrent.futures
+import contextlib
 
 from jhbuild.utils import trigger
+from jhbuild.utils.jobserver import JobServer
+from jhbuild.utils.artifactcache import ArtifactCache
+from jhbuild.utils import compilercache
+from jhbuild.utils.buildhistory import BuildHistory
+from jhbuild.utils import criticalpath
+from jhbuild.utils import revisioncache
 from jhbuild.utils import cmds, _
-from jhbuild.errors import FatalError, CommandError, SkipToPhase, SkipToEnd
+from jhbuild.errors import FatalError, CommandError, BuildStateError, SkipToPhase, SkipToEnd
+
+class per_module_attribute(object):
+    '''An attribute of a build script that describes the module being
+    built.  When several modules are built concurrently, each worker
+    thread sees its own value.'''
+
+    def __init__(self, default=None):
+        self.default = default
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return getattr(obj._get_module_locals(), self.name, self.default)
+
+    def __set__(self, obj, value):
+        setattr(obj._get_module_locals(), self.name, value)
+
+
+class PrefetchBuildScript(object):
+    '''Stand-in for the build script while a module is checked out in the
+    background: the output of commands is not displayed, and they may not
+    interact with the user.'''
+
+    def __init__(self, buildscript):
+        self.buildscript = buildscript
+        self.config = buildscript.config
+
+    def message(self, msg, module_num=-1):
+        pass
+
+    def set_action(self, action, module, module_num=-1, action_target=None):
+        pass
+
+    def execute(self, command, hint=None, cwd=None, extra_env=None):
+        extra_env = dict(extra_env or {})
+        extra_env.setdefault('GIT_TERMINAL_PROMPT', '0')
+        cmds.get_output(self.buildscript._prepare_execute(command),
+                        cwd=cwd, extra_env=extra_env)
+
+
+class ModulePrefetcher(object):
+    '''Checks out, in the background, the modules that follow the one being
+    built in the module list.
+
+    A module that could not be checked out in the background is checked
+    out again once it is reached, so that errors are reported as usual.'''
+
+    def __init__(self, buildscript, count, phases=None):
+        self.buildscript = buildscript
+        self.count = count
+        self.phases = phases
+        self.positions = {}
+        for index, module in enumerate(buildscript.modulelist):
+            self.positions[module.name] = index
+        self.executor = concurrent.futures.ThreadPoolExecutor(count)
+        self.futures = {}
+        # modules checked out in the background, or being built; they
+        # are never checked out (again) in the background
+        self.started = set()
+        self.lock = threading.Lock()
+
+    def can_prefetch(self, module):
+        branch = getattr(module, 'branch', None)
+        if branch is None or not module.has_phase('checkout'):
+            return False
+        if not branch.may_checkout(self.buildscript):
+            return False
+        phases = self.phases or self.buildscript.get_build_phases(module)
+        return 'checkout' in phases
+
+    def prefetch_after(self, module):
+        '''Start checking out the modules coming after module.'''
+        index = self.positions[module.name]
+        upcoming = self.buildscript.modulelist[index+1:index+1+self.count]
+        with self.lock:
+            self.started.add(module.name)
+            for next_module in upcoming:
+                if next_module.name in self.started:
+                    continue
+                if not self.can_prefetch(next_module):
+                    continue
+                self.started.add(next_module.name)
+                self.futures[next_module.name] = self.executor.submit(
+                        next_module.branch.checkout,
+                        PrefetchBuildScript(self.buildscript))
+
+    def get_prefetched(self, module):
+        '''Return True if module has been checked out in the background,
+        waiting for the checkout to finish if needed.'''
+        with self.lock:
+            self.started.add(module.name)
+            future = self.futures.pop(module.name, None)
+        if future is None or future.cancel():
+            return False
+        try:
+            future.result()
+        except Exception as e:
+            logging.warning(_('checking out %(module)s in the background '
+                              'failed (%(error)s), trying again') % {
+                                  'module': module.name, 'error': e})
+            return False
+        return True
+
+    def shutdown(self):
+        with self.lock:
+            for future in self.futures.values():
+                future.cancel()
+            self.futures = {}
+        self.executor.shutdown(wait=True)
+
 
 class BuildScript(object):
+    # whether the frontend can keep the output of concurrently built
+    # modules apart (see the module_jobs configuration variable)
+    supports_parallel_modules = False
+
+    module_num = per_module_attribute(0)
+    # phases planned for the module being built
+    planned_phases = per_module_attribute()
+    # key of the build artifact extracted for the install phase of the
+    # module being built, instead of building it
+    restored_artifact = per_module_attribute()
+    module_jobs = 1
+    # jobserver shared by the make and ninja processes, while building
+    jobserver = None
+    # checks out upcoming modules in the background, while building
+    prefetcher = None
+    # installs modules from their build artifacts, if enabled
+    artifact_cache = None
+    # compiler cache program, and module name -> (hits, misses) of the
+    # compiler cache while building the module
+    compiler_cache = None
+    compiler_cache_stats = None
+    # records the timings of the phases, if enabled
+    build_history = None
+    # module name -> (critical path length, next module), when modules
+    # are scheduled along their critical paths
+    critical_paths = None
+    # set when the modules can be processed in any order, such as when
+    # they are only updated; they are then not held back by failures
+    # of the modules they depend on.
+    independent_modules = False
+
     def __init__(self, config, module_list=None, module_set=None):
         if self.__class__ is BuildScript:
             raise NotImplementedError('BuildScript is an abstract base class')
 
         self.modulelist = module_list
         self.moduleset = module_set
-        self.module_num = 0
 
         self.config = config
 
@@ -87,6 +239,12 @@ class BuildScript(object):
                 if subproc.returncode == 0 and len(stderr_val) == 0:
                     self.subprocess_nice_args.extend(ionice_args)
 
+    def _get_module_locals(self):
+        try:
+            return self.__dict__['_module_locals']
+        except KeyError:
+            return self.__dict__.setdefault('_module_locals', threading.local())
+
     def _prepare_execute(self, command):
         if self.subprocess_nice_args:
             if isinstance(command, str):
@@ -109,126 +267,343 @@ class BuildScript(object):
         
         failures = [] # list of modules that couldn't be built
         self.module_num = 0
-        for module in self.modulelist:
-            self.module_num = self.module_num + 1
+        self._interaction_lock = threading.RLock()
+        self._triggers_lock = threading.Lock()
+        self._host_semaphores = {}
+        # module name -> error of the phase that failed, or None
+        self.module_results = {}
+        module_jobs = self.config.module_jobs or 1
+        if module_jobs > 1 and not self.supports_parallel_modules:
+            logging.warning(_('the %s frontend cannot process modules '
+                              'concurrently') % self.config.buildscript)
+            module_jobs = 1
+        self.module_jobs = min(module_jobs, len(self.modulelist)) or 1
+
+        if self.config.module_scheduling == 'critical-path' and not self.independent_modules:
+            self.critical_paths = criticalpath.get_critical_paths(
+                    self.modulelist,
+                    criticalpath.get_durations(self.config, self.modulelist))
+            if self.module_jobs == 1:
+                self.modulelist = criticalpath.order_modules(self.modulelist,
+                                                             self.critical_paths)
+
+        # modules that are only updated need none of the build machinery
+        if not self.independent_modules:
+            if self.config.build_policy in ('updated', 'updated-deps'):
+                # the policy is checked for every module, find out the
+                # revisions of the checkouts beforehand
+                revisioncache.probe_revisions(self.config, self.modulelist)
+
+            self.jobserver = JobServer.create(self.config)
+            self.artifact_cache = ArtifactCache.create(self.config)
+            self.compiler_cache = compilercache.get_program(self.config)
+            self.build_history = BuildHistory.create(self.config)
+            if self.build_history is not None:
+                self.build_history.start_run()
+        self.compiler_cache_stats = {}
+        compiler_cache_start = None
+        if self.compiler_cache is not None and self.module_jobs > 1:
+            # the counters are shared by the modules built at the same
+            # time, only the totals of the build can be told
+            compiler_cache_start = compilercache.get_stats(self.compiler_cache)
+        if self.config.prefetch_modules and not self.config.nonetwork:
+            self.prefetcher = ModulePrefetcher(self, self.config.prefetch_modules,
+                                               phases)
+        try:
+            if self.module_jobs > 1:
+                self._build_concurrently(phases, failures)
+            else:
+                for module in self.modulelist:
+                    self.module_num = self.module_num + 1
+                    self._build_module(module, phases, failures)
+        finally:
+            if self.prefetcher is not None:
+                self.prefetcher.shutdown()
+                self.prefetcher = None
+            if self.jobserver is not None:
+                if self.jobserver.peak:
+                    logging.info(_('at most %(peak)d of %(jobs)d job slots '
+                                   'were in use at the same time') % {
+                                       'peak': self.jobserver.peak,
+                                       'jobs': self.jobserver.jobs})
+                self.jobserver.close()
+                self.jobserver = None
+            if self.build_history is not None:
+                self.build_history.flush()
+            revisioncache.get_revision_cache(self.config).save()
+            if compiler_cache_start is not None:
+                self._log_compiler_cache_totals(compiler_cache_start)
+            elif self.compiler_cache_stats:
+                hits, misses = [sum(x) for x in zip(*self.compiler_cache_stats.values())]
+                logging.info(_('compiler cache: %(hits)d hits, %(misses)d misses '
+                               'over %(num)d modules') % {
+                                   'hits': hits, 'misses': misses,
+                                   'num': len(self.compiler_cache_stats)})
 
-            if self.config.min_age is not None:
-                installdate = self.moduleset.packagedb.installdate(module.name)
-                if installdate is not None and installdate > self.config.min_age:
-                    self.message(_('Skipping %s (installed recently)') % module.name)
-                    continue
+        self.end_build(failures)
+        if failures:
+            return 1
+        return 0
 
-            self.start_module(module.name)
-            failed = False
-            for dep in module.dependencies:
-                if dep in failures:
-                    if self.config.module_nopoison.get(dep,
-                                                       self.config.nopoison):
-                        self.message(_('module %(mod)s will be built even though %(dep)s failed')
-                                     % { 'mod':module.name, 'dep':dep })
-                    else:
-                        self.message(_('module %(mod)s not built due to non buildable %(dep)s')
-                                     % { 'mod':module.name, 'dep':dep })
-                        failed = True
-            if failed:
-                failures.append(module.name)
-                self.end_module(module.name, failed)
+    def _build_concurrently(self, phases, failures):
+        '''Build the modules of the list using a pool of self.module_jobs
+        worker threads.
+
+        A module is started once every module it depends on (including
+        <after> and <suggests> modules) that comes before it in the
+        module list has been processed; among the modules that are ready,
+        those earlier in the module list are started first.'''
+        positions = {}
+        for index, module in enumerate(self.modulelist):
+            positions[module.name] = index
+
+        # only consider edges towards earlier modules, so that modules
+        # from a dependency cycle cannot wait on each other.
+        waiting_on = {}
+        dependents = {}
+        for index, module in enumerate(self.modulelist):
+            waiting_on[module.name] = set()
+            if self.independent_modules:
                 continue
+            for dep in module.dependencies + module.after + module.suggests:
+                if positions.get(dep, index) < index:
+                    waiting_on[module.name].add(dep)
+                    dependents.setdefault(dep, []).append(module)
+
+        ready = [module for module in self.modulelist
+                 if not waiting_on[module.name]]
+        running = {}
+        with concurrent.futures.ThreadPoolExecutor(self.module_jobs) as executor:
+            while ready or running:
+                ready.sort(key=self.get_module_priority(positions))
+                while ready and len(running) < self.module_jobs:
+                    module = ready.pop(0)
+                    future = executor.submit(self._build_module_in_thread,
+                                             module, positions[module.name] + 1,
+                                             phases, failures)
+                    running[future] = module
+                done, not_done = concurrent.futures.wait(
+                        running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    module = running.pop(future)
+                    # propagate exceptions, such as the SystemExit raised
+                    # by fatal_error()
+                    future.result()
+                    for dependent in dependents.get(module.name, []):
+                        waiting_on[dependent.name].discard(module.name)
+                        if not waiting_on[dependent.name]:
+                            ready.append(dependent)
+
+    def get_module_priority(self, positions):
+        '''Return a sort key function for modules ready to be built
+        concurrently; modules with the lowest keys are started first.'''
+        if self.critical_paths is not None:
+            paths = self.critical_paths
+            return lambda module: (-paths[module.name][0], positions[module.name])
+        return lambda module: positions[module.name]
+
+    def _build_module_in_thread(self, module, module_num, phases, failures):
+        self.module_num = module_num
+        self._build_module(module, phases, failures)
+
+    def _build_module(self, module, phases, failures):
+        if self.prefetcher is not None:
+            self.prefetcher.prefetch_after(module)
+
+        if self.config.min_age is not None:
+            installdate = self.moduleset.packagedb.installdate(module.name)
+            if installdate is not None and installdate > self.config.min_age:
+                self.message(_('Skipping %s (installed recently)') % module.name)
+                return
+
+        self.start_module(module.name)
+        failed = False
+        for dep in module.dependencies:
+            if self.independent_modules:
+                break
+            if dep in failures:
+                if self.config.module_nopoison.get(dep,
+                                                   self.config.nopoison):
+                    self.message(_('module %(mod)s will be built even though %(dep)s failed')
+                                 % { 'mod':module.name, 'dep':dep })
+                else:
+                    self.message(_('module %(mod)s not built due to non buildable %(dep)s')
+                                 % { 'mod':module.name, 'dep':dep })
+                    failed = True
+        if failed:
+            failures.append(module.name)
+            self.module_results[module.name] = BuildStateError(
+                    _('dependencies could not be built'))
+            self.end_module(module.name, failed)
+            return
 
-            if not phases:
-                build_phases = self.get_build_phases(module)
-            else:
-                build_phases = phases
-            phase = None
-            num_phase = 0
-
-            # if there is an error and a new phase is selected (be it by the
-            # user or an automatic system), the chosen phase must absolutely
-            # be executed, it should in no condition be skipped automatically.
-            # The force_phase variable flags that condition.
-            force_phase = False
-
-            while num_phase < len(build_phases):
-                last_phase, phase = phase, build_phases[num_phase]
-                try:
-                    if not force_phase and module.skip_phase(self, phase, last_phase):
-                        num_phase += 1
-                        continue
-                except SkipToEnd:
-                    break
+        if self.compiler_cache is not None and self.module_jobs == 1:
+            compiler_cache_stats = compilercache.get_stats(self.compiler_cache)
+        else:
+            compiler_cache_stats = None
 
-                if not module.has_phase(phase):
-                    # skip phases that do not exist, this can happen when
-                    # phases were explicitely passed to this method.
+        if not phases:
+            build_phases = self.get_build_phases(module)
+        else:
+            build_phases = phases[:]
+        self.planned_phases = build_phases
+        self.restored_artifact = None
+        phase = None
+        num_phase = 0
+
+        # if there is an error and a new phase is selected (be it by the
+        # user or an automatic system), the chosen phase must absolutely
+        # be executed, it should in no condition be skipped automatically.
+        # The force_phase variable flags that condition.
+        force_phase = False
+
+        while num_phase < len(build_phases):
+            last_phase, phase = phase, build_phases[num_phase]
+            try:
+                if not force_phase and module.skip_phase(self, phase, last_phase):
                     num_phase += 1
                     continue
+            except SkipToPhase as e:
+                try:
+                    num_phase = build_phases.index(e.phase)
+                except ValueError:
+                    break
+                continue
 
-                self.start_phase(module.name, phase)
-                error = None
+            if not module.has_phase(phase):
+                # skip phases that do not exist, this can happen when
+                # phases were explicitely passed to this method.
+                num_phase += 1
+                continue
+
+            self.start_phase(module.name, phase)
+            if self.build_history is not None:
+                timing = self.build_history.start_phase()
+            error = None
+            try:
                 try:
-                    try:
+                    with self.get_network_slot(module, phase):
                         error, altphases = module.run_phase(self, phase)
-                    except SkipToPhase as e:
-                        try:
-                            num_phase = build_phases.index(e.phase)
-                        except ValueError:
-                            break
-                        continue
-                    except SkipToEnd:
+                except SkipToEnd:
+                    break
+                except SkipToPhase as e:
+                    try:
+                        num_phase = build_phases.index(e.phase)
+                    except ValueError:
                         break
-                finally:
-                    self._end_phase_internal(module.name, phase, error)
+                    continue
+            finally:
+                if self.build_history is not None:
+                    self.build_history.end_phase(timing, module, phase, error)
+                self._end_phase_internal(module.name, phase, error)
 
-                if error:
-                    if self.config.exit_on_error:
-                        self.fatal_error(module, phase, error)
+            if error:
+                if self.config.exit_on_error:
+                    self.fatal_error(module, phase, error)
 
-                    try:
-                        nextphase = build_phases[num_phase+1]
-                    except IndexError:
-                        nextphase = None
+                try:
+                    nextphase = build_phases[num_phase+1]
+                except IndexError:
+                    nextphase = None
+                # only one module at a time may interact with the user
+                with self._interaction_lock:
                     newphase = self.handle_error(module, phase,
                                                  nextphase, error,
                                                  altphases)
-                    force_phase = True
-                    if newphase == 'fail':
-                        failures.append(module.name)
-                        failed = True
-                        break
-                    if newphase is None:
-                        break
-                    if newphase in build_phases:
-                        num_phase = build_phases.index(newphase)
-                    else:
-                        # requested phase is not part of the plan, we insert
-                        # it, then fill with necessary phases to get back to
-                        # the current one.
-                        filling_phases = self.get_build_phases(module, targets=[phase])
-                        canonical_new_phase = newphase
-                        if canonical_new_phase.startswith('force_'):
-                            # the force_ phases won't appear in normal build
-                            # phases, so get the non-forced phase
-                            canonical_new_phase = canonical_new_phase[6:]
-
-                        if canonical_new_phase in filling_phases:
-                            filling_phases = filling_phases[
-                                    filling_phases.index(canonical_new_phase)+1:-1]
-                        build_phases[num_phase:num_phase] = [newphase] + filling_phases
-
-                        if build_phases[num_phase+1] == canonical_new_phase:
-                            # remove next phase if it would just be a repeat of
-                            # the inserted one
-                            del build_phases[num_phase+1]
+                force_phase = True
+                if newphase == 'fail':
+                    failures.append(module.name)
+                    self.module_results[module.name] = error
+                    failed = True
+                    break
+                if newphase is None:
+                    break
+                if newphase in build_phases:
+                    num_phase = build_phases.index(newphase)
                 else:
-                    force_phase = False
-                    num_phase += 1
-
-            self.end_module(module.name, failed)
-
-        self.end_build(failures)
-        if failures:
-            return 1
-        return 0
+                    # requested phase is not part of the plan, we insert
+                    # it, then fill with necessary phases to get back to
+                    # the current one.
+                    filling_phases = self.get_build_phases(module, targets=[phase])
+                    canonical_new_phase = newphase
+                    if canonical_new_phase.startswith('force_'):
+                        # the force_ phases won't appear in normal build
+                        # phases, so get the non-forced phase
+                        canonical_new_phase = canonical_new_phase[6:]
+
+                    if canonical_new_phase in filling_phases:
+                        filling_phases = filling_phases[
+                                filling_phases.index(canonical_new_phase)+1:-1]
+                    build_phases[num_phase:num_phase] = [newphase] + filling_phases
+
+                    if build_phases[num_phase+1] == canonical_new_phase:
+                        # remove next phase if it would just be a repeat of
+                        # the inserted one
+                        del build_phases[num_phase+1]
+            else:
+                force_phase = False
+                num_phase += 1
+
+        if not failed:
+            self.module_results[module.name] = None
+        if compiler_cache_stats is not None:
+            self._record_compiler_cache_stats(module, compiler_cache_stats)
+        if self.build_history is not None:
+            self.build_history.end_module(module)
+        self.end_module(module.name, failed)
+
+    def _record_compiler_cache_stats(self, module, before):
+        after = compilercache.get_stats(self.compiler_cache)
+        if after is None:
+            return
+        hits, misses = after[0] - before[0], after[1] - before[1]
+        if hits <= 0 and misses <= 0:
+            # nothing compiled (or the statistics were reset)
+            return
+        self.compiler_cache_stats[module.name] = (hits, misses)
+        logging.info(_('compiler cache: %(hits)d hits, %(misses)d misses') %
+                     {'hits': hits, 'misses': misses})
+
+    def _log_compiler_cache_totals(self, before):
+        after = compilercache.get_stats(self.compiler_cache)
+        if after is None:
+            return
+        hits, misses = after[0] - before[0], after[1] - before[1]
+        if hits > 0 or misses > 0:
+            logging.info(_('compiler cache: %(hits)d hits, %(misses)d misses') %
+                         {'hits': hits, 'misses': misses})
+
+    def get_compiler_cache_summary(self, module):
+        '''Return a short description of the compiler cache statistics of
+        module, or None if it did not compile anything.'''
+        if not self.compiler_cache_stats or module not in self.compiler_cache_stats:
+            return None
+        hits, misses = self.compiler_cache_stats[module]
+        return _('%(hits)d/%(total)d compiler cache hits') % {
+                'hits': hits, 'total': hits + misses}
+
+    def get_prefetched(self, module):
+        '''Return True if the branch of module has already been checked
+        out in the background.'''
+        if self.prefetcher is None:
+            return False
+        return self.prefetcher.get_prefetched(module)
+
+    def get_network_slot(self, module, phase):
+        '''Return a context manager to hold while running phase of module,
+        limiting to max_host_connections the number of checkouts from a
+        same host while modules are processed concurrently.'''
+        if self.module_jobs <= 1 or phase not in ('checkout', 'force_checkout'):
+            return contextlib.nullcontext()
+        branch = getattr(module, 'branch', None)
+        host = branch.get_host() if branch is not None else None
+        if host is None:
+            return contextlib.nullcontext()
+        with self._interaction_lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(
+                        self.config.max_host_connections)
+            return self._host_semaphores[host]
 
     def run_triggers(self, modules):
         """See triggers/README."""
@@ -334,7 +709,8 @@ class BuildScript(object):
         pass
     def _end_phase_internal(self, module, phase, error):
         if error is None and phase == 'install':
-            self.run_triggers([module])
+            with self._triggers_lock:
+                self.run_triggers([module])
         self.end_phase(module, phase, error)
 
     def message(self, msg, module_num=-1):
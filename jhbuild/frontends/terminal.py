@@ -22,6 +22,7 @@ import sys
 import os
 import signal
 import subprocess
+import threading
 import unicodedata
 
 from jhbuild.frontends import buildscript
@@ -101,13 +102,19 @@ phase_map = {
     }
 
 class TerminalBuildScript(buildscript.BuildScript):
-    triedcheckout = None
+    supports_parallel_modules = True
+
+    triedcheckout = buildscript.per_module_attribute()
+    # output of the commands run for the current module, held back while
+    # several modules are being built concurrently
+    module_output = buildscript.per_module_attribute()
     is_end_of_build = False
 
     def __init__(self, config, module_list, module_set=None):
         buildscript.BuildScript.__init__(self, config, module_list, module_set=module_set)
         self.trayicon = trayicon.TrayIcon(config)
         self.notify = notify.Notify(config)
+        self.output_lock = threading.RLock()
         
     def message(self, msg, module_num=-1):
         '''Display a message to the user'''
@@ -119,16 +126,27 @@ class TerminalBuildScript(buildscript.BuildScript):
         else:
             progress = ''
 
-        if not (self.config.quiet_mode and self.config.progress_bar):
-            uprint('%s*** %s ***%s%s' % (t_bold, msg, progress, t_reset))
-        else:
-            progress_percent = 1.0 * (module_num-1) / len(self.modulelist)
-            self.display_status_line(progress_percent, module_num, msg)
+        jobs = ''
+        if self.jobserver is not None:
+            in_use = self.jobserver.tokens_in_use()
+            if in_use is not None:
+                jobs = ' ' + _('(%(used)d/%(jobs)d jobs)') % {
+                        'used': in_use, 'jobs': self.jobserver.jobs}
+
+        with self.output_lock:
+            if not (self.config.quiet_mode and self.config.progress_bar):
+                # the number of jobs in use is only worth printing when
+                # several modules are built at the same time.
+                uprint('%s*** %s ***%s%s%s' % (t_bold, msg, progress,
+                        jobs if self.module_jobs > 1 else '', t_reset))
+            else:
+                progress_percent = 1.0 * (module_num-1) / len(self.modulelist)
+                self.display_status_line(progress_percent, module_num, msg)
 
-        if is_xterm:
-            uprint('\033]0;jhbuild:%s%s\007' % (msg, progress), end='', file=sys.stdout)
-            sys.stdout.flush()
-        self.trayicon.set_tooltip('%s%s' % (msg, progress))
+            if is_xterm:
+                uprint('\033]0;jhbuild:%s%s%s\007' % (msg, progress, jobs), end='', file=sys.stdout)
+                sys.stdout.flush()
+        self.trayicon.set_tooltip('%s%s%s' % (msg, progress, jobs))
 
     def set_action(self, action, module, module_num=-1, action_target=None):
         if module_num == -1:
@@ -194,10 +212,19 @@ class TerminalBuildScript(buildscript.BuildScript):
             # see https://bugzilla.gnome.org/show_bug.cgi?id=670349 
             hint = None
 
+        # while modules are built concurrently their output is held back
+        # and displayed, module by module, as each one ends.
+        held_output = self.module_output
+        capture_output = self.config.quiet_mode or held_output is not None
+
         if not self.config.quiet_mode:
             if self.config.print_command_pattern:
                 try:
-                    print(self.config.print_command_pattern % print_args)
+                    if held_output is not None:
+                        held_output.append(self.config.print_command_pattern
+                                           % print_args + '\n')
+                    else:
+                        print(self.config.print_command_pattern % print_args)
                 except TypeError as e:
                     raise FatalError('\'print_command_pattern\' %s' % e)
                 except KeyError as e:
@@ -215,7 +242,7 @@ class TerminalBuildScript(buildscript.BuildScript):
             kws['stdout'] = None
             kws['stderr'] = None
 
-        if self.config.quiet_mode:
+        if capture_output:
             kws['stdout'] = subprocess.PIPE
             kws['stderr'] = subprocess.STDOUT
 
@@ -233,7 +260,10 @@ class TerminalBuildScript(buildscript.BuildScript):
         except OSError as e:
             raise CommandError(str(e))
 
-        output = []
+        if held_output is not None:
+            output = held_output
+        else:
+            output = []
         if hint in ('cvs', 'svn', 'hg-update.py'):
             conflicts = []
 
@@ -241,7 +271,7 @@ class TerminalBuildScript(buildscript.BuildScript):
                 if line.startswith('C '):
                     conflicts.append(line)
 
-                if self.config.quiet_mode:
+                if capture_output:
                     output.append(line)
                     return
 
@@ -259,14 +289,15 @@ class TerminalBuildScript(buildscript.BuildScript):
 
             cmds.pprint_output(p, format_line)
             if conflicts:
-                uprint(_('\nConflicts during checkout:\n'))
-                for line in conflicts:
-                    sys.stdout.write('%s  %s%s\n'
-                                     % (t_colour[12], line, t_reset))
+                with self.output_lock:
+                    uprint(_('\nConflicts during checkout:\n'))
+                    for line in conflicts:
+                        sys.stdout.write('%s  %s%s\n'
+                                         % (t_colour[12], line, t_reset))
                 # make sure conflicts fail
                 if p.returncode == 0 and hint == 'cvs':
                     p.returncode = 1
-        elif self.config.quiet_mode:
+        elif capture_output:
             def format_line(line, error_output, output = output):
                 output.append(line)
             cmds.pprint_output(p, format_line)
@@ -281,7 +312,7 @@ class TerminalBuildScript(buildscript.BuildScript):
                     pass
         try:
             if p.wait() != 0:
-                if self.config.quiet_mode:
+                if self.config.quiet_mode and held_output is None:
                     print(''.join(output))
                 raise CommandError(_('########## Error running %s')
                                    % print_args['command'], p.returncode)
@@ -292,6 +323,25 @@ class TerminalBuildScript(buildscript.BuildScript):
 
     def start_module(self, module):
         self.triedcheckout = None
+        if self.module_jobs > 1:
+            self.module_output = []
+
+    def end_module(self, module, failed):
+        if self.module_jobs > 1:
+            self.flush_module_output(module, failed)
+            self.module_output = None
+
+    def flush_module_output(self, module, failed=False):
+        '''Display the output held back for a module built concurrently
+        with others.  In quiet mode it is only displayed on failure.'''
+        output = self.module_output
+        if not output or (self.config.quiet_mode and not failed):
+            return
+        with self.output_lock:
+            uprint('%s*** %s ***%s' % (t_bold, _('Output of %s') % module, t_reset))
+            uprint(''.join(output), end='')
+            sys.stdout.flush()
+        del output[:]
 
     def start_phase(self, module, phase):
         self.notify.clear()
@@ -319,6 +369,8 @@ class TerminalBuildScript(buildscript.BuildScript):
         '''handle error during build'''
         summary = _('Error during phase %(phase)s of %(module)s') % {
             'phase': phase, 'module':module.name}
+        if self.module_output is not None:
+            self.flush_module_output(module.name, failed=True)
         try:
             error_message = error.args[0]
             self.message('%s: %s' % (summary, error_message))
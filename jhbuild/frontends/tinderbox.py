@@ -22,6 +22,7 @@ import time
 import subprocess
 import logging
 import sys
+import threading
 
 from jhbuild.utils import cmds
 from jhbuild.utils import sysid, _, open_text
@@ -142,13 +143,35 @@ class LoggingFormatter(logging.Formatter):
         logging.Formatter.__init__(self, '<div class="%(levelname)s">'
                                    '%(message)s</div>')
 
+class ModuleLogStream:
+    '''File-like object sending log messages to the build log of the
+    module being built by the current thread.'''
+
+    def __init__(self, buildscript):
+        self.buildscript = buildscript
+
+    def write(self, data):
+        if self.buildscript.modulefp:
+            self.buildscript.modulefp.write(data)
+
+    def flush(self):
+        if self.buildscript.modulefp:
+            self.buildscript.modulefp.flush()
+
 class TinderboxBuildScript(buildscript.BuildScript):
-    triedcheckout = None
+    supports_parallel_modules = True
+
+    triedcheckout = buildscript.per_module_attribute()
+    modulefp = buildscript.per_module_attribute()
+    modulefilename = buildscript.per_module_attribute()
+    # summary table row of the current module, only written to the index
+    # once the module is done when several modules are built concurrently
+    indexrow = buildscript.per_module_attribute()
 
     def __init__(self, config, module_list, module_set=None):
         buildscript.BuildScript.__init__(self, config, module_list, module_set=module_set)
         self.indexfp = None
-        self.modulefp = None
+        self.index_lock = threading.Lock()
 
         for handle in logging.getLogger().handlers:
             handle.setFormatter(LoggingFormatter())
@@ -305,20 +328,29 @@ class TinderboxBuildScript(buildscript.BuildScript):
         self.indexfp.close()
         self.indexfp = None
 
+    def write_index(self, data):
+        if self.indexrow is not None:
+            self.indexrow.append(data)
+            return
+        self.indexfp.write(data)
+        self.indexfp.flush()
+
     def start_module(self, module):
         self.modulefilename='%s.html' % module.replace('/','_')
-        self.indexfp.write('<tr>'
-                           '<td>%s</td>'
-                           '<td><a href="%s">%s</a></td>'
-                           '<td>\n' % (self.timestamp(), self.modulefilename,
-                                       module))
+        if self.module_jobs > 1:
+            self.indexrow = []
+        self.write_index('<tr>'
+                         '<td>%s</td>'
+                         '<td><a href="%s">%s</a></td>'
+                         '<td>\n' % (self.timestamp(), self.modulefilename,
+                                     module))
         self.modulefp = open_text(
                 os.path.join(self.outputdir, self.modulefilename), 'w',
                 encoding='utf-8', errors='xmlcharrefreplace')
 
         for handle in logging.getLogger().handlers:
             if isinstance(handle, logging.StreamHandler):
-                handle.stream = self.modulefp
+                handle.stream = ModuleLogStream(self)
 
         self.modulefp.write(buildlog_header % { 'module': module,
                                                 'charset': 'UTF-8' })
@@ -330,7 +362,7 @@ class TinderboxBuildScript(buildscript.BuildScript):
         self.modulefp.write(buildlog_footer)
         self.modulefp.close()
         self.modulefp = None
-        self.indexfp.write('</td>\n')
+        self.write_index('</td>\n')
         if failed:
             help_html = ''
             if self.config.help_website and self.config.help_website[1]:
@@ -346,23 +378,31 @@ class TinderboxBuildScript(buildscript.BuildScript):
                                         '\'help_website\'',
                                         'key' : e}))
 
-            self.indexfp.write('<td class="failure">failed%s</td>\n' %
-                               help_html)
+            self.write_index('<td class="failure">failed%s</td>\n' %
+                             help_html)
         else:
-            self.indexfp.write('<td class="success">ok</td>\n')
-        self.indexfp.write('</tr>\n\n')
-        self.indexfp.flush()
+            summary = self.get_compiler_cache_summary(module)
+            if summary:
+                self.write_index('<td class="success">ok (%s)</td>\n' %
+                                 escape(summary))
+            else:
+                self.write_index('<td class="success">ok</td>\n')
+        self.write_index('</tr>\n\n')
+        if self.indexrow is not None:
+            with self.index_lock:
+                self.indexfp.write(''.join(self.indexrow))
+                self.indexfp.flush()
+            self.indexrow = None
 
     def start_phase(self, module, phase):
         self.modulefp.write('<a name="%s"></a>\n' % phase)
     def end_phase(self, module, phase, error):
         if error:
-            self.indexfp.write('<a class="failure" title="%s" href="%s#%s">%s</a>\n'
-                               % (error, self.modulefilename, phase, phase))
+            self.write_index('<a class="failure" title="%s" href="%s#%s">%s</a>\n'
+                             % (error, self.modulefilename, phase, phase))
         else:
-            self.indexfp.write('<a class="success" href="%s#%s">%s</a>\n'
-                               % (self.modulefilename, phase, phase))
-        self.indexfp.flush()
+            self.write_index('<a class="success" href="%s#%s">%s</a>\n'
+                             % (self.modulefilename, phase, phase))
 
     def handle_error(self, module, phase, nextphase, error, altphases):
         '''handle error during build'''
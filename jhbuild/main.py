@@ -90,6 +90,9 @@ def main(args):
     parser.add_option('--conditions', action='append',
                       dest='conditions', default=[],
                       help=_('modify the condition set'))
+    parser.add_option('--no-moduleset-cache', action='store_false',
+                      dest='moduleset_cache', default=True,
+                      help=_('do not use the cache of parsed modulesets'))
 
     options, args = parser.parse_args(args)
 
@@ -105,6 +108,8 @@ def main(args):
         config.interact = False
     if options.exit_on_error:
         config.exit_on_error = True
+    if not options.moduleset_cache:
+        config.moduleset_cache = False
 
     if not args or args[0][0] == '-':
         command = 'help'
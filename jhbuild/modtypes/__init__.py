@@ -30,11 +30,13 @@ __all__ = [
 import os
 import re
 import shutil
+import stat
+import tarfile
 import logging
 import importlib
 
 from jhbuild.errors import FatalError, CommandError, BuildStateError, \
-             SkipToEnd, UndefinedRepositoryError
+             SkipToPhase, SkipToEnd, UndefinedRepositoryError
 from jhbuild.utils.sxml import sxml
 from jhbuild.utils import inpath, try_import_module, N_, _
 import jhbuild.utils.fileutils as fileutils
@@ -198,7 +200,29 @@ class Package:
 
     @property
     def extra_env(self):
-        return self.config.module_extra_env.get(self.name)
+        extra_env = self.config.module_extra_env.get(self.name)
+        compiler_cache_env = self.get_compiler_cache_env(extra_env)
+        if compiler_cache_env:
+            extra_env = dict(extra_env or {}, **compiler_cache_env)
+        return extra_env
+
+    def get_compiler_cache_env(self, extra_env):
+        '''Return the environment variables having the compilers run
+        through the compiler cache, if the module type supports it.'''
+        return None
+
+    def get_jobserver(self, buildscript, command, tool, args):
+        '''Return the jobserver the given make or ninja command should be
+        a client of, or None if it should manage its own jobs.'''
+        jobserver = buildscript.jobserver
+        if jobserver is None or not self.supports_parallel_build:
+            return None
+        if re.search(r'(^|\s)-j', args):
+            # an explicit job count takes precedence
+            return None
+        if not jobserver.supports(command, tool):
+            return None
+        return jobserver
 
     def get_srcdir(self, buildscript):
         raise NotImplementedError
@@ -217,26 +241,6 @@ class Package:
         os.makedirs(destdir)
         return destdir
 
-    def _clean_la_files_in_dir(self, buildscript, path):
-        for name in os.listdir(path):
-            subpath = os.path.join(path, name)
-            if os.path.isdir(subpath):
-                self._clean_la_files_in_dir(buildscript, subpath)
-            elif name.endswith('.la'):
-                try:
-                    logging.info(_('Deleting .la file: %r') % (subpath, ))
-                    os.unlink(subpath)
-                except OSError:
-                    pass
-
-    def _clean_la_files(self, buildscript, installroot):
-        """This method removes all .la files. See bug 654013."""
-        assert os.path.isabs(installroot)
-        assert os.path.isabs(buildscript.config.prefix)
-        prefixdir = os.path.join(installroot, buildscript.config.prefix[1:])
-        if os.path.isdir(prefixdir):
-            self._clean_la_files_in_dir(self, prefixdir)
-
     def _clean_texinfo_dir_files(self, buildscript, installroot):
         """This method removes GNU Texinfo dir files."""
         assert os.path.isabs(installroot)
@@ -251,59 +255,111 @@ class Package:
                 except OSError:
                     pass
 
-    def _process_install_files(self, installroot, curdir, prefix, errors):
-        """Strip the prefix from all files in the install root, and move
-them into the prefix."""
-        assert os.path.isdir(installroot) and os.path.isabs(installroot)
-        assert os.path.isdir(curdir) and os.path.isabs(curdir)
-        assert os.path.isdir(prefix) and os.path.isabs(prefix)
-
-        if prefix.endswith('/'):
-            prefix = prefix[:-1]
-
+    def _scan_install_tree(self, path, relpath, contents):
+        """Return the tree of the directory at path, as a list of (name,
+        children) tuples, where children is the tree of a subdirectory, or
+        None for other files.
+
+        .la files are deleted (see bug 654013), and the files and empty
+        directories are appended to contents, relative to the root of the
+        scan (with a trailing separator for directories)."""
+        tree = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    num_contents = len(contents)
+                    children = self._scan_install_tree(
+                            entry.path, relpath + entry.name + os.sep, contents)
+                    # Only add if the directory is empty, otherwise, its
+                    # existence is implicit.
+                    if len(contents) == num_contents:
+                        contents.append(relpath + entry.name + os.sep)
+                    tree.append((entry.name, children))
+                elif entry.name.endswith('.la'):
+                    try:
+                        logging.info(_('Deleting .la file: %r') % (entry.path, ))
+                        os.unlink(entry.path)
+                    except OSError:
+                        pass
+                else:
+                    contents.append(relpath + entry.name)
+                    tree.append((entry.name, None))
+        return tree
+
+    def _count_install_tree_files(self, tree):
+        return sum(1 if children is None else self._count_install_tree_files(children)
+                   for name, children in tree)
+
+    def _process_install_files(self, tree, curdir, destdir, errors, preserved=None):
+        """Move the files of tree, as returned by _scan_install_tree for
+curdir, into destdir.  Directories that do not exist yet in destdir are
+moved as a whole.
+
+If preserved is a list, files identical to those already in destdir are
+not moved, so that they keep their modification time, and are appended
+to preserved instead."""
         num_copied = 0
-        names = os.listdir(curdir)
-        for filename in names:
-            src_path = os.path.join(curdir, filename)
-            assert src_path.startswith(installroot)
-            dest_path = src_path[len(installroot):]
+        curdir = os.path.join(curdir, '')
+        destdir = os.path.join(destdir, '')
+        for name, children in tree:
+            src_path = curdir + name
+            dest_path = destdir + name
             try:
-                if os.path.islink(src_path):
-                    linkto = os.readlink(src_path)
-                    if os.path.islink(dest_path) or os.path.isfile(dest_path):
-                        os.unlink(dest_path)
-                    os.symlink(linkto, dest_path)
-                    os.unlink(src_path)
+                if children is None:
+                    if (preserved is not None and
+                            fileutils.identical_files(src_path, dest_path)):
+                        os.unlink(src_path)
+                        preserved.append(dest_path)
+                        continue
+                    fileutils.rename(src_path, dest_path)
                     num_copied += 1
-                elif os.path.isdir(src_path):
-                    if os.path.exists(dest_path):
-                        if not os.path.isdir(dest_path):
-                            os.unlink(dest_path)
-                            os.mkdir(dest_path)
-                    else:
-                        os.mkdir(dest_path)
-                    num_copied += self._process_install_files(installroot,
-                                                              src_path, prefix,
-                                                              errors)
+                    continue
+                try:
+                    dest_is_dir = stat.S_ISDIR(os.stat(dest_path).st_mode)
+                except FileNotFoundError:
+                    dest_is_dir = False
+                if dest_is_dir:
+                    num_copied += self._process_install_files(children, src_path,
+                                                              dest_path, errors,
+                                                              preserved)
                     try:
                         os.rmdir(src_path)
                     except OSError:
                         # files remaining in buildroot, errors reported below
                         pass
                 else:
-                    try:
-                        fileutils.rename(src_path, dest_path)
-                        num_copied += 1
-                    except OSError as e:
-                        errors.append("%s: '%s'" % (str(e), dest_path))
+                    if os.path.lexists(dest_path):
+                        os.unlink(dest_path)
+                    fileutils.rename(src_path, dest_path)
+                    num_copied += self._count_install_tree_files(children)
             except OSError as e:
-                errors.append(str(e))
+                errors.append("%s: '%s'" % (str(e), dest_path))
         return num_copied
 
+    def _check_install_conflicts(self, buildscript, new_contents):
+        """Warn about (or fail on, depending on install_conflict_policy)
+        the files about to be installed that other modules installed
+        already."""
+        # empty directories can be shared
+        conflicts = buildscript.moduleset.packagedb.find_conflicts(self.name,
+                [x for x in new_contents if not x.endswith(os.sep)])
+        if not conflicts:
+            return
+        by_module = {}
+        for filename, modules in conflicts.items():
+            for module in modules:
+                by_module.setdefault(module, []).append(filename)
+        for module, filenames in sorted(by_module.items()):
+            filenames.sort()
+            logging.warning(_('%(num)d files are also installed by %(module)s: %(files)s') % {
+                    'num': len(filenames), 'module': module,
+                    'files': ', '.join(filenames[:5]) + (', ...' if len(filenames) > 5 else '')})
+        if self.config.install_conflict_policy == 'error':
+            raise CommandError(_('Module would overwrite %d files installed by other modules') % len(conflicts))
+
     def process_install(self, buildscript, revision):
         assert self.supports_install_destdir
         destdir = self.get_destdir(buildscript)
-        self._clean_la_files(buildscript, destdir)
         self._clean_texinfo_dir_files(buildscript, destdir)
 
         prefix_without_drive = os.path.splitdrive(buildscript.config.prefix)[1]
@@ -313,13 +369,27 @@ them into the prefix."""
         save_broken_tree = False
         broken_name = destdir + '-broken'
         destdir_prefix = os.path.join(destdir, stripped_prefix)
-        new_contents = fileutils.accumulate_dirtree_contents(destdir_prefix)
+        new_contents = []
         errors = []
+        num_copied = 0
+        if self.config.install_preserve_unchanged:
+            preserved = []
+        else:
+            preserved = None
+        artifact_key = self.get_artifact_key(buildscript)
         if os.path.isdir(destdir_prefix):
+            tree = self._scan_install_tree(destdir_prefix, '', new_contents)
+            self._check_install_conflicts(buildscript, new_contents)
+            if artifact_key and not buildscript.artifact_cache.has(artifact_key):
+                try:
+                    buildscript.artifact_cache.store(artifact_key, destdir)
+                except (OSError, tarfile.TarError) as e:
+                    logging.warning(_('Could not store build artifact: %s') % e)
+                    artifact_key = None
             logging.info(_('Moving temporary DESTDIR %r into build prefix') % (destdir, ))
-            num_copied = self._process_install_files(destdir, destdir_prefix,
+            num_copied = self._process_install_files(tree, destdir_prefix,
                                                      buildscript.config.prefix,
-                                                     errors)
+                                                     errors, preserved)
 
             # Now the destdir should have a series of empty directories:
             # $JHBUILD_PREFIX/_jhbuild/root-foo/$JHBUILD_PREFIX
@@ -368,6 +438,11 @@ them into the prefix."""
             for filename in new_contents:
                 to_delete.discard (os.path.join(self.config.prefix, filename))
 
+            if to_delete:
+                # don't remove files that other modules installed too
+                to_delete.difference_update(
+                        buildscript.moduleset.packagedb.find_conflicts(self.name, to_delete))
+
             if to_delete:
                 # paranoid double-check
                 assert to_delete == set(fileutils.filter_files_by_prefix(self.config, to_delete))
@@ -385,7 +460,8 @@ them into the prefix."""
 
             buildscript.moduleset.packagedb.add(self.name, revision or '',
                                                 new_contents,
-                                                self.configure_cmd)
+                                                self.configure_cmd,
+                                                artifact_key)
 
         if errors:
             raise CommandError(_('Install encountered errors: %(num)d '
@@ -394,6 +470,10 @@ them into the prefix."""
                                {'num'   : len(errors),
                                 'files' : num_copied,
                                 'err'   : '\n  '.join(errors)})
+        elif preserved is not None:
+            logging.info(_('Install complete: %(copied)d files copied, '
+                           '%(preserved)d unchanged files preserved') %
+                         {'copied': num_copied, 'preserved': len(preserved)})
         else:
             logging.info(_('Install complete: %d files copied') %
                          (num_copied, ))
@@ -401,6 +481,84 @@ them into the prefix."""
     def get_revision(self):
         return self.branch.tree_id()
 
+    def get_artifact_config(self, buildscript):
+        '''Return a string describing how the module is configured, that is
+        part of the key of its build artifact, or None if the module type
+        does not support the artifact cache.'''
+        return None
+
+    def get_artifact_key(self, buildscript):
+        '''Return the key of the build artifact of the module in its
+        current state, or None if it cannot be cached.'''
+        if (buildscript.artifact_cache is None or self.branch is None or
+                not self.supports_install_destdir):
+            return None
+        build_config = self.get_artifact_config(buildscript)
+        if build_config is None:
+            return None
+        revision = self.get_revision()
+        if not revision:
+            return None
+        # local changes are not part of the revision
+        if hasattr(self.branch, 'is_dirty') and self.branch.is_dirty():
+            return None
+        packagedb = buildscript.moduleset.packagedb
+        dependencies = []
+        for dep in sorted(set(self.dependencies + self.suggests + self.after)):
+            entry = packagedb.get(dep)
+            if entry is None:
+                dependencies.append((dep, None))
+            elif 'artifact-key' in entry.metadata:
+                dependencies.append((dep, entry.metadata['artifact-key']))
+            else:
+                # not installed from an artifact; any new installation
+                # of the dependency changes the key
+                dependencies.append((dep, [entry.version,
+                                           entry.metadata.get('installed-date')]))
+        return buildscript.artifact_cache.get_key(
+                [self.name, self.type, revision, build_config, self.extra_env,
+                 buildscript.config.prefix, dependencies])
+
+    def may_restore_artifact(self, buildscript):
+        '''Return whether the module may be installed from its build
+        artifact: only when it is to be configured, built and installed,
+        and no other phase needing the build tree is to run.'''
+        phases = buildscript.planned_phases
+        if not phases:
+            return False
+        for phase in ('configure', 'build', 'install'):
+            if phase not in phases:
+                return False
+        if self.skip_phase(buildscript, 'install', 'build'):
+            return False
+        for phase in phases:
+            if phase in ('checkout', 'force_checkout', 'configure', 'clean',
+                         'build', 'install'):
+                continue
+            if not self.skip_phase(buildscript, phase, None):
+                return False
+        return True
+
+    def extract_artifact(self, buildscript):
+        '''Extract the build artifact of the module in its current state,
+        if the artifact cache holds it, for the install phase to install
+        it instead of the files built.  Return whether it was extracted.'''
+        artifact_key = self.get_artifact_key(buildscript)
+        if artifact_key is None or not buildscript.artifact_cache.has(artifact_key):
+            return False
+        buildscript.set_action(_('Restoring build artifact'), self)
+        destdir = self.prepare_installroot(buildscript)
+        if not buildscript.artifact_cache.restore(artifact_key, destdir):
+            return False
+        buildscript.restored_artifact = artifact_key
+        return True
+
+    def install_artifact(self, buildscript):
+        '''Install the build artifact extracted by extract_artifact().'''
+        buildscript.restored_artifact = None
+        buildscript.set_action(_('Installing'), self)
+        self.process_install(buildscript, self.get_revision())
+
     def skip_phase(self, buildscript, phase, last_phase):
         try:
             skip_phase_method = getattr(self, 'skip_' + phase)
@@ -414,7 +572,10 @@ them into the prefix."""
         Returns a tuple of the following form:
           (error-flag, [other-phases])
         """
-        method = getattr(self, 'do_' + phase)
+        if phase == 'install' and buildscript.restored_artifact is not None:
+            method = self.install_artifact
+        else:
+            method = getattr(self, 'do_' + phase)
         try:
             method(buildscript)
         except (CommandError, BuildStateError) as e:
@@ -559,7 +720,12 @@ class NinjaModule(Package):
         cmd = '{ninja} {ninjaargs} {target}'.format(ninja=ninjacmd,
                                                     ninjaargs=ninjaargs,
                                                     target=target)
-        buildscript.execute(cmd, cwd=self.get_builddir(buildscript), extra_env=extra_env)
+        jobserver = self.get_jobserver(buildscript, ninjacmd, 'ninja', ninjaargs)
+        if jobserver is not None:
+            jobserver.run(buildscript, cmd, cwd=self.get_builddir(buildscript),
+                          extra_env=jobserver.get_environment(extra_env))
+        else:
+            buildscript.execute(cmd, cwd=self.get_builddir(buildscript), extra_env=extra_env)
 
 class MakeModule(Package):
     '''A base class for modules that use the command 'make' within the build
@@ -594,14 +760,23 @@ class MakeModule(Package):
     def make(self, buildscript, target='', pre='', makeargs=None):
         makecmd = os.environ.get('MAKE', self.get_makecmd(buildscript.config))
 
+        jobserver = None
         if makeargs is None:
-            makeargs = self.get_makeargs(buildscript)
+            # with a jobserver, make gets its job count from MAKEFLAGS
+            makeargs = self.get_makeargs(buildscript, add_parallel=False)
+            jobserver = self.get_jobserver(buildscript, makecmd, 'make', makeargs)
+            if jobserver is None:
+                makeargs = self.get_makeargs(buildscript)
 
         cmd = '{pre}{make} {makeargs} {target}'.format(pre=pre,
                                                        make=makecmd,
                                                        makeargs=makeargs,
                                                        target=target)
-        buildscript.execute(cmd, cwd = self.get_builddir(buildscript), extra_env = self.extra_env)
+        if jobserver is not None:
+            jobserver.run(buildscript, cmd, cwd=self.get_builddir(buildscript),
+                          extra_env=jobserver.get_environment(self.extra_env))
+        else:
+            buildscript.execute(cmd, cwd = self.get_builddir(buildscript), extra_env = self.extra_env)
 
 class DownloadableModule:
     PHASE_CHECKOUT = 'checkout'
@@ -614,19 +789,24 @@ class DownloadableModule:
     def checkout(self, buildscript):
         srcdir = self.get_srcdir(buildscript)
         buildscript.set_action(_('Checking out'), self)
-        self.branch.checkout(buildscript)
+        if not buildscript.get_prefetched(self):
+            self.branch.checkout(buildscript)
         # did the checkout succeed?
         if not os.path.exists(srcdir):
             raise BuildStateError(_('source directory %s was not created') % srcdir)
 
         if self.check_build_policy(buildscript) == self.PHASE_DONE:
             raise SkipToEnd()
+        if self.may_restore_artifact(buildscript) and self.extract_artifact(buildscript):
+            raise SkipToPhase('install')
 
     def skip_checkout(self, buildscript, last_phase):
         # skip the checkout stage if the nonetwork flag is set
         if not self.branch.may_checkout(buildscript):
             if self.check_build_policy(buildscript) == self.PHASE_DONE:
                 raise SkipToEnd()
+            if self.may_restore_artifact(buildscript) and self.extract_artifact(buildscript):
+                raise SkipToPhase('install')
             return True
         return False
 
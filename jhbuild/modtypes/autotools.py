@@ -29,6 +29,7 @@ from jhbuild.modtypes import \
      DownloadableModule, register_module_type, MakeModule
 from jhbuild.versioncontrol.tarball import TarballBranch
 from jhbuild.utils import _
+from jhbuild.utils import compilercache
 
 __all__ = [ 'AutogenModule' ]
 
@@ -155,6 +156,15 @@ class AutogenModule(MakeModule, DownloadableModule):
         self.configure_cmd = cmd
         return cmd
 
+    def get_compiler_cache_env(self, extra_env):
+        program = compilercache.get_program(self.config)
+        if program is None:
+            return None
+        return compilercache.wrap_compilers(program, extra_env)
+
+    def get_artifact_config(self, buildscript):
+        return self._get_configure_cmd(buildscript)
+
     def skip_configure(self, buildscript, last_phase):
         # skip if manually instructed to do so
         if self.skip_autogen is True:
@@ -27,6 +27,7 @@ from jhbuild.modtypes import \
      Package, DownloadableModule, register_module_type, MakeModule, NinjaModule
 from jhbuild.modtypes.autotools import collect_args
 from jhbuild.utils import inpath, _
+from jhbuild.utils import compilercache
 
 __all__ = [ 'CMakeModule' ]
 
@@ -78,9 +79,31 @@ class CMakeModule(MakeModule, NinjaModule, DownloadableModule):
                               self.name, self.config.cmakeargs))
         return self.eval_args(args)
 
+    def _get_configure_cmd(self, buildscript):
+        srcdir = self.get_srcdir(buildscript)
+        prefix = os.path.expanduser(buildscript.config.prefix)
+        baseargs = '-DCMAKE_INSTALL_PREFIX=%s -DCMAKE_INSTALL_LIBDIR=lib' % prefix
+        cmakeargs = self.get_cmakeargs()
+        if self.use_ninja:
+            baseargs += ' -G Ninja'
+        compiler_cache = compilercache.get_program(self.config)
+        if compiler_cache and 'COMPILER_LAUNCHER' not in cmakeargs:
+            baseargs += (' -DCMAKE_C_COMPILER_LAUNCHER=%s'
+                         ' -DCMAKE_CXX_COMPILER_LAUNCHER=%s' % (compiler_cache,
+                                                               compiler_cache))
+        # CMake on Windows generates VS projects or NMake makefiles by default.
+        # When using MSYS "MSYS Makefiles" is the best guess. "Unix Makefiles"
+        # and "MinGW Makefiles" could also work (each is a bit different).
+        if os.name == 'nt' and os.getenv("MSYSCON") and '-G' not in cmakeargs:
+            baseargs += ' -G "MSYS Makefiles"'
+        cmakedir = os.path.join(srcdir, self.cmakedir) if self.cmakedir else srcdir
+        return 'cmake %s %s %s' % (baseargs, cmakeargs, cmakedir)
+
+    def get_artifact_config(self, buildscript):
+        return self._get_configure_cmd(buildscript)
+
     def do_configure(self, buildscript):
         buildscript.set_action(_('Configuring'), self)
-        srcdir = self.get_srcdir(buildscript)
         builddir = self.get_builddir(buildscript)
         if os.path.exists(builddir):
             try:
@@ -91,20 +114,9 @@ class CMakeModule(MakeModule, NinjaModule, DownloadableModule):
                 pass
         else:
             os.makedirs(builddir)
-        prefix = os.path.expanduser(buildscript.config.prefix)
         if not inpath('cmake', os.environ['PATH'].split(os.pathsep)):
             raise CommandError(_('%s not found') % 'cmake')
-        baseargs = '-DCMAKE_INSTALL_PREFIX=%s -DCMAKE_INSTALL_LIBDIR=lib' % prefix
-        cmakeargs = self.get_cmakeargs()
-        if self.use_ninja:
-            baseargs += ' -G Ninja'
-        # CMake on Windows generates VS projects or NMake makefiles by default.
-        # When using MSYS "MSYS Makefiles" is the best guess. "Unix Makefiles"
-        # and "MinGW Makefiles" could also work (each is a bit different).
-        if os.name == 'nt' and os.getenv("MSYSCON") and '-G' not in cmakeargs:
-            baseargs += ' -G "MSYS Makefiles"'
-        cmakedir = os.path.join(srcdir, self.cmakedir) if self.cmakedir else srcdir
-        cmd = 'cmake %s %s %s' % (baseargs, cmakeargs, cmakedir)
+        cmd = self._get_configure_cmd(buildscript)
         buildscript.execute(cmd, cwd = builddir, extra_env = self.extra_env)
     do_configure.depends = [PHASE_CHECKOUT]
     do_configure.error_phases = [PHASE_FORCE_CHECKOUT]
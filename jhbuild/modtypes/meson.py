@@ -27,6 +27,7 @@ from jhbuild.modtypes import \
      Package, DownloadableModule, register_module_type, NinjaModule
 from jhbuild.modtypes.autotools import collect_args
 from jhbuild.utils import inpath, _
+from jhbuild.utils import compilercache
 
 __all__ = [ 'MesonModule' ]
 
@@ -80,21 +81,38 @@ class MesonModule(NinjaModule, DownloadableModule):
                               self.name, self.config.mesonargs))
         return self.eval_args(args)
 
+    def _get_configure_cmd(self, buildscript):
+        srcdir = self.get_srcdir(buildscript)
+        prefix = os.path.expanduser(buildscript.config.prefix)
+        baseargs = '--prefix %s --libdir %s' % (prefix, self.get_libdir())
+        mesonargs = self.get_mesonargs()
+        return 'meson setup %s %s %s' % (baseargs, mesonargs, srcdir)
+
+    def get_compiler_cache_env(self, extra_env):
+        program = compilercache.get_program(self.config)
+        if program is None:
+            return None
+        if program == 'ccache' and not ((extra_env or {}).get('CC') or
+                                        os.environ.get('CC')):
+            # meson finds and uses ccache by itself with the default
+            # compilers
+            return None
+        return compilercache.wrap_compilers(program, extra_env)
+
+    def get_artifact_config(self, buildscript):
+        return self._get_configure_cmd(buildscript)
+
     def do_configure(self, buildscript):
         buildscript.set_action(_('Configuring'), self)
-        srcdir = self.get_srcdir(buildscript)
         builddir = self.get_builddir(buildscript)
         # meson does not allow configuring if the builddir already exists,
         # so we'll need to get rid of it and start over to configure again.
         if os.path.exists(builddir):
             shutil.rmtree(builddir)
         os.makedirs(builddir)
-        prefix = os.path.expanduser(buildscript.config.prefix)
         if not inpath('meson', os.environ['PATH'].split(os.pathsep)):
             raise CommandError(_('%s not found') % 'meson')
-        baseargs = '--prefix %s --libdir %s' % (prefix, self.get_libdir())
-        mesonargs = self.get_mesonargs()
-        cmd = 'meson setup %s %s %s' % (baseargs, mesonargs, srcdir)
+        cmd = self._get_configure_cmd(buildscript)
         buildscript.execute(cmd, cwd=builddir, extra_env=self.extra_env)
     do_configure.depends = [PHASE_CHECKOUT]
     do_configure.error_phases = [PHASE_FORCE_CHECKOUT]
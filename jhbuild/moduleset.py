@@ -18,11 +18,13 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 import fnmatch
+import hashlib
 import os
+import pickle
 import sys
 import logging
 from urllib.parse import urlparse, urljoin
-import xml.dom.minidom
+import xml.dom
 import xml.parsers.expat
 
 from jhbuild.utils import _
@@ -39,6 +41,7 @@ from jhbuild.versioncontrol.tarball import TarballBranch
 from jhbuild.versioncontrol.git import GitBranch
 from jhbuild.utils import systeminstall
 from jhbuild.utils import fileutils
+import jhbuild.config
 
 __all__ = ['load', 'load_tests', 'get_default_repo']
 
@@ -67,19 +70,21 @@ class ModuleSet:
         self.config = config
         self.modules = {}
         self.raise_exception_on_warning=False
+        self._rdepends_index = {}
 
         if db is None:
             legacy_pkgdb_path = os.path.join(self.config.prefix, 'share', 'jhbuild', 'packagedb.xml')
             new_pkgdb_path = os.path.join(self.config.top_builddir, 'packagedb.xml')
             if os.path.isfile(legacy_pkgdb_path):
                 fileutils.rename(legacy_pkgdb_path, new_pkgdb_path)
-            self.packagedb = packagedb.PackageDB(new_pkgdb_path, config)
+            self.packagedb = packagedb.open_packagedb(new_pkgdb_path, config)
         else:
             self.packagedb = db
 
     def add(self, module):
         '''add a Module object to this set of modules'''
         self.modules[module.name] = module
+        self._rdepends_index = {}
 
     def get_module(self, module_name, ignore_case = False):
         module_name = module_name.rstrip(os.sep)
@@ -107,14 +112,38 @@ class ModuleSet:
                              include_suggests=True, include_afters=False,
                              warn_about_circular_dependencies=True):
 
+        skipped = {}
+
         def skip_module(module):
             # '*' has special meaning which overrides any other values
             if skip and '*' not in skip:
-                if any(fnmatch.fnmatch(module, exp) for exp in skip):
-                    return True
+                if module not in skipped:
+                    skipped[module] = any(fnmatch.fnmatch(module, exp)
+                                          for exp in skip)
+                return skipped[module]
             return False
 
-        def dep_resolve(node, resolved, seen, after):
+        # build order, as a list of [module, after] items, where after is
+        # True for modules only pulled by an <after/> relation; index maps
+        # modules to their item.
+        resolved = []
+        index = {}
+        # modules are stamped with the value of a counter when they get a
+        # non-<after/> item, so that the set of such modules at a given
+        # point of the search can be known from the value of the counter
+        # at that point.
+        clock = [0]
+        resolved_since = {}
+
+        def add_resolved(module, after):
+            item = [module, after]
+            index[module] = item
+            resolved.append(item)
+            if not after:
+                clock[0] += 1
+                resolved_since[module] = clock[0]
+
+        def dep_resolve(node, seen, seen_set, after):
             ''' Recursive depth-first search of the dependency tree. Creates
             the build order into the list 'resolved'. <after/> modules are
             added to the dependency tree but flagged. When search finished
@@ -122,24 +151,25 @@ class ModuleSet:
             '''
             circular = False
             seen.append(node)
+            seen_set.add(node)
             if include_suggests:
                 edges = node.dependencies + node.suggests + node.after
             else:
                 edges = node.dependencies + node.after
             # do not include <after> modules because a previous visited <after>
             # module may later be a hard dependency
-            resolved_deps = [module for module, after_module in resolved \
-                             if not after_module]
+            resolved_deps_clock = clock[0]
             for edge_name in edges:
                 edge = self.modules.get(edge_name)
                 if edge is None:
-                    if node not in [i[0] for i in resolved]:
+                    if node not in index:
                         self._warn(_('%(module)s has a dependency on unknown'
                                      ' "%(invalid)s" module') % \
                                    {'module'  : node.name,
                                     'invalid' : edge_name})
-                elif not skip_module(edge_name) and edge not in resolved_deps:
-                    if edge in seen:
+                elif not skip_module(edge_name) and \
+                        resolved_since.get(edge, resolved_deps_clock + 1) > resolved_deps_clock:
+                    if edge in seen_set:
                         # circular dependency detected
                         circular = True
                         if self.raise_exception_on_warning:
@@ -153,26 +183,27 @@ class ModuleSet:
                         break
                     else:
                         if edge_name in node.after:
-                            dep_resolve(edge, resolved, seen, True)
+                            dep_resolve(edge, seen, seen_set, True)
                         elif edge_name in node.suggests:
-                            dep_resolve(edge, resolved, seen, after)
+                            dep_resolve(edge, seen, seen_set, after)
                         elif edge_name in node.dependencies:
-                            dep_resolve(edge, resolved, seen, after)
+                            dep_resolve(edge, seen, seen_set, after)
                             # hard dependency may be missed if a cyclic
                             # dependency. Add it:
-                            if edge not in [i[0] for i in resolved]:
-                                resolved.append((edge, after))
+                            if edge not in index:
+                                add_resolved(edge, after)
 
-            seen.remove(node)
+            seen.pop()
+            seen_set.discard(node)
 
             if not circular:
-                if node not in [i[0] for i in resolved]:
-                    resolved.append((node, after))
-                elif not after:
+                if node not in index:
+                    add_resolved(node, after)
+                elif not after and index[node][1] is True:
                     # a dependency exists for an after, flag to keep
-                    for index, item in enumerate(resolved):
-                        if item[1] is True and item[0] == node:
-                            resolved[index] = (node, False)
+                    index[node][1] = False
+                    clock[0] += 1
+                    resolved_since[node] = clock[0]
 
         config_modules = getattr(self.config, 'modules', [])
 
@@ -185,9 +216,8 @@ class ModuleSet:
         except KeyError as e:
             raise UsageError(_("A module called '%s' could not be found.") % e)
 
-        resolved = []
         for module in modules:
-            dep_resolve(module, resolved, [], False)
+            dep_resolve(module, [], set(), False)
 
         if include_afters:
             module_list = [module[0] for module in resolved]
@@ -201,6 +231,44 @@ class ModuleSet:
 
         return module_list
 
+    def get_reverse_dependencies_index(self, include_suggests=True):
+        '''Return a dictionary mapping module names to the set of names of
+        the modules directly depending on them.
+
+        The index is computed once, and is only updated when modules are
+        added with add().'''
+        if include_suggests not in self._rdepends_index:
+            index = {}
+            for module in self.modules.values():
+                edges = module.dependencies
+                if include_suggests:
+                    edges = edges + module.suggests
+                for edge_name in edges:
+                    index.setdefault(edge_name, set()).add(module.name)
+            self._rdepends_index[include_suggests] = index
+        return self._rdepends_index[include_suggests]
+
+    def get_reverse_dependencies(self, module_names, include_suggests=True,
+                                 direct=False):
+        '''Return the set of names of the modules depending on any of the
+        given modules, directly, or through other modules unless direct is
+        set. Soft dependencies are followed when include_suggests is set;
+        <after/> relations are never followed.
+
+        This is, for example, the set of modules to rebuild after a change
+        to the given modules.'''
+        index = self.get_reverse_dependencies_index(include_suggests)
+        rdepends = set()
+        queue = list(module_names)
+        while queue:
+            module_name = queue.pop()
+            for rdep in index.get(module_name, ()):
+                if rdep not in rdepends:
+                    rdepends.add(rdep)
+                    if not direct:
+                        queue.append(rdep)
+        return rdepends - set(module_names)
+
     def get_test_module_list (self, seed, skip=[]):
         test_modules = []
         if seed == []:
@@ -358,13 +426,15 @@ class ModuleSet:
 
 
 def load(config, uri=None):
+    global _default_repo
+
     if uri is not None:
         modulesets = [ uri ]
     elif type(config.moduleset) in (list, tuple):
         modulesets = config.moduleset
     else:
         modulesets = [ config.moduleset ]
-    ms = ModuleSet(config = config)
+    uris = []
     for uri in modulesets:
         if os.path.isabs(uri):
             pass
@@ -377,7 +447,24 @@ def load(config, uri=None):
         elif not urlparse(uri)[0]:
             uri = 'https://gitlab.gnome.org/GNOME/jhbuild/raw/master/modulesets' \
                   '/%s.modules' % uri
-        ms.modules.update(_parse_module_set(config, uri).modules)
+        uris.append(uri)
+
+    ms = ModuleSet(config = config)
+    cache = None
+    if getattr(config, 'moduleset_cache', False):
+        cache = ModuleSetCache(config, uris)
+    cached = cache.load() if cache else None
+    if cached is not None:
+        modules, default_repo = cached
+        ms.modules.update(modules)
+        if default_repo:
+            _default_repo = default_repo
+    else:
+        sources = []
+        for uri in uris:
+            ms.modules.update(_parse_module_set(config, uri, sources).modules)
+        if cache:
+            cache.save(ms.modules, _default_repo, sources)
 
     # create virtual sysdeps
     system_repo_class = get_repo_type('system')
@@ -411,72 +498,205 @@ def _child_elements_matching(parent, names):
         if node.nodeType == node.ELEMENT_NODE and node.nodeName in names:
             yield node
 
-def _handle_conditions(config, element):
-    """
-    If we encounter an <if> tag, consult the conditions set in the config
-    in order to decide if we should include its content or not.  If the
-    condition is met, the child elements are added to the parent of the
-    <if/> tag as if the condition tag were not there at all.  If the
-    condition is not met, the entire content is simply dropped.
+class _Text:
+    """A text node, with the subset of the xml.dom interface used by the
+    module type parsers."""
+
+    __slots__ = ('data',)
+
+    ELEMENT_NODE = xml.dom.Node.ELEMENT_NODE
+    TEXT_NODE = xml.dom.Node.TEXT_NODE
+    nodeType = TEXT_NODE
+    nodeName = '#text'
+    childNodes = ()
+
+    def __init__(self, data):
+        self.data = data
+
+    @property
+    def nodeValue(self):
+        return self.data
+
+class _Element:
+    """An element node, with the subset of the xml.dom interface used by
+    the module type parsers."""
+
+    __slots__ = ('nodeName', 'attributes', 'childNodes', 'conditions')
+
+    ELEMENT_NODE = xml.dom.Node.ELEMENT_NODE
+    TEXT_NODE = xml.dom.Node.TEXT_NODE
+    nodeType = ELEMENT_NODE
+
+    def __init__(self, name, attributes):
+        self.nodeName = name
+        self.attributes = attributes
+        self.childNodes = []
+        # <if> elements whose condition is met
+        self.conditions = None
+
+    @property
+    def tagName(self):
+        return self.nodeName
+
+    def getAttribute(self, name):
+        return self.attributes.get(name, '')
+
+    def hasAttribute(self, name):
+        return name in self.attributes
+
+    def getElementsByTagName(self, name):
+        elements = []
+        for node in _child_elements(self):
+            if name in ('*', node.nodeName):
+                elements.append(node)
+            elements.extend(node.getElementsByTagName(name))
+        return elements
+
+    def normalize(self):
+        children = []
+        for node in self.childNodes:
+            if (node.nodeType == node.TEXT_NODE and children and
+                    children[-1].nodeType == node.TEXT_NODE):
+                children[-1] = _Text(children[-1].data + node.data)
+            elif node.nodeType != node.TEXT_NODE or node.data:
+                children.append(node)
+        self.childNodes[:] = children
+
+class _Condition:
+    """The content of an <if> element whose condition is met."""
+
+    __slots__ = ('childNodes',)
+
+    def __init__(self):
+        self.childNodes = []
 
-    We do the processing as a transformation on the DOM as a whole,
-    immediately after parsing the moduleset XML, before doing any additional
-    processing.  This allows <if> to be used for anything and it means we
-    don't need to deal with it separately from each place.
+class _ModuleSetReader:
+    """Read a moduleset file with expat into a tree of _Element nodes.
+
+    <if> elements are evaluated as they are read, consulting the
+    conditions set in the config: if the condition is met, the child
+    elements are added to the parent of the <if/> tag, after its other
+    children, as if the condition tag were not there at all.  If the
+    condition is not met, the entire content is simply skipped.
+
+    This allows <if> to be used for anything and it means we don't need
+    to deal with it separately from each place.
 
     Although the tool itself will accept <if> anywhere we use the schemas to
     restrict its use to the purposes of conditionalising dependencies
     (including suggests) and {autogen,make,makeinstall}args.
     """
 
-    for condition_tag in _child_elements_matching(element, ['if']):
-        # In all cases, we remove the element from the parent
-        element.childNodes.remove(condition_tag)
-
-        # grab the condition from the attributes
-        c_if = condition_tag.getAttribute('condition-set')
-        c_unless = condition_tag.getAttribute('condition-unset')
-
-        if (not c_if) == (not c_unless):
-            raise FatalError(_("<if> must have exactly one of condition-set='' or condition-unset=''"))
-
-        # check the condition
-        condition_true = ((c_if and c_if in config.conditions) or
-                          (c_unless and c_unless not in config.conditions))
+    def __init__(self, config):
+        self.config = config
+        self.root = None
+        self.stack = []
+        # depth inside an <if> element whose condition is not met
+        self.skipped = 0
+
+    def read(self, filename):
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.CharacterDataHandler = self.character_data
+        with open(filename, 'rb') as fp:
+            parser.ParseFile(fp)
+        return self.root
+
+    def start_element(self, name, attributes):
+        if self.skipped:
+            self.skipped += 1
+            return
+        if not self.stack:
+            self.root = _Element(name, attributes)
+            self.stack.append(self.root)
+            return
 
-        if condition_true:
-            # add the child elements of <condition> back into the parent
-            for condition_child in _child_elements(condition_tag):
-                element.childNodes.append(condition_child)
+        parent = self.stack[-1]
+        if name == 'if':
+            # grab the condition from the attributes
+            c_if = attributes.get('condition-set')
+            c_unless = attributes.get('condition-unset')
+
+            if (not c_if) == (not c_unless):
+                raise FatalError(_("<if> must have exactly one of condition-set='' or condition-unset=''"))
+
+            # check the condition
+            condition_true = ((c_if and c_if in self.config.conditions) or
+                              (c_unless and c_unless not in self.config.conditions))
+            if not condition_true:
+                self.skipped = 1
+                return
+            node = _Condition()
+            if isinstance(parent, _Condition):
+                parent.childNodes.append(node)
+            else:
+                if parent.conditions is None:
+                    parent.conditions = []
+                parent.conditions.append(node)
+        else:
+            node = _Element(name, attributes)
+            parent.childNodes.append(node)
+        self.stack.append(node)
 
-    # now, recurse
-    for c in _child_elements(element):
-        _handle_conditions(config, c)
+    def end_element(self, name):
+        if self.skipped:
+            self.skipped -= 1
+            return
+        node = self.stack.pop()
+        if isinstance(node, _Condition) or not node.conditions:
+            return
+        # the content of <if> elements goes after the other children, in
+        # breadth-first order for nested <if> elements.
+        conditions = node.conditions
+        node.conditions = None
+        for condition in conditions:
+            for child in condition.childNodes:
+                if isinstance(child, _Condition):
+                    conditions.append(child)
+                else:
+                    node.childNodes.append(child)
+
+    def character_data(self, data):
+        if self.skipped or len(self.stack) < 2:
+            # text at the top level of the moduleset is never used
+            return
+        parent = self.stack[-1]
+        if isinstance(parent, _Condition):
+            return
+        children = parent.childNodes
+        if children and children[-1].nodeType == _Text.TEXT_NODE:
+            children[-1].data += data
+        else:
+            children.append(_Text(data))
 
-def _parse_module_set(config, uri):
+def _parse_module_set(config, uri, sources=None):
+    '''Parse the moduleset at uri; the (uri, filename) pairs of the files
+    that are read are appended to sources, if given.'''
     try:
         filename = httpcache.load(uri, nonetwork=config.nonetwork, age=0)
     except Exception as e:
         raise FatalError(_('could not download %s: %s') % (uri, e))
     filename = os.path.normpath(filename)
+    if sources is not None:
+        sources.append((uri, filename))
     try:
-        document = xml.dom.minidom.parse(filename)
+        root = _ModuleSetReader(config).read(filename)
     except IOError as e:
         raise FatalError(_('failed to parse %s: %s') % (filename, e))
     except xml.parsers.expat.ExpatError as e:
         raise FatalError(_('failed to parse %s: %s') % (uri, e))
 
-    assert document.documentElement.nodeName == 'moduleset'
+    assert root.nodeName == 'moduleset'
 
-    for node in _child_elements_matching(document.documentElement, ['redirect']):
+    for node in _child_elements_matching(root, ['redirect']):
         new_url = node.getAttribute('href')
         logging.info('moduleset is now located at %s', new_url)
-        return _parse_module_set(config, new_url)
-
-    _handle_conditions(config, document.documentElement)
+        return _parse_module_set(config, new_url, sources)
 
     moduleset = ModuleSet(config = config)
-    moduleset_name = document.documentElement.getAttribute('name')
+    moduleset_name = root.getAttribute('name')
     if not moduleset_name:
         moduleset_name = os.path.basename(uri)
         if moduleset_name.endswith('.modules'):
@@ -486,8 +706,8 @@ def _parse_module_set(config, uri):
     repositories = {}
     default_repo = None
     for node in _child_elements_matching(
-            document.documentElement, ['repository', 'cvsroot', 'svnroot',
-                                       'arch-archive']):
+            root, ['repository', 'cvsroot', 'svnroot',
+                   'arch-archive']):
         name = node.getAttribute('name')
         if node.getAttribute('default') == 'yes':
             default_repo = name
@@ -533,12 +753,12 @@ def _parse_module_set(config, uri):
                                            archive=name, href=archive_uri)
 
     # and now module definitions
-    for node in _child_elements(document.documentElement):
+    for node in _child_elements(root):
         if node.nodeName == 'include':
             href = node.getAttribute('href')
             inc_uri = urljoin(uri, href)
             try:
-                inc_moduleset = _parse_module_set(config, inc_uri)
+                inc_moduleset = _parse_module_set(config, inc_uri, sources)
             except UndefinedRepositoryError:
                 raise
             except FatalError as e:
@@ -547,7 +767,7 @@ def _parse_module_set(config, uri):
                 # look up in local modulesets
                 inc_uri = os.path.join(os.path.dirname(__file__), '..', 'modulesets',
                                    href)
-                inc_moduleset = _parse_module_set(config, inc_uri)
+                inc_moduleset = _parse_module_set(config, inc_uri, sources)
 
             moduleset.modules.update(inc_moduleset.modules)
         elif node.nodeName in ['repository', 'cvsroot', 'svnroot',
@@ -568,6 +788,123 @@ def _parse_module_set(config, uri):
 
     return moduleset
 
+def _stable_repr(value):
+    """Return a representation of value that does not depend on the
+    iteration order of sets and dictionaries."""
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join(sorted('%s: %s' % (_stable_repr(k), _stable_repr(v))
+                                         for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return '{%s}' % ', '.join(sorted(_stable_repr(x) for x in value))
+    if isinstance(value, (list, tuple)):
+        return '[%s]' % ', '.join(_stable_repr(x) for x in value)
+    return repr(value)
+
+class ModuleSetCache:
+    """Cache of the modules parsed from a list of modulesets.
+
+    The modules are stored pickled, along with the content hashes of the
+    files they were parsed from (including <include>d modulesets).  An
+    entry is looked up from the moduleset URIs, the configuration (which
+    includes the active conditions), and the jhbuild source files; it is
+    only used if the moduleset files, after being refreshed as usual, are
+    unchanged.
+    """
+
+    version = 1
+    max_entries = 16
+
+    def __init__(self, config, uris):
+        self.config = config
+        self.uris = uris
+        self.cachedir = os.path.join(config.xdg_cache_home, 'jhbuild', 'modulesets')
+        key = hashlib.sha256()
+        key.update(_stable_repr([self.version, uris, sorted(config.conditions),
+                                 self.get_config_fingerprint(),
+                                 self.get_source_fingerprint()]).encode('utf-8'))
+        self.filename = os.path.join(self.cachedir, key.hexdigest() + '.pickle')
+
+    def get_config_fingerprint(self):
+        return [(key, getattr(self.config, key, None))
+                for key in sorted(jhbuild.config._known_keys)]
+
+    def get_source_fingerprint(self):
+        """Return the sizes and modification times of the jhbuild source
+        files, so that cached modules are not used with other code."""
+        fingerprint = []
+        topdir = os.path.dirname(os.path.abspath(__file__))
+        for dirpath, dirnames, filenames in os.walk(topdir):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.endswith('.py'):
+                    st = os.stat(os.path.join(dirpath, name))
+                    fingerprint.append((name, st.st_size, st.st_mtime_ns))
+        return fingerprint
+
+    def get_file_hash(self, filename):
+        with open(filename, 'rb') as fp:
+            return hashlib.sha256(fp.read()).hexdigest()
+
+    def persistent_id(self, obj):
+        # the configuration is not part of the cache, it is the one in use
+        # when the cache is loaded.
+        if obj is self.config:
+            return 'config'
+        return None
+
+    def persistent_load(self, pid):
+        if pid == 'config':
+            return self.config
+        raise pickle.UnpicklingError('unknown persistent id %r' % pid)
+
+    def load(self):
+        """Return a (modules, default repository) tuple from the cache, or
+        None if there is no valid entry."""
+        try:
+            with open(self.filename, 'rb') as fp:
+                sources = pickle.load(fp)
+                for uri, digest in sources:
+                    filename = httpcache.load(uri, nonetwork=self.config.nonetwork, age=0)
+                    if self.get_file_hash(filename) != digest:
+                        return None
+                unpickler = pickle.Unpickler(fp)
+                unpickler.persistent_load = self.persistent_load
+                return unpickler.load()
+        except Exception as e:
+            if not isinstance(e, FileNotFoundError):
+                logging.debug('ignoring moduleset cache %s: %s', self.filename, e)
+            return None
+
+    def save(self, modules, default_repo, sources):
+        try:
+            sources = [(uri, self.get_file_hash(filename))
+                       for uri, filename in sources]
+            fileutils.mkdir_with_parents(self.cachedir)
+            writer = fileutils.SafeWriter(self.filename)
+            try:
+                pickle.dump(sources, writer.fp, pickle.HIGHEST_PROTOCOL)
+                pickler = pickle.Pickler(writer.fp, pickle.HIGHEST_PROTOCOL)
+                pickler.persistent_id = self.persistent_id
+                pickler.dump((modules, default_repo))
+            except Exception:
+                writer.abandon()
+                raise
+            writer.commit()
+            self.prune()
+        except Exception as e:
+            logging.debug('could not write moduleset cache %s: %s', self.filename, e)
+
+    def prune(self):
+        """Remove the least recently written entries."""
+        entries = [os.path.join(self.cachedir, x) for x in os.listdir(self.cachedir)
+                   if x.endswith('.pickle')]
+        entries.sort(key=os.path.getmtime)
+        for filename in entries[:-self.max_entries]:
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+
 def warn_local_modulesets(config):
     if config.use_local_modulesets:
         return
@@ -0,0 +1,152 @@
+# jhbuild - a tool to ease building collections of source packages
+# Copyright (C) 2026  The jhbuild authors
+#
+#   artifactcache.py: a cache of the files installed by modules
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''A content-addressed cache of build artifacts.
+
+An artifact is a compressed tarball of the DESTDIR a module installed
+into.  It is stored under a key that is a hash of everything the build
+depends on: the source tree, the configure command, the environment and
+the artifacts the dependencies were installed from.  When a module is
+about to be built with the same key, the artifact is installed instead.
+
+The cache is bounded in size; the least recently used artifacts are
+removed first (the modification time of an artifact is updated when it
+is used, as access times are often not maintained).
+'''
+
+import hashlib
+import json
+import logging
+import os
+import tarfile
+import threading
+import zlib
+
+from jhbuild.utils import _
+from jhbuild.utils import fileutils
+
+__all__ = ['ArtifactCache']
+
+# environment variables that change the output of most build systems
+BUILD_ENVIRONMENT = ('CC', 'CXX', 'CFLAGS', 'CPPFLAGS', 'CXXFLAGS', 'LDFLAGS')
+
+class ArtifactCache:
+    version = 1
+    suffix = '.tar.gz'
+
+    def __init__(self, cachedir, max_size):
+        self.cachedir = cachedir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    @classmethod
+    def create(cls, config):
+        '''Return the artifact cache of the configuration, or None if
+        artifacts are not cached.'''
+        if not config.artifact_cache:
+            return None
+        return cls(config.artifact_cache_dir,
+                   config.artifact_cache_size * 1024 * 1024)
+
+    def get_key(self, parts):
+        '''Return the key of an artifact, from a list of JSON serializable
+        values.'''
+        parts = [self.version, parts,
+                 [(x, os.environ.get(x)) for x in BUILD_ENVIRONMENT]]
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get_filename(self, key):
+        return os.path.join(self.cachedir, key + self.suffix)
+
+    def has(self, key):
+        return os.path.exists(self.get_filename(key))
+
+    def store(self, key, directory):
+        '''Store the contents of directory as the artifact for key.'''
+        fileutils.mkdir_with_parents(self.cachedir)
+        filename = self.get_filename(key)
+        writer = fileutils.SafeWriter(filename)
+        try:
+            with tarfile.open(fileobj=writer.fp, mode='w:gz', compresslevel=6) as tar:
+                for name in sorted(os.listdir(directory)):
+                    tar.add(os.path.join(directory, name), arcname=name)
+        except Exception:
+            writer.abandon()
+            raise
+        writer.commit()
+        logging.info(_('Stored build artifact %(key)s (%(size)d KiB)') % {
+                'key': key[:16], 'size': os.path.getsize(filename) // 1024})
+        self.prune()
+
+    def restore(self, key, directory):
+        '''Extract the artifact for key into directory.  Return False if
+        there is no such artifact, or if it cannot be read (it is then
+        removed).'''
+        filename = self.get_filename(key)
+        try:
+            with tarfile.open(filename, 'r:gz') as tar:
+                members = tar.getmembers()
+                for member in members:
+                    if member.name.startswith('/') or '..' in member.name.split('/'):
+                        raise tarfile.TarError('invalid file name %r' % member.name)
+                if hasattr(tarfile, 'tar_filter'):
+                    # install trees hold absolute symlinks, that the
+                    # default 'data' filter of Python 3.14 rejects
+                    tar.extractall(directory, members, filter='tar')
+                else:
+                    tar.extractall(directory, members)
+        except FileNotFoundError:
+            return False
+        except (OSError, EOFError, zlib.error, tarfile.TarError) as e:
+            logging.warning(_('Removing unreadable build artifact %(file)s: %(error)s') % {
+                    'file': filename, 'error': e})
+            fileutils.ensure_unlinked(filename)
+            return False
+        # mark the artifact as recently used
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+        logging.info(_('Restored build artifact %s') % key[:16])
+        return True
+
+    def prune(self):
+        '''Remove the least recently used artifacts until the cache fits
+        in its maximum size.'''
+        with self.lock:
+            artifacts = []
+            total = 0
+            with os.scandir(self.cachedir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(self.suffix):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    artifacts.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+            artifacts.sort()
+            # always keep the most recent artifact, however large
+            for mtime, size, path in artifacts[:-1]:
+                if total <= self.max_size:
+                    break
+                logging.debug('removing build artifact %s', path)
+                fileutils.ensure_unlinked(path)
+                total -= size
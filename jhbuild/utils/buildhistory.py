@@ -0,0 +1,187 @@
+# jhbuild - a tool to ease building collections of source packages
+# Copyright (C) 2026  The jhbuild authors
+#
+#   buildhistory.py: timings of the build phases
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''History of the build phases.
+
+Every phase run by a build appends a record to build-history.jsonl in
+top_builddir, one JSON object per line:
+
+  run       start time of the build, identifying the records of a build
+  module    module name
+  phase     phase name
+  start     start time of the phase
+  wall      wall-clock time of the phase, in seconds
+  cpu       CPU time (user and system) of the commands run, in seconds
+  status    0 if the phase succeeded, otherwise the exit status of the
+            failed command (or 1)
+  revision  revision of the module sources, if known
+
+The records of a module are written once it is processed, and only if
+it was built: modules that were only checked out (as by jhbuild update)
+are not recorded.
+
+The CPU time is that of all the child processes of jhbuild, it is only
+accurate when modules are not built concurrently.
+'''
+
+import json
+import logging
+import os
+import threading
+import time
+
+from jhbuild.utils import fileutils
+
+__all__ = ['BuildHistory', 'get_filename', 'is_build', 'format_duration']
+
+CHECKOUT_PHASES = ('checkout', 'force_checkout')
+
+def get_filename(config):
+    return os.path.join(config.top_builddir, 'build-history.jsonl')
+
+def is_build(records):
+    '''Return whether the records of a module in a run include phases
+    other than checking it out.'''
+    return any(record['phase'] not in CHECKOUT_PHASES for record in records)
+
+class BuildHistory:
+    # when the file grows larger, only the records of the most recent
+    # runs are kept
+    max_size = 8 * 1024 * 1024
+    keep_runs = 100
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.run = None
+        # module name -> (module, records of the phases not written yet)
+        self.pending = {}
+
+    @classmethod
+    def create(cls, config):
+        '''Return the build history of the configuration, or None if it
+        is not recorded.'''
+        if not config.build_history:
+            return None
+        return cls(get_filename(config))
+
+    def start_run(self):
+        self.run = int(time.time())
+        try:
+            if os.path.getsize(self.filename) > self.max_size:
+                self.prune()
+        except OSError:
+            pass
+
+    def start_phase(self):
+        '''Return the state to pass to end_phase once the phase is done.'''
+        times = os.times()
+        return (time.time(), time.perf_counter(),
+                times.children_user + times.children_system)
+
+    def end_phase(self, state, module, phase, error):
+        start, counter, cpu = state
+        times = os.times()
+        if error is None:
+            status = 0
+        else:
+            status = getattr(error, 'returncode', None) or 1
+        record = {'run': self.run or int(start),
+                  'module': module.name,
+                  'phase': phase,
+                  'start': round(start, 1),
+                  'wall': round(time.perf_counter() - counter, 2),
+                  'cpu': round(times.children_user + times.children_system - cpu, 2),
+                  'status': status,
+                  'revision': None}
+        with self.lock:
+            self.pending.setdefault(module.name, (module, []))[1].append(record)
+
+    def end_module(self, module):
+        '''Write the records of the phases of module, if it was built.'''
+        with self.lock:
+            module, records = self.pending.pop(module.name, (module, []))
+        if not is_build(records):
+            return
+        try:
+            revision = module.get_revision()
+        except Exception:
+            revision = None
+        for record in records:
+            record['revision'] = revision
+        self.append(records)
+
+    def flush(self):
+        '''Write the records of the modules whose processing was
+        interrupted.'''
+        with self.lock:
+            modules = [module for module, records in self.pending.values()]
+        for module in modules:
+            self.end_module(module)
+
+    def append(self, records):
+        data = ''.join(json.dumps(record, separators=(',', ':')) + '\n'
+                       for record in records)
+        with self.lock:
+            try:
+                fileutils.mkdir_with_parents(os.path.dirname(self.filename))
+                with open(self.filename, 'a', encoding='utf-8') as fp:
+                    fp.write(data)
+            except OSError as e:
+                logging.debug('could not write build history %s: %s',
+                              self.filename, e)
+
+    def read(self):
+        '''Return the list of records, oldest first.'''
+        records = []
+        try:
+            with open(self.filename, encoding='utf-8') as fp:
+                for line in fp:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # truncated by an interrupted build
+                        pass
+        except FileNotFoundError:
+            pass
+        return records
+
+    def prune(self):
+        '''Only keep the records of the keep_runs most recent runs.'''
+        with self.lock:
+            records = self.read()
+            runs = sorted(set(x['run'] for x in records))[-self.keep_runs:]
+            first_run = runs[0] if runs else 0
+            writer = fileutils.SafeWriter(self.filename)
+            for record in records:
+                if record['run'] >= first_run:
+                    writer.fp.write((json.dumps(record, separators=(',', ':')) +
+                                     '\n').encode('utf-8'))
+            writer.commit()
+
+
+def format_duration(seconds):
+    '''Return a short human readable form of a duration.'''
+    if seconds < 60:
+        return '%.1fs' % seconds
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if minutes < 60:
+        return '%dm%02ds' % (minutes, seconds)
+    hours, minutes = divmod(minutes, 60)
+    return '%dh%02dm%02ds' % (hours, minutes, seconds)
@@ -0,0 +1,104 @@
+# jhbuild - a tool to ease building collections of source packages
+# Copyright (C) 2026  The jhbuild authors
+#
+#   compilercache.py: ccache and sccache support
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''Support for compiler caches (ccache and sccache).
+
+The location and size of the cache are set in the environment when the
+configuration is loaded; the module types then have the compilers run
+through the cache, each in its own way (see the compiler_cache
+configuration variable).
+'''
+
+import json
+import logging
+import os
+import subprocess
+import threading
+
+from jhbuild.utils import inpath, _
+
+__all__ = ['PROGRAMS', 'get_program', 'get_environment', 'wrap_compilers',
+           'get_stats']
+
+PROGRAMS = ('ccache', 'sccache')
+
+_found = {}
+_found_lock = threading.Lock()
+
+def get_program(config):
+    '''Return the compiler cache program of the configuration, or None if
+    there is none or it cannot be found.'''
+    program = config.compiler_cache
+    if not program:
+        return None
+    with _found_lock:
+        if program not in _found:
+            _found[program] = inpath(program, os.environ.get('PATH', '').split(os.pathsep))
+            if not _found[program]:
+                logging.warning(_('compiler cache %s not found, compilers '
+                                  'will be run directly') % program)
+    if not _found[program]:
+        return None
+    return program
+
+def get_environment(config):
+    '''Return the environment variables setting the location and the
+    maximum size of the compiler cache.'''
+    size = '%dM' % config.compiler_cache_size
+    if config.compiler_cache == 'sccache':
+        return {'SCCACHE_DIR': config.compiler_cache_dir,
+                'SCCACHE_CACHE_SIZE': size}
+    return {'CCACHE_DIR': config.compiler_cache_dir,
+            'CCACHE_MAXSIZE': size}
+
+def wrap_compilers(program, extra_env=None):
+    '''Return the CC and CXX environment variables running the compilers
+    (from extra_env, the environment, or the defaults) through program.'''
+    env = {}
+    for var, default in (('CC', 'cc'), ('CXX', 'c++')):
+        compiler = (extra_env or {}).get(var) or os.environ.get(var) or default
+        if compiler.split()[0] not in PROGRAMS:
+            compiler = '%s %s' % (program, compiler)
+        env[var] = compiler
+    return env
+
+def get_stats(program):
+    '''Return the (hits, misses) counters of the compiler cache, or None
+    if they cannot be read.'''
+    try:
+        if program == 'sccache':
+            output = subprocess.check_output(
+                    [program, '--show-stats', '--stats-format=json'],
+                    stderr=subprocess.DEVNULL)
+            stats = json.loads(output.decode('utf-8'))['stats']
+            return (sum(stats['cache_hits']['counts'].values()),
+                    sum(stats['cache_misses']['counts'].values()))
+        output = subprocess.check_output([program, '--print-stats'],
+                                         stderr=subprocess.DEVNULL)
+        counters = {}
+        for line in output.decode('utf-8', 'replace').splitlines():
+            name, sep, value = line.partition('\t')
+            if value.isdigit():
+                counters[name] = int(value)
+        return (counters.get('direct_cache_hit', 0) +
+                counters.get('preprocessed_cache_hit', 0),
+                counters['cache_miss'])
+    except (OSError, subprocess.CalledProcessError, ValueError, KeyError) as e:
+        logging.debug('could not read %s statistics: %s', program, e)
+        return None
@@ -0,0 +1,134 @@
+# jhbuild - a tool to ease building collections of source packages
+# Copyright (C) 2026  The jhbuild authors
+#
+#   criticalpath.py: critical path scheduling of the modules
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''Critical path scheduling of the modules of a build.
+
+The critical path length of a module is the estimated time from the
+start of its build to the end of the longest chain of modules that
+depend on it, directly or not.  Building the modules with the longest
+critical paths first shortens concurrent builds, and makes failures of
+modules that hold back many others appear earlier.
+
+The duration of a module is estimated from the build history (see the
+build_history configuration variable); modules that were never built
+are assumed to take the median time of the others.
+'''
+
+import heapq
+
+from jhbuild.utils.buildhistory import BuildHistory, get_filename, is_build
+
+__all__ = ['get_durations', 'get_critical_paths', 'get_critical_path',
+           'order_modules']
+
+# estimated duration of a module, when there is no build history at all
+DEFAULT_DURATION = 60.0
+
+def get_durations(config, modules):
+    '''Return a dictionary mapping the names of modules to their estimated
+    durations, in seconds.'''
+    names = set(module.name for module in modules)
+    runs = {}
+    for record in BuildHistory(get_filename(config)).read():
+        if record['module'] in names:
+            runs.setdefault((record['module'], record['run']), []).append(record)
+    known = {}
+    for (name, run), records in sorted(runs.items(), key=lambda x: x[0][1]):
+        # the latest successful build, not a mere checkout
+        if is_build(records) and all(record['status'] == 0 for record in records):
+            known[name] = sum(record['wall'] for record in records)
+
+    if known:
+        values = sorted(known.values())
+        default = values[len(values) // 2]
+    else:
+        default = DEFAULT_DURATION
+    durations = {}
+    for module in modules:
+        if module.type == 'meta':
+            durations[module.name] = 0.0
+        else:
+            durations[module.name] = known.get(module.name, default)
+    return durations
+
+def get_dependents(modules):
+    '''Return a dictionary mapping the names of modules to the lists of
+    the modules of the list that come after them and depend on them.
+
+    Only edges towards earlier modules of the list are considered, so
+    that modules from a dependency cycle cannot wait on each other.'''
+    positions = dict((module.name, index) for index, module in enumerate(modules))
+    dependents = dict((module.name, []) for module in modules)
+    for index, module in enumerate(modules):
+        for dep in set(module.dependencies + module.after + module.suggests):
+            if positions.get(dep, index) < index:
+                dependents[dep].append(module)
+    return dependents
+
+def get_critical_paths(modules, durations):
+    '''Return a dictionary mapping the names of modules to (length, next)
+    tuples, where length is the critical path length of the module, and
+    next the name of the following module on its critical path (or
+    None).'''
+    dependents = get_dependents(modules)
+    paths = {}
+    for module in reversed(modules):
+        length, following = 0.0, None
+        for dependent in dependents[module.name]:
+            if paths[dependent.name][0] > length:
+                length, following = paths[dependent.name][0], dependent.name
+        paths[module.name] = (durations[module.name] + length, following)
+    return paths
+
+def get_critical_path(paths):
+    '''Return the names of the modules on the longest critical path.'''
+    if not paths:
+        return []
+    name = max(paths, key=lambda x: paths[x][0])
+    path = []
+    while name is not None:
+        path.append(name)
+        name = paths[name][1]
+    return path
+
+def order_modules(modules, paths):
+    '''Return the modules reordered so that, among the modules whose
+    dependencies come before them, the ones with the longest critical
+    paths come first.'''
+    positions = dict((module.name, index) for index, module in enumerate(modules))
+    dependents = get_dependents(modules)
+    waiting = dict((module.name, 0) for module in modules)
+    for module_dependents in dependents.values():
+        for dependent in module_dependents:
+            waiting[dependent.name] += 1
+
+    def key(module):
+        return (-paths[module.name][0], positions[module.name])
+
+    ready = [(key(module), module) for module in modules if not waiting[module.name]]
+    heapq.heapify(ready)
+    ordered = []
+    while ready:
+        module = heapq.heappop(ready)[1]
+        ordered.append(module)
+        for dependent in dependents[module.name]:
+            waiting[dependent.name] -= 1
+            if not waiting[dependent.name]:
+                heapq.heappush(ready, (key(dependent), dependent))
+    return ordered
@@ -0,0 +1,197 @@
+# jhbuild - a tool to ease building collections of source packages
+# Copyright (C) 2026  The jhbuild authors
+#
+#   download.py: download of source tarballs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''Download of files, resuming interrupted downloads.
+
+The file is first downloaded to a .part file next to its destination,
+and hashed as the data arrives; it is only renamed to its destination
+once its size and hash have been checked.  When a .part file is left by
+an interrupted download, the rest of the file is requested with a HTTP
+Range header.
+
+No more than max_host_connections downloads from a same host, and no
+more than max_connections downloads in all, run at the same time, whether
+modules are built or checked out in the background.
+'''
+
+import hashlib
+import http.client
+import logging
+import os
+import socket
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from jhbuild.errors import BuildStateError
+from jhbuild.utils import _
+
+__all__ = ['download', 'get_hash_algorithm', 'hash_file']
+
+BLOCK_SIZE = 256 * 1024
+RETRIES = 5
+TIMEOUT = 60
+
+_semaphore = None
+_host_semaphores = {}
+_semaphores_lock = threading.Lock()
+
+def _get_semaphore(config):
+    global _semaphore
+    with _semaphores_lock:
+        if _semaphore is None:
+            _semaphore = threading.BoundedSemaphore(config.max_connections)
+        return _semaphore
+
+def _get_host_semaphore(config, url):
+    host = urllib.parse.urlparse(url).hostname
+    with _semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(
+                    config.max_host_connections)
+        return _host_semaphores[host]
+
+def get_hash_algorithm(source_hash):
+    '''Return the (algorithm, hexdigest) tuple of a algo:hexdigest hash
+    attribute, or None if it is invalid or the algorithm not supported.'''
+    try:
+        algo, hexdigest = source_hash.split(':')
+    except ValueError:
+        logging.warning(_('invalid hash attribute %s') % source_hash)
+        return None
+    if not hasattr(hashlib, algo):
+        logging.warning(_('skipped hash check (missing support for %s)') % algo)
+        return None
+    return algo, hexdigest
+
+def hash_file(filename, algo, hash=None):
+    '''Return hash (a new one of algorithm algo if None) updated with the
+    contents of filename.'''
+    if hash is None:
+        hash = getattr(hashlib, algo)()
+    with open(filename, 'rb') as fp:
+        data = fp.read(BLOCK_SIZE)
+        while data:
+            hash.update(data)
+            data = fp.read(BLOCK_SIZE)
+    return hash
+
+def _check(partfile, size, hash, expected_size, expected_hash):
+    if expected_size is not None and size != expected_size:
+        os.unlink(partfile)
+        raise BuildStateError(
+                _('downloaded file size is incorrect (expected %(size1)d, got %(size2)d)')
+                % {'size1': expected_size, 'size2': size})
+    if hash is not None and hash.hexdigest() != expected_hash:
+        os.unlink(partfile)
+        raise BuildStateError(
+                _('file hash is incorrect (expected %(sum1)s, got %(sum2)s)')
+                % {'sum1': expected_hash, 'sum2': hash.hexdigest()})
+
+def _fetch(url, partfile, expected_size, algo):
+    '''Download url to partfile, resuming from its current contents;
+    return the size and the hash of the whole file.'''
+    hash = getattr(hashlib, algo)() if algo else None
+    try:
+        offset = os.stat(partfile).st_size
+    except FileNotFoundError:
+        offset = 0
+    if expected_size is not None and offset > expected_size:
+        os.unlink(partfile)
+        offset = 0
+    if offset and offset == expected_size:
+        # the download was interrupted before the file was renamed
+        return offset, hash_file(partfile, algo, hash) if hash else None
+
+    request = urllib.request.Request(url)
+    request.add_header('Accept', '*/*')
+    if offset:
+        request.add_header('Range', 'bytes=%d-' % offset)
+    try:
+        response = urllib.request.urlopen(request, timeout=TIMEOUT)
+    except urllib.error.HTTPError as e:
+        if e.code != 416 or not offset:
+            raise
+        # range not satisfiable, the partial file cannot be used
+        os.unlink(partfile)
+        return _fetch(url, partfile, expected_size, algo)
+
+    with response:
+        if offset and getattr(response, 'status', None) == 206:
+            mode = 'ab'
+            if hash is not None:
+                hash_file(partfile, algo, hash)
+        else:
+            # the server sent the whole file
+            mode = 'wb'
+            offset = 0
+        size = offset
+        with open(partfile, mode) as fp:
+            data = response.read(BLOCK_SIZE)
+            while data:
+                if hash is not None:
+                    hash.update(data)
+                fp.write(data)
+                size += len(data)
+                data = response.read(BLOCK_SIZE)
+    return size, hash
+
+def download(buildscript, url, filename, expected_size=None, expected_hash=None):
+    '''Download url to filename, checking its size and hash (of the form
+    algo:hexdigest), if given.'''
+    partfile = filename + '.part'
+    algo = None
+    if expected_hash:
+        algorithm = get_hash_algorithm(expected_hash)
+        if algorithm:
+            algo, expected_hash = algorithm
+
+    buildscript.message(_('Downloading %s') % url)
+    start = time.time()
+    try:
+        with _get_host_semaphore(buildscript.config, url), \
+                _get_semaphore(buildscript.config):
+            for attempt in range(RETRIES):
+                try:
+                    size, hash = _fetch(url, partfile, expected_size, algo)
+                    break
+                except urllib.error.HTTPError as e:
+                    # the server answered, there is no point in trying again
+                    raise BuildStateError(_('could not download %(url)s: %(error)s') % {
+                            'url': url, 'error': e})
+                except (urllib.error.URLError, http.client.HTTPException, socket.timeout,
+                        ConnectionError) as e:
+                    if attempt == RETRIES - 1:
+                        raise BuildStateError(_('could not download %(url)s: %(error)s') % {
+                                'url': url, 'error': e})
+                    logging.warning(_('download of %(url)s interrupted (%(error)s), '
+                                      'resuming') % {'url': url, 'error': e})
+                    time.sleep(attempt + 1)
+
+        _check(partfile, size, hash, expected_size, expected_hash)
+        os.rename(partfile, filename)
+    except (OSError, ValueError) as e:
+        # an invalid URL, or the file could not be written
+        raise BuildStateError(_('could not download %(url)s: %(error)s') % {
+                'url': url, 'error': e})
+    elapsed = max(time.time() - start, 0.001)
+    buildscript.message(_('Downloaded %(url)s (%(size).1f MiB, %(speed).1f MiB/s)') % {
+            'url': url, 'size': size / 2.0**20, 'speed': size / 2.0**20 / elapsed})
@@ -21,34 +21,7 @@
 
 import os
 import errno
-
-def _accumulate_dirtree_contents_recurse(path, contents):
-    names = os.listdir(path)
-    for name in names:
-        subpath = os.path.join(path, name)
-        if os.path.isdir(subpath) and not os.path.islink(subpath):
-            previous_len = len(contents)
-            _accumulate_dirtree_contents_recurse(subpath, contents)
-            new_len = len(contents)
-            # Only add if the directory is empty, otherwise, its existence
-            # is implicit.
-            if previous_len == new_len:
-                contents.append(subpath + os.sep)
-        else:
-            contents.append(subpath)
-
-def accumulate_dirtree_contents(path):
-    """Return a list of files and empty directories in the directory at PATH.  Each item
-in the returned list is relative to the root path."""
-    contents = []
-    _accumulate_dirtree_contents_recurse(path, contents)
-    if not path.endswith(os.sep):
-        path = path + os.sep
-    pathlen = len(path)
-    for i,subpath in enumerate(contents):
-        assert subpath.startswith(path)
-        contents[i] = subpath[pathlen:]
-    return contents
+import stat
 
 def remove_files_and_dirs(file_paths, allow_nonempty_dirs=False):
     """Given a list of file paths in any order, attempt to delete
@@ -114,9 +87,32 @@ def ensure_unlinked(filename):
     try:
         os.unlink(filename)
     except OSError as e:
-        if e.errno != os.errno.ENOENT:
+        if e.errno != errno.ENOENT:
             raise
 
+def identical_files(path1, path2):
+    """Return whether path1 and path2 are files of the same type, mode and
+contents, or symbolic links to the same target.  The sizes are compared
+before the contents are read."""
+    try:
+        st1 = os.lstat(path1)
+        st2 = os.lstat(path2)
+    except OSError:
+        return False
+    if st1.st_mode != st2.st_mode:
+        return False
+    if stat.S_ISLNK(st1.st_mode):
+        return os.readlink(path1) == os.readlink(path2)
+    if not stat.S_ISREG(st1.st_mode) or st1.st_size != st2.st_size:
+        return False
+    with open(path1, 'rb') as fp1, open(path2, 'rb') as fp2:
+        while True:
+            data1 = fp1.read(65536)
+            if data1 != fp2.read(65536):
+                return False
+            if not data1:
+                return True
+
 def mkdir_with_parents(filename):
     try:
         os.makedirs(filename)
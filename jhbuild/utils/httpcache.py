@@ -26,11 +26,17 @@ and draws ideas from feedparser.py.  Strategies include:
       resource to reduce downloads when the file has not changed.
     - honour Expires headers returned by server.  If no expiry time is
       given, it defaults to 6 hours.
+    - keep the index in memory, and only write it, along with the changes
+      of other jhbuild processes, when an entry is added or validated.
 '''
 
 from io import BytesIO
+import hashlib
+import json
+import logging
 import os
 import sys
+import threading
 import time
 from email.utils import parsedate_tz, mktime_tz
 import gzip
@@ -39,7 +45,13 @@ from urllib.parse import urlparse
 import urllib.request
 import xml.dom.minidom
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 from jhbuild.utils import _
+from jhbuild.utils import fileutils
 
 def _parse_isotime(string):
     if string[-1] != 'Z':
@@ -47,9 +59,6 @@ def _parse_isotime(string):
     tm = time.strptime(string, '%Y-%m-%dT%H:%M:%SZ')
     return time.mktime(tm[:8] + (0,)) - time.timezone    
 
-def _format_isotime(tm):
-    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(tm))
-
 def _parse_date(date):
     tm = parsedate_tz(date)
     if tm:
@@ -64,7 +73,17 @@ class CacheEntry:
         self.etag = etag
         self.expires = expires
 
+    def to_json(self):
+        return json.dumps({'uri': self.uri, 'local': self.local,
+                           'modified': self.modified, 'etag': self.etag,
+                           'expires': self.expires}, separators=(',', ':'))
+
 class Cache:
+    '''The index of the cache is kept in memory, and written to index.jsonl
+    (one JSON object per entry) when it changes.  The index is written
+    with an atomic rename, holding an advisory lock on index.lock, after
+    merging the changes other processes may have made in the meantime.'''
+
     try:
         cachedir = os.path.join(os.environ['XDG_CACHE_HOME'], 'jhbuild')
     except KeyError:
@@ -78,18 +97,46 @@ class Cache:
             self.cachedir = cachedir
         if not os.path.exists(self.cachedir):
             os.makedirs(self.cachedir)
+        self.index = os.path.join(self.cachedir, 'index.jsonl')
         self.entries = {}
+        self.loaded = False
+        self.index_stat = None
+        self.lock = threading.Lock()
 
-    def read_cache(self):
-        self.entries = {}
+    def _get_index_stat(self):
+        try:
+            st = os.stat(self.index)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _read_index(self):
+        entries = {}
+        try:
+            with open(self.index, encoding='utf-8') as fp:
+                for line in fp:
+                    try:
+                        entry = CacheEntry(**json.loads(line))
+                    except (ValueError, TypeError):
+                        continue
+                    entries[entry.uri] = entry
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logging.debug('could not read %s: %s', self.index, e)
+        return entries
+
+    def _read_xml_index(self):
+        '''Return the entries of the index of older versions, index.xml'''
+        entries = {}
         cindex = os.path.join(self.cachedir, 'index.xml')
         try:
             document = xml.dom.minidom.parse(cindex)
         except Exception:
-            return # treat like an empty cache
+            return entries # treat like an empty cache
         if document.documentElement.nodeName != 'cache':
             document.unlink()
-            return # doesn't look like a cache
+            return entries # doesn't look like a cache
 
         for node in document.documentElement.childNodes:
             if node.nodeType != node.ELEMENT_NODE:
@@ -107,58 +154,67 @@ class Cache:
             else:
                 etag = None
             expires = _parse_isotime(node.getAttribute('expires'))
-            # only add to cache list if file actually exists.
-            if os.path.exists(os.path.join(self.cachedir, local)):
-                self.entries[uri] = CacheEntry(uri, local, modified,
-                                               etag, expires)
+            entries[uri] = CacheEntry(uri, local, modified, etag, expires)
         document.unlink()
+        return entries
 
-    def write_cache(self):
-        cindex = os.path.join(self.cachedir, 'index.xml')
+    def read_cache(self):
+        '''Load the index, unless it did not change since it was last
+        loaded.'''
+        index_stat = self._get_index_stat()
+        if self.loaded and index_stat == self.index_stat:
+            return
+        entries = self._read_index()
+        if entries is None:
+            entries = self._read_xml_index()
+        # only keep the entries whose file actually exists.
+        self.entries = dict((uri, entry) for uri, entry in entries.items()
+                            if os.path.exists(os.path.join(self.cachedir, entry.local)))
+        self.loaded = True
+        self.index_stat = index_stat
 
-        
-        document = xml.dom.minidom.Document()
-        document.appendChild(document.createElement('cache'))
-        node = document.createTextNode('\n')
-        document.documentElement.appendChild(node)
-        for uri in self.entries.keys():
-            entry = self.entries[uri]
-            node = document.createElement('entry')
-            node.setAttribute('uri', entry.uri)
-            node.setAttribute('local', entry.local)
-            if entry.modified:
-                node.setAttribute('modified', entry.modified)
-            if entry.etag:
-                node.setAttribute('etag', entry.etag)
-            node.setAttribute('expires', _format_isotime(entry.expires))
-            document.documentElement.appendChild(node)
-
-            node = document.createTextNode('\n')
-            document.documentElement.appendChild(node)
-        fp = open(cindex, 'w')
-        document.writexml(fp)
-        document.unlink()
-        fp.close()
+    def _lock_index(self):
+        if fcntl is None:
+            return None
+        fd = os.open(os.path.join(self.cachedir, 'index.lock'),
+                     os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    def _unlock_index(self, fd):
+        if fd is not None:
+            # closing the file releases the lock
+            os.close(fd)
+
+    def write_cache(self, entry, data=None):
+        '''Add entry to the index, and save its contents (if data is not
+        None) and the index.'''
+        fd = self._lock_index()
+        try:
+            if data is not None:
+                writer = fileutils.SafeWriter(os.path.join(self.cachedir, entry.local))
+                writer.fp.write(data)
+                writer.commit()
+            # merge the entries written by other processes
+            self.read_cache()
+            self.entries[entry.uri] = entry
+            writer = fileutils.SafeWriter(self.index)
+            for cached_entry in self.entries.values():
+                writer.fp.write((cached_entry.to_json() + '\n').encode('utf-8'))
+            writer.commit()
+            self.index_stat = self._get_index_stat()
+        finally:
+            self._unlock_index(fd)
 
     def _make_filename(self, uri):
-        '''picks a unique name for a new entry in the cache.
-        Very simplistic.'''
+        '''picks a unique name for a new entry in the cache, from a hash
+        of the URI and its basename.'''
         # get the basename from the URI
         parts = urlparse(uri, allow_fragments=False)
         base = parts[2].split('/')[-1]
         if not base:
             base = 'index.html'
-
-        is_unique = False
-        while not is_unique:
-            is_unique = True
-            for uri in self.entries.keys():
-                if self.entries[uri].local == base:
-                    is_unique = False
-                    break
-            if not is_unique:
-                base = base + '-'
-        return base
+        return '%s-%s' % (hashlib.sha256(uri.encode('utf-8')).hexdigest()[:16], base)
 
     def load(self, uri, nonetwork=False, age=None):
         '''Downloads the file associated with the URI, and returns a local
@@ -174,8 +230,9 @@ class Cache:
         now = time.time()
 
         # is the file cached and not expired?
-        self.read_cache()
-        entry = self.entries.get(uri)
+        with self.lock:
+            self.read_cache()
+            entry = self.entries.get(uri)
         if entry and (age != 0 or nonetwork):
             if (nonetwork or now <= entry.expires):
                 return os.path.join(self.cachedir, entry.local)
@@ -207,7 +264,7 @@ class Cache:
                 try:
                     data = gzip.GzipFile(fileobj=BytesIO(data)).read()
                 except Exception:
-                    data = ''
+                    data = b''
 
             expires = response.headers.get('Expires')
             
@@ -215,16 +272,14 @@ class Cache:
             entry = CacheEntry(uri, self._make_filename(uri),
                                response.headers.get('Last-Modified'),
                                response.headers.get('ETag'))
-            filename = os.path.join(self.cachedir, entry.local)
-            fp = open(filename, 'wb')
-            fp.write(data)
-            fp.close()
         except urllib.error.HTTPError as e:
             if e.code == 304: # not modified; update validated
                 expires = e.hdrs.get('Expires')
-                filename = os.path.join(self.cachedir, entry.local)
+                entry = CacheEntry(uri, entry.local, entry.modified, entry.etag)
+                data = None
             else:
                 raise
+        filename = os.path.join(self.cachedir, entry.local)
 
         # set expiry date
         entry.expires = _parse_date(expires)
@@ -234,8 +289,8 @@ class Cache:
             entry.expires = now + age
 
         # save cache
-        self.entries[uri] = entry
-        self.write_cache()
+        with self.lock:
+            self.write_cache(entry, data)
         return filename
 
 _cache = None
@@ -0,0 +1,174 @@
+# jhbuild - a tool to ease building collections of source packages
+# Copyright (C) 2026  The jhbuild authors
+#
+#   jobserver.py: a GNU make compatible jobserver
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''A jobserver shared by all the make and ninja processes of a build.
+
+The jobserver is a named pipe holding one byte (a token) per job that may
+run at any time.  It is advertised to the children through the MAKEFLAGS
+environment variable, using the --jobserver-auth=fifo:PATH syntax that is
+understood by GNU make >= 4.4 and ninja >= 1.13.
+
+Before starting a make or ninja process, jhbuild takes a token out of the
+pipe; that token stands for the implicit job slot of the child, and is put
+back once the child exits.  Any further job started by the child takes
+another token, so that no more than "jobs" jobs run at the same time, no
+matter how many modules are built concurrently.
+
+A child that is killed or crashes does not give back the tokens its jobs
+held; the pool is filled up again whenever no child is running.
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import logging
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    fcntl = None
+
+from jhbuild.utils import _
+from jhbuild.utils.cmds import check_version
+
+__all__ = ['JobServer']
+
+TOKEN = b'+'
+
+class JobServer:
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.tmpdir = tempfile.mkdtemp(prefix='jhbuild-jobserver-')
+        self.path = os.path.join(self.tmpdir, 'fifo')
+        os.mkfifo(self.path, 0o600)
+        # open the reading end first, without blocking as there is no
+        # writer yet, then switch it back to blocking reads.
+        self.readfd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        self.writefd = os.open(self.path, os.O_WRONLY)
+        os.set_blocking(self.readfd, True)
+        os.write(self.writefd, TOKEN * jobs)
+
+        self.lock = threading.Lock()
+        self.held = 0
+        self.peak = 0
+        # make and ninja processes running, or waiting for a token
+        self.clients = 0
+        self.supported_commands = {}
+
+    @classmethod
+    def create(cls, config):
+        '''Return a new jobserver for the configuration, or None if the
+        jobserver is disabled or cannot be used.'''
+        if not config.jobserver or os.name != 'posix' or config.jobs < 1:
+            return None
+        if '--jobserver-auth' in os.environ.get('MAKEFLAGS', ''):
+            # already running under a jobserver (jhbuild called from make)
+            return None
+        try:
+            return cls(config.jobs)
+        except OSError as e:
+            logging.warning(_('could not create jobserver: %s') % e)
+            return None
+
+    def close(self):
+        os.close(self.readfd)
+        os.close(self.writefd)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def supports(self, command, tool):
+        '''Return whether command, a "make" or "ninja" tool, can use the
+        jobserver.'''
+        with self.lock:
+            if command not in self.supported_commands:
+                if tool == 'make':
+                    supported = check_version('%s --version' % command,
+                                              r'GNU Make ([\d.]+)', '4.4',
+                                              extra_env={'LC_ALL': 'C'})
+                else:
+                    supported = check_version('%s --version' % command,
+                                              r'([\d.]+)', '1.13')
+                self.supported_commands[command] = supported
+            return self.supported_commands[command]
+
+    def get_makeflags(self):
+        return '-j%d --jobserver-auth=fifo:%s' % (self.jobs, self.path)
+
+    def acquire(self):
+        '''Take a token out of the pool, waiting until one is available.'''
+        token = os.read(self.readfd, 1)
+        with self.lock:
+            self.held += 1
+            in_use = self.tokens_in_use()
+            if in_use is not None:
+                self.peak = max(self.peak, in_use)
+        return token
+
+    def release(self, token):
+        with self.lock:
+            self.held -= 1
+        os.write(self.writefd, token or TOKEN)
+
+    def refill(self):
+        '''Put back the tokens lost by children that exited without
+        releasing them; to be called when no child is running.'''
+        in_use = self.tokens_in_use()
+        if in_use:
+            logging.debug('jobserver: %d job tokens were not released', in_use)
+            os.write(self.writefd, TOKEN * in_use)
+
+    def tokens_in_use(self):
+        '''Return the number of tokens currently taken out of the pool, by
+        jhbuild or by its children, or None if it cannot be known.'''
+        if fcntl is None:
+            return None
+        try:
+            available = int.from_bytes(
+                    fcntl.ioctl(self.readfd, termios.FIONREAD, b'\0' * 4),
+                    sys.byteorder)
+        except OSError:
+            return None
+        return self.jobs - available
+
+    def get_environment(self, extra_env=None):
+        '''Return extra_env updated so that a command run with the
+        returned environment is a client of the jobserver.'''
+        env = (extra_env or {}).copy()
+        makeflags = env.get('MAKEFLAGS', os.environ.get('MAKEFLAGS', ''))
+        env['MAKEFLAGS'] = (makeflags + ' ' + self.get_makeflags()).strip()
+        return env
+
+    def run(self, buildscript, command, cwd=None, extra_env=None):
+        '''Execute command through the buildscript, holding a token for
+        the implicit job slot of the child for the time it runs.'''
+        with self.lock:
+            self.clients += 1
+        try:
+            token = self.acquire()
+            try:
+                buildscript.execute(command, cwd=cwd, extra_env=extra_env)
+            finally:
+                self.release(token)
+        finally:
+            with self.lock:
+                self.clients -= 1
+                if self.clients == 0 and self.held == 0:
+                    self.refill()
@@ -22,9 +22,16 @@ import time
 import logging
 import errno
 import hashlib
+import threading
 
 import xml.etree.ElementTree as ET
 
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from jhbuild.errors import FatalError
 from jhbuild.utils import fileutils, _, open_text
 
 def _parse_isotime(string):
@@ -47,7 +54,7 @@ class PackageEntry:
 
     @property
     def manifest(self):
-        if self._manifest:
+        if self._manifest is not None:
             return self._manifest
         if not os.path.exists(os.path.join(self.dirname, 'manifests', self.package)):
             return None
@@ -61,7 +68,7 @@ class PackageEntry:
         if value is None:
             self._manifest = value
             return
-        self._manifest = [x.strip() for x in value if '\n' not in value]
+        self._manifest = [x.strip() for x in value if '\n' not in x]
         if len(self._manifest) != len(value):
             logging.error(_('package %s has files with embedded new lines') % self.package)
 
@@ -94,6 +101,8 @@ class PackageEntry:
         if 'configure-hash' in self.metadata:
             entry_node.attrib['configure-hash'] = \
                 self.metadata['configure-hash']
+        if 'artifact-key' in self.metadata:
+            entry_node.attrib['artifact-key'] = self.metadata['artifact-key']
 
         return entry_node
 
@@ -109,6 +118,9 @@ class PackageEntry:
         configure_hash = node.attrib.get('configure-hash')
         if configure_hash:
             metadata['configure-hash'] = configure_hash
+        artifact_key = node.attrib.get('artifact-key')
+        if artifact_key:
+            metadata['artifact-key'] = artifact_key
 
         dbentry = cls(package, version, metadata, dirname)
 
@@ -153,27 +165,163 @@ class PackageEntry:
         return None
 
 class PackageDB:
+    """The registry of installed packages.
+
+    The entries are read once from the info/ directory (and the legacy
+    packagedb.xml file) into memory, and written back as they are added or
+    removed.  The directories are checked for changes before each access,
+    so that the entries are read again if another jhbuild process
+    modified them.  The database can be used from several threads.
+    """
+
     def __init__(self, dbfile, config):
         self.dirname = os.path.dirname(dbfile)
         self.config = config
+        self._lock = threading.RLock()
+        self._entries = None
+        self._stamp = None
+        # installed file (absolute path) -> set of packages
+        self._owners = None
+        self._legacy = os.path.exists(os.path.join(self.dirname, 'packagedb.xml'))
+
+    def _get_stamp(self):
+        paths = [os.path.join(self.dirname, 'info')]
+        if self._legacy:
+            # entries of packagedb.xml depend on the existing manifests
+            paths.append(os.path.join(self.dirname, 'manifests'))
+            paths.append(os.path.join(self.dirname, 'packagedb.xml'))
+        stamp = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                stamp.append(None)
+            else:
+                stamp.append((st.st_ino, st.st_size, st.st_mtime_ns))
+        return stamp
+
+    def _read_entries(self):
+        entries = {}
+        try:
+            packages = os.listdir(os.path.join(self.dirname, 'info'))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            packages = []
+        for package in packages:
+            if package.endswith('.tmp'):
+                # being written by fileutils.SafeWriter
+                continue
+            try:
+                with open(os.path.join(self.dirname, 'info', package), 'rb') as info:
+                    node = ET.parse(info).getroot()
+            except EnvironmentError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            if node.tag == 'entry':
+                entries[package] = PackageEntry.from_xml(node, self.dirname)
+
+        # Add the entries of the old packagedb.xml file.  We use the
+        # manifest file to check if the package 'really exists' because
+        # otherwise we may see the old packagedb.xml entry for an
+        # uninstalled package (since we no longer update that file)
+        #
+        # please delete this code in 2016
+        try:
+            with open(os.path.join(self.dirname, 'packagedb.xml'), 'rb') as info:
+                root = ET.parse(info).getroot()
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        else:
+            if root.tag == 'packagedb':
+                for node in root:
+                    if node.tag != 'entry':
+                        continue
+                    package = node.attrib['package']
+                    if package in entries:
+                        continue
+                    if os.path.exists(os.path.join(self.dirname, 'manifests', package)):
+                        entries[package] = PackageEntry.from_xml(node, self.dirname)
+        return entries
+
+    def _get_entries(self):
+        # must be called with the lock held
+        stamp = self._get_stamp()
+        if self._entries is None or stamp != self._stamp:
+            self._entries = self._read_entries()
+            self._stamp = stamp
+            self._owners = None
+        return self._entries
+
+    def _get_owners(self):
+        # must be called with the lock held
+        entries = self._get_entries()
+        if self._owners is None:
+            self._owners = {}
+            for entry in entries.values():
+                self._index_entry(entry)
+        return self._owners
+
+    def _index_entry(self, entry, remove=False):
+        for path in entry.manifest or []:
+            path = self._abspath(path)
+            if remove:
+                packages = self._owners.get(path)
+                if packages is not None:
+                    packages.discard(entry.package)
+                    if not packages:
+                        del self._owners[path]
+            else:
+                self._owners.setdefault(path, set()).add(entry.package)
+
+    def _abspath(self, path):
+        # this is called for every file of every manifest, so avoid
+        # os.path.join and os.path.normpath where possible
+        if not path.startswith(os.sep):
+            prefix = self.config.prefix
+            if not prefix.endswith(os.sep):
+                prefix += os.sep
+            path = prefix + path
+        if os.sep + '.' in path or os.sep * 2 in path or os.altsep:
+            return os.path.normpath(path)
+        return path.rstrip(os.sep) or os.sep
 
     def get(self, package):
         '''Return entry if package is installed, otherwise return None.'''
-        return PackageEntry.open(self.dirname, package)
+        with self._lock:
+            return self._get_entries().get(package)
 
-    def add(self, package, version, contents, configure_cmd = None):
+    def add(self, package, version, contents, configure_cmd = None,
+            artifact_key = None):
         '''Add a module to the install cache.'''
-        entry = self.get(package)
-        if entry:
-            metadata = entry.metadata
-        else:
-            metadata = {}
-        metadata['installed-date'] = time.time() # now
-        if configure_cmd:
-            metadata['configure-hash'] = hashlib.md5(configure_cmd.encode("utf-8")).hexdigest()
-        pkg = PackageEntry(package, version, metadata, self.dirname)
-        pkg.manifest = contents
-        pkg.write()
+        with self._lock:
+            entry = self._get_entries().get(package)
+            if entry:
+                metadata = entry.metadata.copy()
+            else:
+                metadata = {}
+            metadata['installed-date'] = time.time() # now
+            if configure_cmd:
+                metadata['configure-hash'] = hashlib.md5(configure_cmd.encode("utf-8")).hexdigest()
+            # the key of the build artifact the files come from, if any
+            if artifact_key:
+                metadata['artifact-key'] = artifact_key
+            else:
+                metadata.pop('artifact-key', None)
+            pkg = PackageEntry(package, version, metadata, self.dirname)
+            pkg.manifest = contents
+            if self._owners is not None:
+                if entry:
+                    self._index_entry(entry, remove=True)
+                self._index_entry(pkg)
+            pkg.write()
+            # keep the entry as it will be read back (e.g. the installation
+            # date is only stored to the second)
+            self._entries[package] = PackageEntry.from_xml(pkg.to_xml(), self.dirname)
+            self._entries[package].manifest = pkg.manifest
+            self._stamp = self._get_stamp()
 
     def check(self, package, version=None):
         '''Check whether a particular module is installed.'''
@@ -210,6 +358,12 @@ class PackageDB:
         # (presumably we'd fail, but better not to try)
         to_delete = fileutils.filter_files_by_prefix(self.config, entry.manifest)
 
+        # Keep the files that other packages installed too
+        shared = self.find_conflicts(package_name, to_delete)
+        if shared:
+            logging.info(_('Keeping %d files also installed by other packages') % len(shared))
+            to_delete = [x for x in to_delete if x not in shared]
+
         # Don't warn on non-empty directories; we want to allow multiple
         # modules to share the same directory.  We could improve this by
         # reference-counting directories.
@@ -222,4 +376,218 @@ class PackageDB:
                 logging.warn(_("Failed to delete %(file)r: %(msg)s") % { 'file': path,
                                                                          'msg': error_string})
 
-        entry.remove()
+        self._remove(entry)
+
+    def _remove(self, entry):
+        with self._lock:
+            entries = self._get_entries()
+            if self._owners is not None:
+                self._index_entry(entry, remove=True)
+            entry.remove()
+            entries.pop(entry.package, None)
+            self._stamp = self._get_stamp()
+
+    def find_owners(self, filenames):
+        '''Return a dictionary mapping each of filenames installed by a
+        package to the sorted list of the packages that installed it.
+
+        Filenames are either absolute or relative to the prefix.'''
+        owners = {}
+        with self._lock:
+            index = self._get_owners()
+            for filename in filenames:
+                packages = index.get(self._abspath(filename))
+                if packages:
+                    owners[filename] = sorted(packages)
+        return owners
+
+    def find_conflicts(self, package, filenames):
+        '''Return a dictionary mapping each of filenames installed by
+        another package than package to the sorted list of those
+        packages.'''
+        conflicts = {}
+        for filename, packages in self.find_owners(filenames).items():
+            others = [x for x in packages if x != package]
+            if others:
+                conflicts[filename] = others
+        return conflicts
+
+
+class SQLitePackageEntry(PackageEntry):
+    """An entry of a SQLitePackageDB, whose manifest is read from the
+    database when needed."""
+
+    def __init__(self, package, version, metadata, dirname, db):
+        PackageEntry.__init__(self, package, version, metadata, dirname)
+        self.db = db
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            self._manifest = self.db._get_manifest(self.package)
+        return self._manifest
+
+    @manifest.setter
+    def manifest(self, value):
+        PackageEntry.manifest.fset(self, value)
+
+
+class SQLitePackageDB(PackageDB):
+    """The registry of installed packages, stored in an SQLite database.
+
+    The files installed by the packages are indexed, so that the owners of
+    a file can be found without reading all the manifests.  The database
+    is created from the info/ and manifests/ directories the first time it
+    is used; those are not updated afterwards.
+    """
+
+    schema_version = 1
+
+    def __init__(self, dbfile, config):
+        if sqlite3 is None:
+            raise FatalError(_('the sqlite package database requires the '
+                               'sqlite3 Python module'))
+        PackageDB.__init__(self, dbfile, config)
+        self.filename = os.path.join(self.dirname, 'packagedb.sqlite')
+        self.__connection = None
+
+    @property
+    def _connection(self):
+        # must be used with the lock held; the connection is shared by
+        # the threads of the build.
+        if self.__connection is None:
+            fileutils.mkdir_with_parents(self.dirname)
+            connection = sqlite3.connect(self.filename, timeout=60,
+                                         check_same_thread=False)
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+            if version != self.schema_version:
+                self._migrate(connection)
+            self.__connection = connection
+        return self.__connection
+
+    def _migrate(self, connection):
+        # everything is done in a single transaction, so that an
+        # interrupted migration leaves the database empty and is done
+        # again the next time.
+        logging.info(_('migrating the package database to %s') % self.filename)
+        entries = PackageDB._read_entries(self)
+        with connection:
+            connection.executescript('''
+                DROP TABLE IF EXISTS files;
+                DROP TABLE IF EXISTS metadata;
+                DROP TABLE IF EXISTS entries;
+                CREATE TABLE entries (
+                    package TEXT PRIMARY KEY,
+                    version TEXT NOT NULL);
+                CREATE TABLE metadata (
+                    package TEXT NOT NULL REFERENCES entries(package),
+                    key TEXT NOT NULL,
+                    value,
+                    PRIMARY KEY (package, key));
+                CREATE TABLE files (
+                    package TEXT NOT NULL REFERENCES entries(package),
+                    path TEXT NOT NULL);
+                CREATE INDEX files_package ON files(package);
+                CREATE INDEX files_path ON files(path);
+            ''')
+            for entry in entries.values():
+                self._insert(connection, entry)
+            connection.execute('PRAGMA user_version = %d' % self.schema_version)
+
+    def _insert(self, connection, entry):
+        connection.execute('DELETE FROM files WHERE package = ?', (entry.package,))
+        connection.execute('DELETE FROM metadata WHERE package = ?', (entry.package,))
+        connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?)',
+                           (entry.package, entry.version))
+        connection.executemany('INSERT INTO metadata VALUES (?, ?, ?)',
+                               [(entry.package, key, value)
+                                for key, value in entry.metadata.items()])
+        connection.executemany('INSERT INTO files VALUES (?, ?)',
+                               [(entry.package, path)
+                                for path in entry.manifest or []])
+
+    def _get_manifest(self, package):
+        with self._lock:
+            rows = self._connection.execute(
+                    'SELECT path FROM files WHERE package = ? ORDER BY rowid',
+                    (package,)).fetchall()
+        return [row[0] for row in rows]
+
+    def get(self, package):
+        '''Return entry if package is installed, otherwise return None.'''
+        with self._lock:
+            row = self._connection.execute(
+                    'SELECT version FROM entries WHERE package = ?',
+                    (package,)).fetchone()
+            if row is None:
+                return None
+            metadata = dict(self._connection.execute(
+                    'SELECT key, value FROM metadata WHERE package = ?',
+                    (package,)))
+        return SQLitePackageEntry(package, row[0], metadata, self.dirname, self)
+
+    def add(self, package, version, contents, configure_cmd = None,
+            artifact_key = None):
+        '''Add a module to the install cache.'''
+        with self._lock:
+            entry = self.get(package)
+            if entry:
+                metadata = entry.metadata.copy()
+            else:
+                metadata = {}
+            metadata['installed-date'] = time.time() # now
+            if configure_cmd:
+                metadata['configure-hash'] = hashlib.md5(configure_cmd.encode("utf-8")).hexdigest()
+            # the key of the build artifact the files come from, if any
+            if artifact_key:
+                metadata['artifact-key'] = artifact_key
+            else:
+                metadata.pop('artifact-key', None)
+            pkg = SQLitePackageEntry(package, version, metadata, self.dirname, self)
+            pkg.manifest = contents
+            with self._connection as connection:
+                self._insert(connection, pkg)
+
+    def _remove(self, entry):
+        with self._lock:
+            with self._connection as connection:
+                for table in ('files', 'metadata', 'entries'):
+                    connection.execute('DELETE FROM %s WHERE package = ?' % table,
+                                       (entry.package,))
+
+    def find_owners(self, filenames):
+        '''Return a dictionary mapping each of filenames installed by a
+        package to the sorted list of the packages that installed it.
+
+        Filenames are either absolute or relative to the prefix.'''
+        # manifests hold paths relative to the prefix, or absolute paths
+        # for old entries, with a trailing separator for directories.
+        prefix = os.path.join(os.path.normpath(self.config.prefix), '')
+        forms = {}
+        for filename in filenames:
+            path = self._abspath(filename)
+            forms.setdefault(path, set()).add(filename)
+            forms.setdefault(path + os.sep, set()).add(filename)
+            if path.startswith(prefix):
+                forms.setdefault(path[len(prefix):], set()).add(filename)
+                forms.setdefault(path[len(prefix):] + os.sep, set()).add(filename)
+        forms = list(forms.items())
+        owners = {}
+        with self._lock:
+            # stay below the limit of variables of old SQLite versions
+            for i in range(0, len(forms), 500):
+                chunk = dict(forms[i:i+500])
+                query = ('SELECT path, package FROM files WHERE path IN (%s)' %
+                         ', '.join('?' * len(chunk)))
+                for path, package in self._connection.execute(query, list(chunk)):
+                    for filename in chunk[path]:
+                        owners.setdefault(filename, set()).add(package)
+        return dict((filename, sorted(packages))
+                    for filename, packages in owners.items())
+
+
+def open_packagedb(dbfile, config):
+    '''Return the package database of the configuration.'''
+    if getattr(config, 'packagedb_backend', 'files') == 'sqlite':
+        return SQLitePackageDB(dbfile, config)
+    return PackageDB(dbfile, config)
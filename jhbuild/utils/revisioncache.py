@@ -0,0 +1,157 @@
+# jhbuild - a tool to ease building collections of source packages
+# Copyright (C) 2026  The jhbuild authors
+#
+#   revisioncache.py: cache of the revisions of the checkouts
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''Cache of the revisions of the checkouts.
+
+Finding out the revision of a checkout (for the build policies, the
+snapshot and info commands) requires running the version control tool,
+several times per module.  Branches that can tell when their revision
+may have changed, through get_revision_stamp() (e.g. from the
+modification times of the files of the .git directory), have it cached:
+
+ - the revision checked out (the commit, without local changes) is kept
+   in revisions.json in top_builddir, as long as the stamp is unchanged;
+ - whether the checkout has local changes is kept for the duration of
+   the jhbuild process, as edits to the working tree do not change the
+   stamp.
+
+get_tree_ids() and probe_revisions() fill the cache for a list of
+modules, running the version control tool for several checkouts at the
+same time.
+'''
+
+import concurrent.futures
+import json
+import logging
+import os
+import threading
+
+from jhbuild.utils import fileutils
+
+__all__ = ['RevisionCache', 'get_revision_cache', 'get_tree_ids',
+           'probe_revisions']
+
+class RevisionCache:
+    version = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.revisions = None
+        self.dirty = {}
+        self.changed = False
+
+    def _load(self):
+        if self.revisions is not None:
+            return
+        self.revisions = {}
+        try:
+            with open(self.filename, encoding='utf-8') as fp:
+                data = json.load(fp)
+            if data.get('version') == self.version:
+                self.revisions = data['revisions']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            logging.debug('ignoring revision cache %s: %s', self.filename, e)
+
+    def _lookup(self, cache, key, stamp, compute):
+        with self.lock:
+            if cache is None:
+                self._load()
+                cache = self.revisions
+            entry = cache.get(key)
+            if entry is not None and entry[0] == stamp:
+                return entry[1]
+        value = compute()
+        with self.lock:
+            cache[key] = [stamp, value]
+            if cache is self.revisions:
+                self.changed = True
+        return value
+
+    def get_revision(self, branch, compute):
+        '''Return the revision checked out by branch, calling compute if
+        it is not cached.'''
+        stamp = branch.get_revision_stamp()
+        if stamp is None:
+            return compute()
+        return self._lookup(None, branch.get_checkoutdir(), stamp, compute)
+
+    def is_dirty(self, branch, compute):
+        '''Return whether branch has local changes, calling compute if it
+        is not known yet.'''
+        stamp = branch.get_revision_stamp()
+        if stamp is None:
+            return compute()
+        return self._lookup(self.dirty, branch.get_checkoutdir(), stamp, compute)
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            revisions = dict((path, entry) for path, entry in self.revisions.items()
+                             if os.path.exists(path))
+            try:
+                fileutils.mkdir_with_parents(os.path.dirname(self.filename))
+                writer = fileutils.SafeWriter(self.filename)
+                writer.fp.write(json.dumps({'version': self.version,
+                                            'revisions': revisions}).encode('utf-8'))
+                writer.commit()
+                self.changed = False
+            except OSError as e:
+                logging.debug('could not write revision cache %s: %s', self.filename, e)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_revision_cache(config):
+    '''Return the revision cache of the checkouts of config.'''
+    filename = os.path.join(config.top_builddir, 'revisions.json')
+    with _caches_lock:
+        if filename not in _caches:
+            _caches[filename] = RevisionCache(filename)
+        return _caches[filename]
+
+def get_tree_ids(config, modules, jobs=None):
+    '''Return the list of the tree ids of the checkouts of modules (None
+    for the modules that have none), finding them out jobs at a time.'''
+    def tree_id(module):
+        if getattr(module, 'branch', None) is None:
+            return None
+        try:
+            return module.branch.tree_id()
+        except (NotImplementedError, AttributeError):
+            return None
+
+    jobs = jobs or config.jobs or 1
+    with concurrent.futures.ThreadPoolExecutor(max(1, jobs)) as executor:
+        tree_ids = list(executor.map(tree_id, modules))
+    get_revision_cache(config).save()
+    return tree_ids
+
+def probe_revisions(config, modules, jobs=None):
+    '''Find out, jobs at a time, the revisions of the checkouts of
+    modules that support the revision cache, and save the cache.'''
+    modules = [module for module in modules
+               if getattr(module, 'branch', None) is not None and
+               getattr(module.branch, 'get_revision_stamp', None) is not None]
+    if modules:
+        get_tree_ids(config, modules, jobs)
@@ -0,0 +1,186 @@
+# jhbuild - a tool to ease building collections of source packages
+# Copyright (C) 2026  The jhbuild authors
+#
+#   tarballstore.py: content-addressed store of downloaded tarballs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''A content-addressed store of downloaded tarballs.
+
+Tarballs whose module declares a hash (e.g. sha256:...) are kept in the
+store under that hash, and linked into tarballdir when they are needed,
+so that several configurations (with their own tarballdir) download a
+tarball only once.  Files are hard linked when possible, otherwise
+cloned (on file systems supporting reflinks) or copied.
+
+A tarball of the store is checked against its hash whenever it is
+linked into a tarballdir, and removed from the store if it does not
+match.
+
+The modification time of a tarball of the store is updated when it is
+used; "jhbuild tarballs gc" removes the least recently used tarballs that
+no module refers to until the store fits in its maximum size.  Tarballs
+that are still hard linked from a tarballdir (of any configuration) are
+kept, as removing them would not free any space.
+'''
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from jhbuild.utils import _
+from jhbuild.utils import fileutils
+from jhbuild.utils.download import get_hash_algorithm, hash_file
+
+__all__ = ['TarballStore']
+
+# ioctl cloning a file on Linux (btrfs, xfs...)
+FICLONE = 0x40049409
+
+def _link_or_copy(src, dst):
+    '''Make dst a hard link to src, or failing that, a clone or a copy.'''
+    # the store is shared between processes, the temporary file must
+    # have a name of its own
+    fd, tmpname = tempfile.mkstemp(prefix='.' + os.path.basename(dst) + '.',
+                                   suffix='.tmp', dir=os.path.dirname(dst))
+    os.close(fd)
+    try:
+        try:
+            os.unlink(tmpname)
+            os.link(src, tmpname)
+        except OSError:
+            with open(src, 'rb') as src_fp, open(tmpname, 'wb') as dst_fp:
+                try:
+                    if fcntl is None:
+                        raise OSError()
+                    fcntl.ioctl(dst_fp.fileno(), FICLONE, src_fp.fileno())
+                except OSError:
+                    shutil.copyfileobj(src_fp, dst_fp, 1024 * 1024)
+        os.rename(tmpname, dst)
+    except BaseException:
+        fileutils.ensure_unlinked(tmpname)
+        raise
+
+class TarballStore:
+    def __init__(self, storedir, max_size):
+        self.storedir = storedir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    @classmethod
+    def create(cls, config):
+        '''Return the tarball store of the configuration, or None if
+        tarballs are not shared.'''
+        if not config.tarball_store:
+            return None
+        return cls(config.tarball_store_dir,
+                   config.tarball_store_size * 1024 * 1024)
+
+    def get_filename(self, source_hash):
+        '''Return the filename of the tarball of hash source_hash (of the
+        form algo:hexdigest), or None if the hash is not supported.'''
+        if not source_hash:
+            return None
+        algorithm = get_hash_algorithm(source_hash)
+        if algorithm is None:
+            return None
+        algo, hexdigest = algorithm
+        hexdigest = hexdigest.lower()
+        if not hexdigest.isalnum():
+            return None
+        return os.path.join(self.storedir, algo, hexdigest)
+
+    def has(self, source_hash):
+        filename = self.get_filename(source_hash)
+        return filename is not None and os.path.exists(filename)
+
+    def restore(self, source_hash, localfile):
+        '''Link the tarball of hash source_hash to localfile, returning
+        False if it is not in the store, or does not match its hash (it
+        is then removed from the store).'''
+        filename = self.get_filename(source_hash)
+        if filename is None:
+            return False
+        algo, hexdigest = get_hash_algorithm(source_hash)
+        try:
+            if hash_file(filename, algo).hexdigest() != hexdigest.lower():
+                logging.warning(_('Removing corrupted %s from the tarball store') %
+                                filename)
+                fileutils.ensure_unlinked(filename)
+                return False
+            os.utime(filename)
+            _link_or_copy(filename, localfile)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logging.warning(_('Could not link %(file)s from the tarball store: %(error)s') % {
+                    'file': localfile, 'error': e})
+            return False
+        return True
+
+    def store(self, source_hash, localfile):
+        '''Add localfile, a tarball of hash source_hash that has been
+        checked, to the store.'''
+        filename = self.get_filename(source_hash)
+        if filename is None or os.path.exists(filename):
+            return
+        try:
+            fileutils.mkdir_with_parents(os.path.dirname(filename))
+            _link_or_copy(localfile, filename)
+        except OSError as e:
+            logging.warning(_('Could not add %(file)s to the tarball store: %(error)s') % {
+                    'file': localfile, 'error': e})
+
+    def gc(self, referenced, max_size=None):
+        '''Remove the least recently used tarballs whose hashes are not in
+        referenced, and that are not linked from a tarballdir, until the
+        store fits in max_size bytes (the maximum size of the store if
+        None); return the number of tarballs and of bytes removed.'''
+        if max_size is None:
+            max_size = self.max_size
+        keep = set(filter(None, (self.get_filename(x) for x in referenced)))
+        with self.lock:
+            tarballs = []
+            total = 0
+            for dirpath, dirnames, filenames in os.walk(self.storedir):
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    total += st.st_size
+                    # a tarball linked from elsewhere is still in use,
+                    # and removing it would not free its space
+                    if path not in keep and st.st_nlink == 1:
+                        tarballs.append((st.st_mtime, st.st_size, path))
+            tarballs.sort()
+            removed = removed_size = 0
+            for mtime, size, path in tarballs:
+                if total <= max_size:
+                    break
+                logging.debug('removing tarball %s', path)
+                fileutils.ensure_unlinked(path)
+                total -= size
+                removed += 1
+                removed_size += size
+            return removed, removed_size
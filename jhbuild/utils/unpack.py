@@ -17,7 +17,9 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import logging
 import tarfile
+import time
 import zipfile
 import os.path
 import tempfile
@@ -110,6 +112,27 @@ def unpack_zip_file(localfile, target_directory):
         os.chmod(os.path.join(target_directory, pkg_file), attr_to_file_perm(chost, attr))
 
 
+# commands decompressing to their standard output, by extension, the
+# multi-threaded ones first
+DECOMPRESSORS = {
+    '.lzma': ['lzcat -d'],
+    '.xz': ['xz -T0 -dc', 'xzcat -d'],
+    '.zst': ['zstd -dc'],
+    '.bz2': ['lbzip2 -dc', 'pbzip2 -dc', 'bunzip2 -dc'],
+    '.gz': ['pigz -dc', 'gzip -dc'],
+    '.tgz': ['pigz -dc', 'gzip -dc'],
+}
+
+def get_decompressor(localfile):
+    '''Return the command decompressing localfile to its standard output,
+    or None if there is none.'''
+    ext = os.path.splitext(localfile)[-1]
+    for command in DECOMPRESSORS.get(ext, []):
+        if has_command(command.split()[0]):
+            return command
+    return None
+
+
 def unpack_archive(buildscript, localfile, target_directory, checkoutdir=None):
     """
     Unpack @localfile to @target_directory; if @checkoutdir is specified make
@@ -119,18 +142,11 @@ def unpack_archive(buildscript, localfile, target_directory, checkoutdir=None):
         final_target_directory = target_directory
         target_directory = tempfile.mkdtemp(dir=final_target_directory)
 
+    start = time.time()
     ext = os.path.splitext(localfile)[-1]
-    if ext == '.lzma' and has_command('lzcat') and has_command('tar'):
-        buildscript.execute('lzcat -d "%s" | tar xf -' % localfile,
-                cwd=target_directory)
-    elif ext == '.xz' and has_command('xzcat') and has_command('tar'):
-        buildscript.execute('xzcat -d "%s" | tar xf -' % localfile,
-                cwd=target_directory)
-    elif ext == '.bz2' and has_command('bunzip2') and has_command('tar'):
-        buildscript.execute('bunzip2 -dc "%s" | tar xf -' % localfile,
-                cwd=target_directory)
-    elif ext in ('.gz', '.tgz') and has_command('gzip') and has_command('tar'):
-        buildscript.execute('gzip -dc "%s" | tar xf -' % localfile,
+    decompressor = get_decompressor(localfile)
+    if decompressor and has_command('tar'):
+        buildscript.execute('%s "%s" | tar xf -' % (decompressor, localfile),
                 cwd=target_directory)
     elif ext == '.zip' and has_command('unzip'):
         buildscript.execute('unzip "%s"' % localfile,
@@ -145,6 +161,11 @@ def unpack_archive(buildscript, localfile, target_directory, checkoutdir=None):
                 raise CommandError(_('Failed to unpack %s (unknown archive type)') % localfile)
         except Exception:
             raise CommandError(_('Failed to unpack %s') % localfile)
+    elapsed = max(time.time() - start, 0.001)
+    size = os.path.getsize(localfile) / 2.0**20
+    logging.info(_('Unpacked %(file)s (%(size).1f MiB in %(time).1fs, %(speed).1f MiB/s)') % {
+            'file': os.path.basename(localfile), 'size': size,
+            'time': elapsed, 'speed': size / elapsed})
 
     if checkoutdir:
         # tarball has been extracted in $destdir/$tmp/, check, then move the
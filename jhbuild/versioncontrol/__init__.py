@@ -22,11 +22,13 @@ __all__ = [
     'Branch',
     'register_repo_type',
     'get_repo_type',
+    'get_url_host',
     ]
 
 __metaclass__ = type
 
 import os
+import re
 import urllib.error
 import urllib.parse
 
@@ -34,6 +36,21 @@ from jhbuild.errors import FatalError, CommandError, BuildStateError
 from jhbuild.modtypes import get_branch
 from jhbuild.utils import httpcache, try_import_module, _
 
+def get_url_host(url):
+    """Return the host name part of url, also accepting the scp-like
+    [user@]host:path syntax of ssh URLs, or None if there is none."""
+    if not isinstance(url, str):
+        return None
+    try:
+        host = urllib.parse.urlparse(url).hostname
+    except ValueError:
+        host = None
+    if host is None and '://' not in url:
+        match = re.match(r'(?:[^@/]+@)?([^:/]{2,}):', url)
+        if match:
+            host = match.group(1).lower()
+    return host
+
 class Repository:
     """An abstract class representing a collection of modules."""
 
@@ -132,6 +149,11 @@ class Branch:
            May raise NotImplementedError if cannot check a given branch."""
         raise NotImplementedError
 
+    def get_host(self):
+        """Return the name of the host the branch is fetched from, or
+        None for local or unknown locations."""
+        return get_url_host(self.module)
+
     def get_module_basename(self):
         # prevent basename() from returning empty strings on trailing '/'
         module = self.module.rstrip(os.sep)
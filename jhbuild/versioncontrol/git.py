@@ -31,10 +31,11 @@ import sys
 
 from jhbuild.errors import FatalError, CommandError
 from jhbuild.utils.cmds import get_output, check_version
-from jhbuild.versioncontrol import Repository, Branch, register_repo_type
+from jhbuild.versioncontrol import Repository, Branch, register_repo_type, get_url_host
 from jhbuild.utils import inpath, _, uprint
 from jhbuild.utils.sxml import sxml
 from jhbuild.utils import udecode
+from jhbuild.utils.revisioncache import get_revision_cache
 
 # Make sure that the urlparse module considers git:// and git+ssh://
 # schemes to be netloc aware and set to allow relative URIs.
@@ -68,6 +69,102 @@ class GitUnknownBranchNameError(Exception):
     pass
 
 
+class GitCheckoutState:
+    """The state of a git checkout: its branch, whether it has local
+    changes, and its references.
+
+    It is read with a single git status and a single git for-each-ref, on
+    first use, instead of running git for every question.  The state is
+    tied to the revision stamp of the checkout, and it has to be dropped
+    after running a git command that changes the checkout.
+    """
+
+    state_minimum_version = '2.16'
+
+    def __init__(self, checkoutdir, stamp):
+        self.checkoutdir = checkoutdir
+        self.stamp = stamp
+        self._status = None
+        self._refs = None
+
+    def _get_output(self, cmd):
+        return get_output(cmd, cwd=self.checkoutdir, extra_env=get_git_extra_env())
+
+    def _get_status(self):
+        if self._status is not None:
+            return self._status
+        # --no-optional-locks keeps git status from refreshing the index,
+        # which would change the revision stamp
+        output = self._get_output(['git', '--no-optional-locks', 'status',
+                '--porcelain=v2', '--branch', '--untracked-files=no',
+                '--ignore-submodules=all'])
+        branch = commit = None
+        dirty = False
+        for line in output.splitlines():
+            if line.startswith('# branch.head '):
+                branch = line[len('# branch.head '):]
+                if branch == '(detached)':
+                    branch = None
+            elif line.startswith('# branch.oid '):
+                commit = line[len('# branch.oid '):]
+                if commit == '(initial)':
+                    commit = None
+            elif line and not line.startswith('#'):
+                # a changed, renamed or unmerged tracked file
+                dirty = True
+        self._status = (branch, commit, dirty)
+        return self._status
+
+    def _get_refs(self):
+        if self._refs is not None:
+            return self._refs
+        output = self._get_output(['git', 'for-each-ref',
+                '--format=%(refname)%09%(symref)%09%(upstream:remotename)'])
+        self._refs = {}
+        for line in output.splitlines():
+            refname, symref, remote = line.split('\t')
+            self._refs[refname] = (symref, remote)
+        return self._refs
+
+    @property
+    def branch(self):
+        """The name of the branch checked out, None if HEAD is detached."""
+        return self._get_status()[0]
+
+    @property
+    def commit(self):
+        return self._get_status()[1]
+
+    @property
+    def dirty(self):
+        """Whether tracked files (submodules aside) differ from HEAD."""
+        return self._get_status()[2]
+
+    def has_ref(self, refname):
+        return refname in self._get_refs()
+
+    def has_ref_ending_with(self, name):
+        """Whether a reference matches name, as with git show-ref."""
+        return any(refname.endswith('/' + name) for refname in self._get_refs())
+
+    def get_remote(self, branch):
+        """Return the remote the local branch tracks, or None."""
+        symref, remote = self._get_refs().get('refs/heads/' + branch, (None, None))
+        return remote or None
+
+    def get_remote_branches(self):
+        """Return the remote branches, as listed by git branch -r."""
+        branches = []
+        for refname, (symref, remote) in self._get_refs().items():
+            if not refname.startswith('refs/remotes/'):
+                continue
+            name = refname[len('refs/remotes/'):]
+            if symref.startswith('refs/remotes/'):
+                name += ' -> ' + symref[len('refs/remotes/'):]
+            branches.append(name)
+        return sorted(branches)
+
+
 class GitRepository(Repository):
     """A class representing a GIT repository.
 
@@ -148,10 +245,21 @@ class GitBranch(Branch):
         if version and not tag:
             raise FatalError(_('Cannot set "version" of a git branch without "tag"'))
         self.unmirrored_module = unmirrored_module
+        self._state = None
+
+    def get_host(self):
+        # the mirror is local, the network is only used to update it
+        return get_url_host(self.unmirrored_module or self.module)
+
+    # results of check_version_git(), as it is called for every branch
+    _git_version_checks = {}
 
     def check_version_git(self, version_spec):
-        return check_version(['git', '--version'], r'git version ([\d.]+)',
-                version_spec, extra_env=get_git_extra_env())
+        if version_spec not in self._git_version_checks:
+            self._git_version_checks[version_spec] = check_version(
+                    ['git', '--version'], r'git version ([\d.]+)',
+                    version_spec, extra_env=get_git_extra_env())
+        return self._git_version_checks[version_spec]
 
     def get_module_basename(self):
         # prevent basename() from returning empty strings on trailing '/'
@@ -187,11 +295,41 @@ class GitBranch(Branch):
             return False
         return True
 
+    def _get_state(self):
+        """Return the state of the checkout, None if git is too old to
+        read it at once."""
+        if not self.check_version_git(GitCheckoutState.state_minimum_version):
+            return None
+        stamp = self.get_revision_stamp()
+        if self._state is None or self._state.stamp != stamp:
+            self._state = GitCheckoutState(self.get_checkoutdir(), stamp)
+        return self._state
+
+    def _execute_git(self, buildscript, cmd):
+        """Run a git command that changes the checkout."""
+        try:
+            buildscript.execute(cmd, cwd=self.get_checkoutdir(),
+                    extra_env=get_git_extra_env())
+        finally:
+            self._state = None
+
     def is_local_branch(self, branch):
-        is_local_head = self.execute_git_predicate( ['git', 'show-ref', '--quiet',
-                                                     '--verify', 'refs/heads/' + branch])
-        if is_local_head:
-            return True
+        state = self._get_state()
+        if state is None:
+            is_local_head = self.execute_git_predicate( ['git', 'show-ref', '--quiet',
+                                                         '--verify', 'refs/heads/' + branch])
+            if is_local_head:
+                return True
+        else:
+            # the references git rev-parse would resolve branch to
+            try:
+                for refname in (branch, 'refs/' + branch, 'refs/tags/' + branch,
+                                'refs/heads/' + branch, 'refs/remotes/' + branch,
+                                'refs/remotes/%s/HEAD' % branch):
+                    if state.has_ref(refname):
+                        return True
+            except CommandError:
+                return False
         return self.execute_git_predicate(['git', 'rev-parse', branch])
 
     def is_inside_work_tree(self):
@@ -201,11 +339,29 @@ class GitBranch(Branch):
     def is_tracking_a_remote_branch(self, local_branch):
         if not local_branch:
             return False
+        state = self._get_state()
+        if state is not None:
+            try:
+                return state.get_remote(local_branch) is not None
+            except CommandError:
+                return False
         current_branch_remote_config = 'branch.%s.remote' % local_branch
         return self.execute_git_predicate(
                 ['git', 'config', '--get', current_branch_remote_config])
 
     def is_dirty(self, ignore_submodules=True):
+        if not ignore_submodules:
+            return self._is_dirty(ignore_submodules)
+        return get_revision_cache(self.config).is_dirty(
+                self, lambda: self._is_dirty(ignore_submodules))
+
+    def _is_dirty(self, ignore_submodules):
+        state = self._get_state()
+        if state is not None and ignore_submodules:
+            try:
+                return state.dirty
+            except CommandError:
+                return True
         submodule_options = []
         if ignore_submodules:
             submodule_options = ['--ignore-submodules']
@@ -213,8 +369,50 @@ class GitBranch(Branch):
                 ['git', 'diff', '--exit-code', '--quiet'] + submodule_options
                 + ['HEAD'])
 
+    def get_revision_stamp(self):
+        '''Return the state of the files of the .git directory that change
+        when HEAD moves or the index is updated, or None if the checkout
+        is not a git repository.'''
+        checkoutdir = self.get_checkoutdir()
+        gitdir = os.path.join(checkoutdir, '.git')
+        try:
+            if os.path.isfile(gitdir):
+                # submodules and worktrees
+                with open(gitdir) as fp:
+                    content = fp.read().strip()
+                if not content.startswith('gitdir:'):
+                    return None
+                gitdir = os.path.join(checkoutdir, content[len('gitdir:'):].strip())
+            with open(os.path.join(gitdir, 'HEAD')) as fp:
+                head = fp.read().strip()
+            commondir = gitdir
+            if os.path.exists(os.path.join(gitdir, 'commondir')):
+                with open(os.path.join(gitdir, 'commondir')) as fp:
+                    commondir = os.path.join(gitdir, fp.read().strip())
+        except OSError:
+            return None
+        paths = [os.path.join(gitdir, 'index'),
+                 os.path.join(commondir, 'packed-refs')]
+        if head.startswith('ref: '):
+            paths.append(os.path.join(commondir, head[len('ref: '):]))
+        stamp = [head]
+        for path in paths:
+            try:
+                st = os.stat(path)
+                stamp.append([st.st_ino, st.st_mtime_ns, st.st_size])
+            except OSError:
+                stamp.append(None)
+        return stamp
+
     def get_current_branch(self):
         """Returns either a branchname or None if head is detached"""
+        state = self._get_state()
+        if state is not None:
+            try:
+                return state.branch
+            except CommandError:
+                raise CommandError(_('Unexpected: Checkoutdir is not a git '
+                        'repository:' + self.get_checkoutdir()))
         if not self.is_inside_work_tree():
             raise CommandError(_('Unexpected: Checkoutdir is not a git '
                     'repository:' + self.get_checkoutdir()))
@@ -232,11 +430,19 @@ class GitBranch(Branch):
         """Try to find the given branch first, locally, then remotely, and state
         the availability in the return value."""
         wanted_ref = remote_name + '/' + branch_name
-        if self.execute_git_predicate( ['git', 'show-ref', wanted_ref]):
+        if self._has_ref_ending_with(wanted_ref):
             return True
-        buildscript.execute(['git', 'fetch'], cwd=self.get_checkoutdir(),
-                extra_env=get_git_extra_env())
-        return self.execute_git_predicate( ['git', 'show-ref', wanted_ref])
+        self._execute_git(buildscript, ['git', 'fetch'])
+        return self._has_ref_ending_with(wanted_ref)
+
+    def _has_ref_ending_with(self, name):
+        state = self._get_state()
+        if state is None:
+            return self.execute_git_predicate(['git', 'show-ref', name])
+        try:
+            return state.has_ref_ending_with(name)
+        except CommandError:
+            return False
 
     def get_default_branch_name(self):
         try:
@@ -303,10 +509,9 @@ class GitBranch(Branch):
                         wanted_branch, 'origin/' + wanted_branch]
 
         if switch_command:
-            if self.is_dirty():
+            if self._is_dirty(ignore_submodules=True):
                 raise CommandError(_('Refusing to switch a dirty tree.'))
-            buildscript.execute(switch_command, cwd=self.get_checkoutdir(),
-                    extra_env=get_git_extra_env())
+            self._execute_git(buildscript, switch_command)
 
     def rebase_current_branch(self, buildscript):
         """Pull the current branch if it is tracking a remote branch."""
@@ -314,11 +519,7 @@ class GitBranch(Branch):
         if not self.is_tracking_a_remote_branch(branch):
             return
 
-        git_extra_args = {'cwd': self.get_checkoutdir(),
-                'extra_env': get_git_extra_env()}
-
-        buildscript.execute(['git', 'rebase', 'origin/' + branch],
-                            **git_extra_args)
+        self._execute_git(buildscript, ['git', 'rebase', 'origin/' + branch])
 
     def move_to_sticky_date(self, buildscript):
         if self.config.quiet_mode:
@@ -328,22 +529,22 @@ class GitBranch(Branch):
         commit = self._get_commit_from_date()
         branch = 'jhbuild-date-branch'
         branch_cmd = ['git', 'checkout'] + quiet + [branch]
-        git_extra_args = {'cwd': self.get_checkoutdir(),
-                'extra_env': get_git_extra_env()}
         if self.config.sticky_date == 'none':
             current_branch = self.get_current_branch()
             if current_branch and current_branch == branch:
-                buildscript.execute(['git', 'checkout'] + quiet + ['master'],
-                        **git_extra_args)
+                self._execute_git(buildscript, ['git', 'checkout'] + quiet + ['master'])
             return
         try:
-            buildscript.execute(branch_cmd, **git_extra_args)
+            self._execute_git(buildscript, branch_cmd)
         except CommandError:
             branch_cmd = ['git', 'checkout'] + quiet + ['-b', branch]
-            buildscript.execute(branch_cmd, **git_extra_args)
-        buildscript.execute(['git', 'reset', '--hard', commit], **git_extra_args)
+            self._execute_git(buildscript, branch_cmd)
+        self._execute_git(buildscript, ['git', 'reset', '--hard', commit])
 
     def get_remote_branches_list(self):
+        state = self._get_state()
+        if state is not None:
+            return state.get_remote_branches()
         return [x.strip() for x in get_output(['git', 'branch', '-r'],
                 cwd=self.get_checkoutdir(),
                 extra_env=get_git_extra_env()).splitlines()]
@@ -399,12 +600,8 @@ class GitBranch(Branch):
 
     def _update_submodules(self, buildscript):
         if os.path.exists(os.path.join(self.get_checkoutdir(), '.gitmodules')):
-            cmd = ['git', 'submodule', 'init']
-            buildscript.execute(cmd, cwd=self.get_checkoutdir(),
-                    extra_env=get_git_extra_env())
-            cmd = ['git', 'submodule', 'update']
-            buildscript.execute(cmd, cwd=self.get_checkoutdir(),
-                    extra_env=get_git_extra_env())
+            self._execute_git(buildscript, ['git', 'submodule', 'init'])
+            self._execute_git(buildscript, ['git', 'submodule', 'update'])
 
     def update_dvcs_mirror(self, buildscript):
         if not self.config.dvcs_mirror_dir:
@@ -420,12 +617,57 @@ class GitBranch(Branch):
             buildscript.execute(['git', 'remote', 'set-url', 'origin',
                     self.unmirrored_module], cwd=mirror_dir,
                     extra_env=get_git_extra_env())
+            if self.config.dvcs_mirror_alternates:
+                self._protect_mirror_objects(buildscript, mirror_dir)
             buildscript.execute(['git', 'fetch'], cwd=mirror_dir,
                     extra_env=get_git_extra_env())
         else:
             buildscript.execute(
                     ['git', 'clone', '--mirror', self.unmirrored_module,
                     mirror_dir], extra_env=get_git_extra_env())
+            if self.config.dvcs_mirror_alternates:
+                self._protect_mirror_objects(buildscript, mirror_dir)
+
+    def _protect_mirror_objects(self, buildscript, mirror_dir):
+        # checkouts borrowing the objects of the mirror may still refer
+        # to objects that are no longer reachable from its references;
+        # never let the garbage collection of the mirror remove them
+        buildscript.execute(['git', 'config', 'gc.pruneExpire', 'never'],
+                cwd=mirror_dir, extra_env=get_git_extra_env())
+        buildscript.execute(['git', 'config', 'gc.reflogExpireUnreachable', 'never'],
+                cwd=mirror_dir, extra_env=get_git_extra_env())
+
+    def _get_alternates(self):
+        """Return the list of the object directories the checkout borrows
+        objects from."""
+        objects = os.path.join(self.get_checkoutdir(), '.git', 'objects')
+        try:
+            with open(os.path.join(objects, 'info', 'alternates')) as fp:
+                return [os.path.join(objects, line.strip()) for line in fp
+                        if line.strip() and not line.startswith('#')]
+        except OSError:
+            return []
+
+    def _check_alternates(self):
+        for path in self._get_alternates():
+            if not os.path.isdir(path):
+                raise CommandError(_('%(dir)s borrows objects from %(path)s, which '
+                                     'no longer exists (the checkout has to be '
+                                     'removed)') % {'dir': self.get_checkoutdir(),
+                                                    'path': path})
+
+    def dissociate(self):
+        """Copy into the checkout the objects it borrows from the DVCS
+        mirror, so that it no longer depends on it; return False if it did
+        not borrow any."""
+        if not self._get_alternates():
+            return False
+        self._check_alternates()
+        cwd = self.get_checkoutdir()
+        get_output(['git', 'repack', '-a', '-d', '-q'], cwd=cwd,
+                   extra_env=get_git_extra_env())
+        os.remove(os.path.join(cwd, '.git', 'objects', 'info', 'alternates'))
+        return True
 
     def _checkout(self, buildscript, copydir=None):
 
@@ -433,7 +675,10 @@ class GitBranch(Branch):
         if self.config.quiet_mode:
             extra_opts.append('-q')
 
-        if self.config.shallow_clone:
+        if self.unmirrored_module and self.config.dvcs_mirror_alternates:
+            # borrow the objects of the mirror instead of copying them
+            extra_opts.append('--shared')
+        elif self.config.shallow_clone:
             extra_opts += ['--depth=1', '--no-single-branch']
 
         self.update_dvcs_mirror(buildscript)
@@ -458,26 +703,26 @@ class GitBranch(Branch):
 
     def _update(self, buildscript, copydir=None, update_mirror=True):
         cwd = self.get_checkoutdir()
-        git_extra_args = {'cwd': cwd, 'extra_env': get_git_extra_env()}
 
         if not os.path.exists(os.path.join(cwd, '.git')):
             if os.path.exists(os.path.join(cwd, '.svn')):
                 raise CommandError(_('Failed to update module as it switched to git (you should check for changes then remove the directory).'))
             raise CommandError(_('Failed to update module (missing .git) (you should check for changes then remove the directory).'))
 
+        self._check_alternates()
+
         if update_mirror:
             self.update_dvcs_mirror(buildscript)
 
-        buildscript.execute(['git', 'remote', 'set-url', 'origin',
-                self.module], **git_extra_args)
+        self._execute_git(buildscript, ['git', 'remote', 'set-url', 'origin',
+                self.module])
 
-        buildscript.execute(['git', 'remote', 'update', 'origin'],
-                **git_extra_args)
+        self._execute_git(buildscript, ['git', 'remote', 'update', 'origin'])
 
         stashed = False
-        if self.is_dirty(ignore_submodules=True):
+        if self._is_dirty(ignore_submodules=True):
             stashed = True
-            buildscript.execute(['git', 'stash', 'save', 'jhbuild-stash'], **git_extra_args)
+            self._execute_git(buildscript, ['git', 'stash', 'save', 'jhbuild-stash'])
 
         if self.config.sticky_date:
             self.move_to_sticky_date(buildscript)
@@ -489,15 +734,18 @@ class GitBranch(Branch):
         self._update_submodules(buildscript)
 
         if stashed:
-            buildscript.execute(['git', 'stash', 'pop'], **git_extra_args)
+            self._execute_git(buildscript, ['git', 'stash', 'pop'])
 
         if self.patches:
             self._do_patches(buildscript)
 
     def _do_patches(self, buildscript):
         patch_files = self.get_patch_files(buildscript)
-        for (patchfile, patch, patchstrip) in patch_files:
-            self._do_patch(buildscript, patchfile, patch)
+        try:
+            for (patchfile, patch, patchstrip) in patch_files:
+                self._do_patch(buildscript, patchfile, patch)
+        finally:
+            self._state = None
 
     def _do_patch(self, buildscript, patchfile, patch):
         git_extra_args = {'cwd': self.get_checkoutdir(), 'extra_env': get_git_extra_env()}
@@ -529,9 +777,13 @@ class GitBranch(Branch):
         git_extra_args = {'cwd': self.get_checkoutdir(), 'extra_env': get_git_extra_env()}
         buildscript.execute(['git', 'clean', '-d', '-f', '-x'], **git_extra_args)
 
-    def tree_id(self):
-        if not os.path.exists(self.get_checkoutdir()):
-            return None
+    def _get_head_commit(self):
+        state = self._get_state()
+        if state is not None:
+            try:
+                return state.commit
+            except CommandError:
+                return None
         try:
             output = get_output(['git', 'rev-parse', 'HEAD'],
                     cwd = self.get_checkoutdir(), get_stderr=False,
@@ -540,10 +792,19 @@ class GitBranch(Branch):
             return None
         except GitUnknownBranchNameError:
             return None
+        return output.strip()
+
+    def tree_id(self):
+        if not os.path.exists(self.get_checkoutdir()):
+            return None
+        commit = get_revision_cache(self.config).get_revision(
+                self, self._get_head_commit)
+        if commit is None:
+            return None
         id_suffix = ''
         if self.is_dirty():
             id_suffix = self.dirty_branch_suffix
-        return output.strip() + id_suffix
+        return commit + id_suffix
 
     def to_sxml(self):
         attrs = {}
@@ -22,7 +22,8 @@ __metaclass__ = type
 
 import os
 import hashlib
-import logging
+import json
+import stat
 import urllib.error
 import urllib.parse
 import urllib.request
@@ -31,6 +32,8 @@ import zipfile
 from jhbuild.errors import FatalError, CommandError, BuildStateError
 from jhbuild.versioncontrol import Repository, Branch, register_repo_type
 from jhbuild.utils.cmds import has_command, get_output
+from jhbuild.utils.download import download, get_hash_algorithm, hash_file
+from jhbuild.utils.tarballstore import TarballStore
 from jhbuild.utils.unpack import unpack_archive
 from jhbuild.utils import _
 from jhbuild.utils.sxml import sxml
@@ -128,6 +131,8 @@ class TarballBranch(Branch):
             localdir = localdir[:-9]
         elif localdir.endswith('.tar.xz'):
             localdir = localdir[:-7]
+        elif localdir.endswith('.tar.zst'):
+            localdir = localdir[:-8]
         elif localdir.endswith('.tgz'):
             localdir = localdir[:-4]
         elif localdir.endswith('.zip'):
@@ -158,49 +163,23 @@ class TarballBranch(Branch):
                         _('downloaded file size is incorrect (expected %(size1)d, got %(size2)d)')
                                       % {'size1':self.source_size, 'size2':local_size})
         if self.source_hash is not None:
-            try:
-                algo, hash = self.source_hash.split(':')
-            except ValueError:
-                logging.warning(_('invalid hash attribute on module %s') % self.module)
+            algorithm = get_hash_algorithm(self.source_hash)
+            if algorithm is None:
                 return
-            if hasattr(hashlib, algo):
-                local_hash = getattr(hashlib, algo)()
-
-                fp = open(localfile, 'rb')
-                data = fp.read(32768)
-                while data:
-                    local_hash.update(data)
-                    data = fp.read(32768)
-                fp.close()
-                if local_hash.hexdigest() != hash:
-                    raise BuildStateError(
-                            _('file hash is incorrect (expected %(sum1)s, got %(sum2)s)')
-                            % {'sum1':hash, 'sum2':local_hash.hexdigest()})
-            else:
-                logging.warning(_('skipped hash check (missing support for %s)') % algo)
+            algo, hash = algorithm
+            local_hash = hash_file(localfile, algo).hexdigest()
+            if local_hash != hash:
+                raise BuildStateError(
+                        _('file hash is incorrect (expected %(sum1)s, got %(sum2)s)')
+                        % {'sum1':hash, 'sum2':local_hash})
 
     def _download_tarball(self, buildscript, localfile):
+        """Downloads the tarball off the internet, checking its size and
+        hash as it is downloaded."""
         if not os.access(self.config.tarballdir, os.R_OK|os.W_OK|os.X_OK):
             raise FatalError(_('tarball dir (%s) must be writable') % self.config.tarballdir)
-        """Downloads the tarball off the internet, using wget or curl."""
-        extra_env = {
-            'LD_LIBRARY_PATH': os.environ.get('UNMANGLED_LD_LIBRARY_PATH'),
-            'PATH': os.environ.get('UNMANGLED_PATH')
-            }
-        lines = [
-            ['wget', '--continue', self.module, '-O', localfile],
-            ['curl', '--retry', '5', '--fail', '--continue-at', '-', '-L', self.module, '-o', localfile]
-            ]
-        lines = [line for line in lines if has_command(line[0])]
-        if not lines:
-            raise FatalError(_("unable to find wget or curl"))
-        try:
-            return buildscript.execute(lines[0], extra_env = extra_env)
-        except CommandError:
-            # Cleanup potential leftover file
-            if os.path.exists(localfile):
-                os.remove(localfile)
-            raise
+        download(buildscript, self.module, localfile,
+                 self.source_size, self.source_hash)
 
     def _download_and_unpack(self, buildscript):
         localfile = self._local_tarball
@@ -213,9 +192,13 @@ class TarballBranch(Branch):
         try:
             self._check_tarball()
         except BuildStateError:
-            # don't have the tarball, try downloading it and check again
-            self._download_tarball(buildscript, localfile)
-            self._check_tarball()
+            # don't have the tarball, look for it in the tarball store,
+            # otherwise download it
+            store = TarballStore.create(self.config)
+            if store is None or not store.restore(self.source_hash, localfile):
+                self._download_tarball(buildscript, localfile)
+                if store is not None:
+                    store.store(self.source_hash, localfile)
 
         # now to unpack it
         try:
@@ -230,6 +213,66 @@ class TarballBranch(Branch):
         if self.patches:
             self._do_patches(buildscript)
 
+        self._write_unpack_stamp()
+
+    @property
+    def _unpack_stamp(self):
+        # kept beside the sources, so that it does not end up in them
+        # (and in the tarballs made from them)
+        return self.raw_srcdir + '.jhbuild-unpacked'
+
+    def _get_sources_id(self):
+        """Return what the unpacked sources are made of: the tarball and
+        the patches applied."""
+        if self.source_hash:
+            tarball = self.source_hash
+        else:
+            st = os.stat(self._local_tarball)
+            tarball = '%s:%d:%d' % (os.path.basename(self._local_tarball),
+                                    st.st_size, st.st_mtime_ns)
+        return {'tarball': tarball,
+                'patches': [[patch, strip] for patch, strip in self.patches]}
+
+    def _get_tree_state(self):
+        """Return a fingerprint of the unpacked sources: a hash of the
+        path, type, size and modification time of every file, which
+        changes when they are modified, or files are added or removed."""
+        fingerprint = hashlib.sha1()
+        for dirpath, dirnames, filenames in os.walk(self.raw_srcdir):
+            dirnames.sort()
+            for name in sorted(filenames + dirnames):
+                path = os.path.join(dirpath, name)
+                st = os.lstat(path)
+                if stat.S_ISDIR(st.st_mode):
+                    # the directory itself only changes with its contents
+                    entry = '%s\0d\n' % path
+                else:
+                    entry = '%s\0%o:%d:%d\n' % (
+                            path, stat.S_IFMT(st.st_mode), st.st_size, st.st_mtime_ns)
+                fingerprint.update(os.fsencode(entry))
+        return fingerprint.hexdigest()
+
+    def _write_unpack_stamp(self):
+        stamp = {'sources': self._get_sources_id(),
+                 'tree': self._get_tree_state()}
+        with open(self._unpack_stamp, 'w') as fp:
+            json.dump(stamp, fp)
+
+    def _check_unpacked(self, check_tree):
+        """Return True if the sources were unpacked from the current
+        tarball and patches (and left unchanged since, if check_tree is
+        True), False if they were not, or None if this is unknown."""
+        try:
+            with open(self._unpack_stamp) as fp:
+                stamp = json.load(fp)
+            if stamp['sources'] != self._get_sources_id():
+                return False
+            if check_tree:
+                return stamp['tree'] == self._get_tree_state()
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return True
+
     def _do_patches(self, buildscript):
         # now patch the working tree
         patch_files = self.get_patch_files(buildscript)
@@ -275,7 +318,10 @@ class TarballBranch(Branch):
             zipped_path.write(self._local_tarball, arcname=os.path.basename(self._local_tarball))
 
     def checkout(self, buildscript):
-        if self.checkout_mode == 'clobber':
+        # the sources are unpacked again if the tarball or the patches
+        # changed, or in clobber mode, if they were modified since
+        unpacked = self._check_unpacked(self.checkout_mode == 'clobber')
+        if unpacked is False or (unpacked is None and self.checkout_mode == 'clobber'):
             self._wipedir(buildscript, self.raw_srcdir)
         if not os.path.exists(self.srcdir):
             self._download_and_unpack(buildscript)
@@ -288,6 +334,9 @@ class TarballBranch(Branch):
     def may_checkout(self, buildscript):
         if os.path.exists(self._local_tarball):
             return True
+        store = TarballStore.create(self.config)
+        if store is not None and store.has(self.source_hash):
+            return True
         elif buildscript.config.nonetwork:
             return False
         return True
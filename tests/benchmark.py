@@ -0,0 +1,343 @@
+#! /usr/bin/env python3
+# jhbuild - a tool to ease building collections of source packages
+# Copyright (C) 2026  The jhbuild authors
+#
+#   benchmark.py: benchmarks of jhbuild internals
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''Benchmarks of jhbuild internals.
+
+Run from the top source directory as:
+
+    python3 -m tests.benchmark [benchmark...]
+
+Without arguments, all benchmarks are run.
+'''
+
+import builtins
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import xml.dom.minidom
+
+SRCDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+builtins.__dict__['PKGDATADIR'] = None
+builtins.__dict__['DATADIR'] = None
+builtins.__dict__['SRCDIR'] = SRCDIR
+
+sys.path.insert(0, SRCDIR)
+
+import jhbuild.config
+import jhbuild.moduleset
+from jhbuild.modtypes import Package
+from jhbuild.utils import revisioncache
+from jhbuild.utils.packagedb import PackageDB
+from jhbuild.versioncontrol.git import GitRepository
+
+from . import mock
+
+
+class BenchmarkConfig(jhbuild.config.Config):
+    def setup_env(self):
+        pass
+
+
+def make_config():
+    config = BenchmarkConfig(None, [])
+    config.use_local_modulesets = True
+    config.modulesets_dir = os.path.join(SRCDIR, 'modulesets')
+    return config
+
+
+def timeit(func, repeat=5):
+    '''Return the best time, in seconds, of repeat calls to func.'''
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def report(name, seconds, detail=''):
+    print('  %-40s %10.2f ms  %s' % (name, seconds * 1000, detail))
+
+
+def peak_memory(func):
+    '''Return the peak memory, in bytes, allocated during a call to func.'''
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def synthetic_moduleset(count, seed=0):
+    '''Return a module set of count modules, laid out in layers, each module
+    having a few dependencies, suggests and afters in the lower layers.'''
+    rnd = random.Random(seed)
+    module_set = jhbuild.moduleset.ModuleSet(mock.Config(), db=mock.PackageDB())
+    names = ['module%05d' % i for i in range(count)]
+    layer_size = 200
+    for i, name in enumerate(names):
+        module = Package(name)
+        lower = names[:i - i % layer_size]
+        if lower:
+            module.dependencies = rnd.sample(lower, min(len(lower), rnd.randint(1, 6)))
+            module.suggests = rnd.sample(lower, min(len(lower), rnd.randint(0, 2)))
+            module.after = rnd.sample(lower, min(len(lower), rnd.randint(0, 2)))
+        module_set.add(module)
+    return module_set
+
+
+def bench_resolve():
+    '''Dependency resolution (ModuleSet.get_full_module_list)'''
+    config = make_config()
+    for moduleset in ('gnome-suites-core-deps-latest', 'gnome-world'):
+        config.moduleset = moduleset
+        module_set = jhbuild.moduleset.load(config)
+        report(moduleset, timeit(module_set.get_full_module_list),
+               '%d modules' % len(module_set.modules))
+
+    for count in (1000, 10000):
+        module_set = synthetic_moduleset(count)
+        report('synthetic', timeit(module_set.get_full_module_list, repeat=3),
+               '%d modules' % count)
+
+
+def bench_parse():
+    '''Moduleset parsing (xml.dom.minidom vs the streaming reader)'''
+    config = make_config()
+    config.moduleset_cache = False
+    uri = os.path.join(config.modulesets_dir, 'gnome-world.modules')
+    sources = []
+    jhbuild.moduleset._parse_module_set(config, uri, sources)
+    filenames = [filename for uri, filename in sources]
+
+    def minidom_parse():
+        for filename in filenames:
+            xml.dom.minidom.parse(filename)
+
+    def reader_parse():
+        for filename in filenames:
+            jhbuild.moduleset._ModuleSetReader(config).read(filename)
+
+    def load():
+        jhbuild.moduleset._parse_module_set(config, uri)
+
+    for name, func in (('xml.dom.minidom', minidom_parse),
+                       ('_ModuleSetReader', reader_parse),
+                       ('gnome-world (full load)', load)):
+        report(name, timeit(func),
+               '%.1f MiB peak, %d files' % (peak_memory(func) / 2.0**20,
+                                            len(filenames)))
+
+
+def bench_packagedb():
+    '''Package database lookups (PackageDB.installdate)'''
+    tempdir = tempfile.mkdtemp(prefix='jhbuild-benchmark-')
+    try:
+        dbfile = os.path.join(tempdir, 'packagedb.xml')
+        db = PackageDB(dbfile, make_config())
+        names = ['module%05d' % i for i in range(500)]
+        for name in names:
+            db.add(name, '1.0', [os.path.join(tempdir, name)])
+
+        def lookup():
+            for name in names:
+                db.installdate(name)
+
+        report('installdate', timeit(lookup), '%d entries' % len(names))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def make_destdir(root, count):
+    '''Create count files under root, laid out like icon themes, locales
+    and documentation.'''
+    dirs = []
+    for i in range(count // 100):
+        kind = i % 3
+        if kind == 0:
+            path = 'share/icons/theme%d/%dx%d/apps' % (i // 300, i, i)
+        elif kind == 1:
+            path = 'share/locale/lang%d/LC_MESSAGES' % i
+        else:
+            path = 'share/doc/module%d/html' % i
+        dirs.append(os.path.join(root, path))
+    for path in dirs:
+        os.makedirs(path)
+        for j in range(100):
+            with open(os.path.join(path, 'file%d' % j), 'w'):
+                pass
+
+
+def bench_install():
+    '''Moving DESTDIR into the prefix (Package.process_install)'''
+    tempdir = tempfile.mkdtemp(prefix='jhbuild-benchmark-')
+    try:
+        config = make_config()
+        config.prefix = os.path.join(tempdir, 'prefix')
+        config.top_builddir = os.path.join(config.prefix, '_jhbuild')
+        db = PackageDB(os.path.join(config.top_builddir, 'packagedb.xml'), config)
+        module = Package('module')
+        module.config = config
+        module.supports_install_destdir = True
+        buildscript = mock.BuildScript(config, [module],
+                jhbuild.moduleset.ModuleSet(config, db=db))
+        count = 100000
+
+        for name in ('new prefix', 'existing prefix'):
+            if name == 'new prefix':
+                shutil.rmtree(config.prefix, ignore_errors=True)
+                os.makedirs(config.top_builddir)
+            destdir = module.prepare_installroot(buildscript)
+            make_destdir(os.path.join(destdir, config.prefix[1:]), count)
+            start = time.perf_counter()
+            module.process_install(buildscript, '')
+            report(name, time.perf_counter() - start, '%d files' % count)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def own_size(directory):
+    '''Return the size of the files under directory that are not hard
+    links to other files.'''
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for name in filenames:
+            st = os.lstat(os.path.join(dirpath, name))
+            if st.st_nlink == 1:
+                size += st.st_size
+    return size
+
+
+def bench_mirror_clone():
+    '''Cloning from the DVCS mirror (dvcs_mirror_alternates)'''
+    tempdir = tempfile.mkdtemp(prefix='jhbuild-benchmark-')
+    try:
+        env = dict(os.environ, GIT_AUTHOR_NAME='jhbuild', GIT_AUTHOR_EMAIL='jhbuild@',
+                   GIT_COMMITTER_NAME='jhbuild', GIT_COMMITTER_EMAIL='jhbuild@')
+        upstream = os.path.join(tempdir, 'upstream')
+        os.makedirs(upstream)
+        subprocess.check_call(['git', 'init', '-q'], cwd=upstream, env=env)
+        rnd = random.Random(0)
+        count = 2000
+        for commit in range(5):
+            for i in range(count):
+                with open(os.path.join(upstream, 'file%d' % i), 'wb') as fp:
+                    fp.write(bytes(rnd.getrandbits(8) for j in range(2048)))
+            subprocess.check_call(['git', 'add', '.'], cwd=upstream, env=env)
+            subprocess.check_call(['git', 'commit', '-q', '-m', str(commit)],
+                                  cwd=upstream, env=env)
+        mirror = os.path.join(tempdir, 'mirror.git')
+        subprocess.check_call(['git', 'clone', '-q', '--mirror', upstream, mirror])
+        subprocess.check_call(['git', 'gc', '-q'], cwd=mirror)
+
+        for name, options in (('copy (other file system)', ['--no-hardlinks']),
+                              ('copy (hard links)', []),
+                              ('shared', ['--shared'])):
+            checkout = os.path.join(tempdir, 'checkout')
+
+            def clone():
+                shutil.rmtree(checkout, ignore_errors=True)
+                subprocess.check_call(['git', 'clone', '-q'] + options + [mirror, checkout])
+
+            elapsed = timeit(clone, repeat=3)
+            report(name, elapsed, '%.1f MiB of objects' % (
+                    own_size(os.path.join(checkout, '.git', 'objects')) / 2.0**20))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def bench_tree_ids():
+    '''Inspecting checkouts (snapshot and info, revisioncache.get_tree_ids)'''
+    tempdir = tempfile.mkdtemp(prefix='jhbuild-benchmark-')
+    try:
+        config = make_config()
+        config.checkoutroot = os.path.join(tempdir, 'checkout')
+        config.top_builddir = os.path.join(tempdir, '_jhbuild')
+        config.dvcs_mirror_dir = None
+        repository = GitRepository(config, 'local', 'file://' + tempdir)
+        count = 200
+        modules = []
+        env = dict(os.environ, GIT_AUTHOR_NAME='jhbuild', GIT_AUTHOR_EMAIL='jhbuild@',
+                   GIT_COMMITTER_NAME='jhbuild', GIT_COMMITTER_EMAIL='jhbuild@')
+        for i in range(count):
+            name = 'module%05d' % i
+            checkoutdir = os.path.join(config.checkoutroot, name)
+            os.makedirs(checkoutdir)
+            with open(os.path.join(checkoutdir, 'README'), 'w') as fp:
+                fp.write(name)
+            for args in (['init', '-q'], ['add', 'README'], ['commit', '-q', '-m', name]):
+                subprocess.check_call(['git'] + args, cwd=checkoutdir, env=env)
+            module = Package(name, branch=repository.branch(name))
+            module.config = config
+            modules.append(module)
+
+        def get_tree_ids(jobs):
+            revisioncache._caches.clear()
+            revisioncache.get_tree_ids(config, modules, jobs)
+
+        def cold(jobs):
+            def func():
+                if os.path.exists(config.top_builddir):
+                    shutil.rmtree(config.top_builddir)
+                get_tree_ids(jobs)
+            return func
+
+        for jobs in (1, 8):
+            report('no cache, %d jobs' % jobs, timeit(cold(jobs), repeat=3),
+                   '%d checkouts' % count)
+        for jobs in (1, 8):
+            report('cached revisions, %d jobs' % jobs,
+                   timeit(lambda: get_tree_ids(jobs), repeat=3),
+                   '%d checkouts' % count)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+benchmarks = {
+    'install': bench_install,
+    'mirror_clone': bench_mirror_clone,
+    'packagedb': bench_packagedb,
+    'parse': bench_parse,
+    'resolve': bench_resolve,
+    'tree_ids': bench_tree_ids,
+}
+
+
+def main(args):
+    logging.disable(logging.WARNING)
+    for name in args or sorted(benchmarks):
+        if name not in benchmarks:
+            sys.exit('unknown benchmark: %s (available: %s)' % (
+                name, ', '.join(sorted(benchmarks))))
+        print('%s: %s' % (name, benchmarks[name].__doc__))
+        benchmarks[name]()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
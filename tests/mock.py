@@ -59,6 +59,20 @@ class Config(jhbuild.config.Config):
     build_targets = ['install']
     exit_on_error = False
     disable_Werror = False
+    module_jobs = 1
+    module_scheduling = 'list'
+    jobserver = False
+    update_jobs = 1
+    max_connections = 8
+    max_host_connections = 4
+    prefetch_modules = 0
+    install_conflict_policy = 'warn'
+    install_preserve_unchanged = False
+    artifact_cache = False
+    compiler_cache = None
+    build_history = False
+    tarball_store = False
+    buildscript = 'mock'
 
     min_age = None
 
@@ -91,7 +105,8 @@ class PackageDB:
             return None
         return entry.version == version
 
-    def add(self, package, version, manifest, configure_cmd=None):
+    def add(self, package, version, manifest, configure_cmd=None,
+            artifact_key=None):
         entry = PackageEntry(package, version, [], {})
         entry.metadata['installed-date'] = time.time()+self.time_delta
         self.entries[package] = entry
@@ -109,6 +124,12 @@ class PackageDB:
         '''Return entry if package is installed, otherwise return None.'''
         return self.entries.get(package)
 
+    def find_owners(self, filenames):
+        return {}
+
+    def find_conflicts(self, package, filenames):
+        return {}
+
 class BuildScript(jhbuild.frontends.buildscript.BuildScript):
     execute_is_failure = False
 
@@ -133,6 +154,18 @@ class BuildScript(jhbuild.frontends.buildscript.BuildScript):
         self.actions[-1] = self.actions[-1] + ' [error]'
         return 'fail'
 
+class ParallelBuildScript(BuildScript):
+    supports_parallel_modules = True
+
+    def handle_error(self, module, state, nextstate, error, altstates):
+        # actions of other modules may have been recorded in the meantime
+        prefix = '%s:' % module.name
+        for i in reversed(range(len(self.actions))):
+            if self.actions[i].startswith(prefix):
+                self.actions[i] = self.actions[i] + ' [error]'
+                break
+        return 'fail'
+
 class MockModule(jhbuild.modtypes.Package):
     PHASE_FORCE_CHECKOUT = 'force-checkout'
     PHASE_CHECKOUT       = 'checkout'
@@ -146,6 +179,8 @@ class MockModule(jhbuild.modtypes.Package):
 
     def do_checkout(self, buildscript):
         buildscript.set_action(_('Checking out'), self)
+        if not buildscript.get_prefetched(self):
+            self.branch.checkout(buildscript)
         if self.check_build_policy(buildscript) == self.PHASE_DONE:
             raise jhbuild.errors.SkipToEnd()
     do_checkout.error_phases = [PHASE_FORCE_CHECKOUT]
@@ -199,6 +234,9 @@ class Branch(jhbuild.versioncontrol.Branch):
     def checkout(self, buildscript):
         pass
 
+    def get_host(self):
+        return None
+
     def may_checkout(self, buildscript):
         if buildscript.config.nonetwork:
             return False
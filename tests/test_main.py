@@ -26,7 +26,12 @@ import logging
 import subprocess
 import sys
 import glob
+import hashlib
+import http.server
+import tarfile
 import tempfile
+import threading
+import time
 import unittest
 
 SRCDIR = os.path.join(os.path.dirname(__file__), '..')
@@ -42,14 +47,25 @@ import jhbuild.utils.systeminstall
 sys.modules['jhbuild.utils.systeminstall'] = sys.modules[__name__]
 sys.modules['jhbuild.utils'].systeminstall = sys.modules[__name__]
 
-from jhbuild.errors import UsageError, CommandError
+from jhbuild.errors import UsageError, CommandError, FatalError, BuildStateError
 from jhbuild.modtypes import Package
 from jhbuild.modtypes.autotools import AutogenModule
 from jhbuild.modtypes.distutils import DistutilsModule
+import jhbuild.commands.stats
 import jhbuild.config
 import jhbuild.frontends.terminal
 import jhbuild.moduleset
+import jhbuild.utils.artifactcache
+import jhbuild.utils.buildhistory
 import jhbuild.utils.cmds
+import jhbuild.utils.httpcache
+import jhbuild.utils.compilercache
+import jhbuild.utils.criticalpath
+import jhbuild.utils.download
+import jhbuild.utils.packagedb
+import jhbuild.utils.revisioncache
+import jhbuild.utils.tarballstore
+import jhbuild.versioncontrol.git
 import jhbuild.versioncontrol.tarball
 from jhbuild.utils.sxml import sxml_to_string
 from jhbuild.utils.cmds import pprint_output
@@ -365,6 +381,24 @@ class ModuleOrderingTestCase(JhbuildConfigTestCase):
         self.assertRaises(UsageError, self.get_module_list, ['foo', 'bar'])
         self.moduleset.raise_exception_on_warning = False
 
+    def test_reverse_dependencies(self):
+        '''Reverse dependencies'''
+        self.moduleset.modules['foo'].dependencies = ['bar']
+        self.moduleset.modules['bar'].dependencies = ['baz']
+        self.moduleset.modules['qux'].suggests = ['baz']
+        self.moduleset.modules['quux'].after = ['baz']
+        self.moduleset.modules['corge'].dependencies = ['foo']
+        self.assertEqual(self.moduleset.get_reverse_dependencies(['baz']),
+                         set(['bar', 'foo', 'qux', 'corge']))
+        self.assertEqual(self.moduleset.get_reverse_dependencies(
+                             ['baz'], include_suggests=False),
+                         set(['bar', 'foo', 'corge']))
+        self.assertEqual(self.moduleset.get_reverse_dependencies(
+                             ['baz'], direct=True),
+                         set(['bar', 'qux']))
+        self.assertEqual(self.moduleset.get_reverse_dependencies(['foo', 'bar']),
+                         set(['corge']))
+
     def test_sys_deps(self):
         '''deps ommitted because satisfied by system dependencies'''
         class TestBranch(jhbuild.versioncontrol.tarball.TarballBranch):
@@ -412,6 +446,117 @@ class ModuleOrderingTestCase(JhbuildConfigTestCase):
                          ['baz', 'syspkgbravo', 'bar', 'foo'])
 
 
+class ModulesetParserTestCase(JhbuildConfigTestCase):
+    '''Parsing of moduleset files'''
+
+    def parse(self, content, conditions=()):
+        config = self.make_config()
+        config.conditions = set(conditions)
+        filename = os.path.join(self.make_temp_dir(), 'test.modules')
+        with open(filename, 'w') as fp:
+            fp.write('<?xml version="1.0"?><moduleset>'
+                     '<repository type="tarball" name="local" default="yes" href="file:///"/>'
+                     '%s</moduleset>' % content)
+        return jhbuild.moduleset._parse_module_set(config, filename).modules
+
+    def test_conditions(self):
+        '''Conditional content of modules'''
+        content = ('<autotools id="foo" autogenargs="--foo">'
+                   '<branch module="foo.tar.gz" version="1"/>'
+                   '<if condition-set="a"><autogenargs value="--a"/></if>'
+                   '<dependencies><dep package="dep"/>'
+                   '<if condition-set="a"><dep package="a"/>'
+                   '<if condition-set="b"><dep package="ab"/></if>'
+                   '<if condition-unset="b"><dep package="a-not-b"/></if>'
+                   '</if>'
+                   '<if condition-unset="a"><dep package="not-a"/></if>'
+                   '</dependencies></autotools>')
+        modules = self.parse(content)
+        self.assertEqual(modules['foo'].dependencies[:-3], ['dep', 'not-a'])
+        self.assertEqual(modules['foo'].autogenargs, '--foo')
+        modules = self.parse(content, ['a'])
+        self.assertEqual(modules['foo'].dependencies[:-3], ['dep', 'a', 'a-not-b'])
+        self.assertEqual(modules['foo'].autogenargs, '--foo --a')
+        modules = self.parse(content, ['a', 'b'])
+        self.assertEqual(modules['foo'].dependencies[:-3], ['dep', 'a', 'ab'])
+        self.assertRaises(FatalError, self.parse,
+                          '<if><metamodule id="foo"/></if>')
+
+    def test_module_content(self):
+        '''Text content of moduleset elements'''
+        modules = self.parse('<autotools id="foo"><branch module="foo.tar.gz" '
+                             'version="1"><patch file="foo.patch"/></branch>'
+                             '<pkg-config>foo-1.0.pc</pkg-config></autotools>'
+                             '<systemmodule id="bar"><pkg-config>'
+                             'bar.pc</pkg-config><branch repo="system"/>'
+                             '<systemdependencies><dep type="path" name="bar">'
+                             '<altdep type="path" name="baz"/></dep>'
+                             '</systemdependencies></systemmodule>'
+                             '<repository type="system" name="system"/>')
+        self.assertEqual(modules['foo'].pkg_config, 'foo-1.0.pc')
+        self.assertEqual(modules['foo'].branch.patches, [('foo.patch', 0)])
+        self.assertEqual(modules['bar'].systemdependencies,
+                         [('path', 'bar', [('path', 'baz', [])])])
+
+
+class ModulesetCacheTestCase(JhbuildConfigTestCase):
+    '''Cache of parsed modulesets'''
+
+    def setUp(self):
+        super(ModulesetCacheTestCase, self).setUp()
+        self.config = self.make_config()
+        self.config.xdg_cache_home = self.make_temp_dir()
+        self.config.moduleset_cache = True
+        self.moduleset_dir = self.make_temp_dir()
+        self.config.moduleset = os.path.join(self.moduleset_dir, 'main.modules')
+        self.write_moduleset('main.modules',
+                '<include href="included.modules"/>'
+                '<repository type="tarball" name="local" default="yes" href="file:///"/>'
+                '<autotools id="foo"><branch module="foo.tar.gz" version="1"/>'
+                '<dependencies><if condition-set="bar"><dep package="bar"/></if>'
+                '</dependencies></autotools>')
+        self.write_moduleset('included.modules', '<metamodule id="bar"/>')
+
+    def write_moduleset(self, name, content):
+        with open(os.path.join(self.moduleset_dir, name), 'w') as fp:
+            fp.write('<?xml version="1.0"?><moduleset>%s</moduleset>' % content)
+
+    def get_module_list(self):
+        module_set = jhbuild.moduleset.load(self.config)
+        return [x.name for x in module_set.get_module_list(['foo'])]
+
+    def test_cache(self):
+        '''Loading modules from the cache'''
+        self.assertEqual(self.get_module_list(), ['foo'])
+        old_parse_module_set = jhbuild.moduleset._parse_module_set
+
+        def parse_module_set(*args):
+            raise AssertionError('moduleset parsed again')
+        jhbuild.moduleset._parse_module_set = parse_module_set
+        try:
+            module_set = jhbuild.moduleset.load(self.config)
+        finally:
+            jhbuild.moduleset._parse_module_set = old_parse_module_set
+        self.assertTrue(module_set.modules['foo'].config is self.config)
+        self.assertTrue('bar' in module_set.modules)
+
+    def test_cache_invalidation(self):
+        '''Modules are parsed again when modulesets or conditions change'''
+        self.assertEqual(self.get_module_list(), ['foo'])
+        self.config.conditions.add('bar')
+        self.assertEqual(self.get_module_list(), ['bar', 'foo'])
+        self.write_moduleset('included.modules',
+                '<metamodule id="bar"><dependencies>'
+                '<dep package="foo"/></dependencies></metamodule>'
+                '<metamodule id="baz"/>')
+        module_set = jhbuild.moduleset.load(self.config)
+        self.assertTrue('baz' in module_set.modules)
+        self.config.moduleset_cache = False
+        self.write_moduleset('included.modules', '<metamodule id="qux"/>')
+        module_set = jhbuild.moduleset.load(self.config)
+        self.assertTrue('qux' in module_set.modules)
+
+
 class BuildTestCase(JhbuildConfigTestCase):
     def setUp(self):
         super(BuildTestCase, self).setUp()
@@ -426,6 +571,8 @@ class BuildTestCase(JhbuildConfigTestCase):
         super(BuildTestCase, self).tearDown()
         self.buildscript = None
 
+    buildscript_class = mock.BuildScript
+
     def build(self, packagedb_params = {}, **kwargs):
         self.config.build_targets = ['install', 'test']
         for k in kwargs:
@@ -435,7 +582,7 @@ class BuildTestCase(JhbuildConfigTestCase):
         if (self.packagedb is None) or (len(packagedb_params) > 0):
             self.packagedb = mock.PackageDB(**packagedb_params)
             self.moduleset = jhbuild.moduleset.ModuleSet(self.config, db=self.packagedb)
-        self.buildscript = mock.BuildScript(self.config, self.modules, self.moduleset)
+        self.buildscript = self.buildscript_class(self.config, self.modules, self.moduleset)
 
         self.buildscript.build()
         return self.buildscript.actions
@@ -493,6 +640,21 @@ class AutotoolsModTypeTestCase(BuildTestCase):
                 ['foo:Checking out', 'foo:Configuring', 'foo:Building',
                  'foo:Checking [error]'])
 
+    def test_build_history(self):
+        '''Recording the timings of the phases of a autotools module'''
+        self.config.top_builddir = self.make_temp_dir()
+        self.build(build_history = True)
+        history = jhbuild.utils.buildhistory.BuildHistory.create(self.config)
+        records = history.read()
+        self.assertEqual([x['phase'] for x in records],
+                         ['checkout', 'configure', 'build', 'install'])
+        self.assertEqual(set(x['module'] for x in records), set(['foo']))
+        self.assertEqual(set(x['status'] for x in records), set([0]))
+        self.assertEqual(len(set(x['run'] for x in records)), 1)
+        # modules that are only checked out are not recorded
+        self.build(build_history = True, nobuild = True)
+        self.assertEqual(len(history.read()), 4)
+
 
 class BuildPolicyTestCase(BuildTestCase):
     '''Build Policy'''
@@ -551,6 +713,63 @@ class TwoModulesTestCase(BuildTestCase):
                  'bar:Building', 'bar:Installing',
                 ])
 
+    def test_build_compiler_cache_stats(self):
+        '''Compiler cache statistics of modules built one at a time'''
+        bindir = self.make_temp_dir()
+        with open(os.path.join(bindir, 'ccache'), 'w') as fp:
+            # one more hit every time the statistics are read
+            fp.write('#!/bin/sh\n'
+                     'n=$(cat %(count)s 2>/dev/null || echo 0)\n'
+                     'echo $((n+1)) > %(count)s\n'
+                     'printf "direct_cache_hit\\t$n\\ncache_miss\\t0\\n"\n'
+                     % {'count': os.path.join(bindir, 'count')})
+        os.chmod(os.path.join(bindir, 'ccache'), 0o755)
+        os.environ['PATH'] = bindir + os.pathsep + os.environ['PATH']
+        jhbuild.utils.compilercache._found.clear()
+        try:
+            self.build(compiler_cache='ccache')
+            self.assertEqual(self.buildscript.compiler_cache_stats,
+                             {'foo': (1, 0), 'bar': (1, 0)})
+            # modules built concurrently share the counters
+            self.buildscript_class = mock.ParallelBuildScript
+            self.build(module_jobs=2)
+            self.assertEqual(self.buildscript.compiler_cache_stats, {})
+        finally:
+            jhbuild.utils.compilercache._found.clear()
+
+    def test_build_critical_path(self):
+        '''Building modules along their critical paths'''
+        baz = mock.MockModule('baz', branch=self.branch, dependencies=['bar'])
+        baz.config = self.config
+        self.modules.append(baz)
+        self.config.build_targets = ['checkout']
+        self.build(module_scheduling='critical-path')
+        self.assertEqual([x.name for x in self.buildscript.modulelist],
+                         ['bar', 'foo', 'baz'])
+
+        paths = jhbuild.utils.criticalpath.get_critical_paths(
+                self.modules, {'foo': 100, 'bar': 10, 'baz': 20})
+        self.assertEqual(paths['bar'], (30, 'baz'))
+        self.assertEqual(jhbuild.utils.criticalpath.get_critical_path(paths),
+                         ['foo'])
+        self.assertEqual([x.name for x in jhbuild.utils.criticalpath.order_modules(
+                                self.modules, paths)], ['foo', 'bar', 'baz'])
+
+    def test_durations(self):
+        '''Estimating the durations of modules from their latest builds'''
+        self.config.top_builddir = self.make_temp_dir()
+        history = jhbuild.utils.buildhistory.BuildHistory(
+                jhbuild.utils.buildhistory.get_filename(self.config))
+
+        def record(run, module, phase, wall):
+            return {'run': run, 'module': module, 'phase': phase, 'start': run,
+                    'wall': wall, 'cpu': 0, 'status': 0, 'revision': None}
+        history.append([record(1, 'foo', 'checkout', 1), record(1, 'foo', 'build', 100),
+                        record(1, 'bar', 'build', 10),
+                        record(2, 'foo', 'checkout', 2)])
+        self.assertEqual(jhbuild.utils.criticalpath.get_durations(self.config, self.modules),
+                         {'foo': 101, 'bar': 10})
+
     def test_build_failure_independent_modules(self):
         '''Building two independent autotools modules, with failure in first'''
 
@@ -601,6 +820,130 @@ class TwoModulesTestCase(BuildTestCase):
                  'bar:Building', 'bar:Installing',
                 ])
 
+    def test_build_module_jobs(self):
+        '''Building two independent autotools modules concurrently'''
+        self.buildscript_class = mock.ParallelBuildScript
+        self.assertEqual(sorted(self.build(module_jobs = 2)),
+                sorted(['foo:Checking out', 'foo:Configuring',
+                        'foo:Building', 'foo:Installing',
+                        'bar:Checking out', 'bar:Configuring',
+                        'bar:Building', 'bar:Installing',
+                       ]))
+
+    def test_build_module_jobs_dependent_modules(self):
+        '''Building two dependent autotools modules with module_jobs'''
+        self.modules[1].dependencies = ['foo']
+        self.buildscript_class = mock.ParallelBuildScript
+        self.assertEqual(self.build(module_jobs = 2),
+                ['foo:Checking out', 'foo:Configuring',
+                 'foo:Building', 'foo:Installing',
+                 'bar:Checking out', 'bar:Configuring',
+                 'bar:Building', 'bar:Installing',
+                ])
+
+    def test_build_module_jobs_failure_dependent_modules(self):
+        '''Building two dependent modules with module_jobs, with failure in first'''
+        self.modules[1].dependencies = ['foo']
+
+        def build_error(buildscript, *args):
+            self.modules[0].do_build_orig(buildscript, *args)
+            raise CommandError('Mock Command Error Exception')
+        build_error.depends = self.modules[0].do_build.depends
+        build_error.error_phases = self.modules[0].do_build.error_phases
+        self.modules[0].do_build_orig = self.modules[0].do_build
+        self.modules[0].do_build = build_error
+
+        self.buildscript_class = mock.ParallelBuildScript
+        self.assertEqual(self.build(module_jobs = 2),
+                ['foo:Checking out', 'foo:Configuring', 'foo:Building [error]'])
+
+    def test_build_prefetch(self):
+        '''Checking out the second module in the background'''
+        checkouts = []
+
+        def checkout(buildscript):
+            checkouts.append(buildscript.__class__.__name__)
+        self.branch.checkout = checkout
+
+        self.assertEqual(self.build(prefetch_modules = 1),
+                ['foo:Checking out', 'foo:Configuring',
+                 'foo:Building', 'foo:Installing',
+                 'bar:Checking out', 'bar:Configuring',
+                 'bar:Building', 'bar:Installing',
+                ])
+        self.assertEqual(checkouts, ['PrefetchBuildScript'])
+
+    def test_build_prefetch_failure(self):
+        '''Checking out the second module again after a background failure'''
+        checkouts = []
+
+        def checkout(buildscript):
+            checkouts.append(buildscript.__class__.__name__)
+            if len(checkouts) == 1:
+                raise CommandError('Mock Command Error Exception')
+        self.branch.checkout = checkout
+
+        self.assertEqual(self.build(prefetch_modules = 1),
+                ['foo:Checking out', 'foo:Configuring',
+                 'foo:Building', 'foo:Installing',
+                 'bar:Checking out', 'bar:Configuring',
+                 'bar:Building', 'bar:Installing',
+                ])
+        self.assertEqual(checkouts, ['PrefetchBuildScript', 'BuildScript'])
+
+    def test_prefetch_once(self):
+        '''Never checking out in the background a module being built'''
+        checkouts = []
+
+        def checkout(buildscript):
+            checkouts.append(buildscript.__class__.__name__)
+        self.branch.checkout = checkout
+        self.config.update_build_targets()
+        moduleset = jhbuild.moduleset.ModuleSet(self.config, db=mock.PackageDB())
+        buildscript = mock.BuildScript(self.config, self.modules, moduleset)
+        foo, bar = self.modules
+
+        prefetcher = jhbuild.frontends.buildscript.ModulePrefetcher(buildscript, 1)
+        prefetcher.prefetch_after(foo)
+        self.assertTrue(prefetcher.get_prefetched(bar))
+        prefetcher.prefetch_after(foo)
+        self.assertFalse(prefetcher.get_prefetched(bar))
+        prefetcher.shutdown()
+        self.assertEqual(checkouts, ['PrefetchBuildScript'])
+
+        # bar is being built by another worker
+        prefetcher = jhbuild.frontends.buildscript.ModulePrefetcher(buildscript, 1)
+        prefetcher.prefetch_after(bar)
+        prefetcher.prefetch_after(foo)
+        prefetcher.shutdown()
+        self.assertEqual(checkouts, ['PrefetchBuildScript'])
+
+    def test_update_independent_modules(self):
+        '''Updating two dependent modules concurrently, with failure in first'''
+        self.modules[1].dependencies = ['foo']
+
+        def checkout_error(buildscript, *args):
+            self.modules[0].do_checkout_orig(buildscript, *args)
+            raise CommandError('Mock Command Error Exception')
+        checkout_error.error_phases = self.modules[0].do_checkout.error_phases
+        self.modules[0].do_checkout_orig = self.modules[0].do_checkout
+        self.modules[0].do_checkout = checkout_error
+
+        self.config.build_targets = ['checkout']
+        self.config.module_jobs = 2
+        # none of the build machinery is set up to update modules
+        self.config.build_history = True
+        moduleset = jhbuild.moduleset.ModuleSet(self.config, db=mock.PackageDB())
+        buildscript = mock.ParallelBuildScript(self.config, self.modules, moduleset)
+        buildscript.independent_modules = True
+        self.assertEqual(buildscript.build(), 1)
+        self.assertEqual(sorted(buildscript.actions),
+                ['bar:Checking out', 'foo:Checking out [error]'])
+        self.assertEqual(buildscript.module_results['bar'], None)
+        self.assertEqual(buildscript.module_results['foo'].args[0],
+                         'Mock Command Error Exception')
+        self.assertEqual(buildscript.build_history, None)
+
     def test_build_no_update(self):
         '''Building two uptodate, autotools module'''
         self.build() # will feed PackageDB
@@ -713,6 +1056,773 @@ def with_stdout_hidden(func):
         os.close(old_fd)
 
 
+class PackageDBTestCase(JhbuildConfigTestCase):
+    '''Registry of installed packages'''
+
+    def test_packagedb(self):
+        config = self.make_config()
+        dbfile = os.path.join(config.top_builddir, 'packagedb.xml')
+        db = jhbuild.utils.packagedb.PackageDB(dbfile, config)
+        self.assertEqual(db.get('foo'), None)
+        installed = os.path.join(config.prefix, 'foo.txt')
+        with open(installed, 'w') as fp:
+            fp.write('foo')
+        db.add('foo', '1.0', [installed], 'configure')
+        self.assertTrue(db.check('foo', '1.0'))
+        self.assertFalse(db.check('foo', '2.0'))
+        self.assertEqual(db.get('foo').manifest, [installed])
+        self.assertTrue(db.installdate('foo') is not None)
+
+        # entries written by another process are seen
+        other_db = jhbuild.utils.packagedb.PackageDB(dbfile, config)
+        self.assertTrue(other_db.check('foo', '1.0'))
+        other_db.add('bar', '2.0', [])
+        other_db.add('foo', '1.1', [installed])
+        self.assertTrue(db.check('bar', '2.0'))
+        self.assertTrue(db.check('foo', '1.1'))
+        self.assertEqual(db.get('foo').metadata['configure-hash'],
+                         other_db.get('foo').metadata['configure-hash'])
+
+        db.uninstall('foo')
+        self.assertFalse(os.path.exists(installed))
+        self.assertFalse(other_db.check('foo'))
+        self.assertTrue(other_db.check('bar'))
+
+    def test_sqlite_packagedb(self):
+        config = self.make_config()
+        dbfile = os.path.join(config.top_builddir, 'packagedb.xml')
+        files_db = jhbuild.utils.packagedb.PackageDB(dbfile, config)
+        shared = os.path.join(config.prefix, 'shared.txt')
+        foo = os.path.join(config.prefix, 'foo.txt')
+        for filename in (shared, foo):
+            with open(filename, 'w') as fp:
+                fp.write('foo')
+        files_db.add('foo', '1.0', [foo, shared], 'configure')
+        files_db.add('bar', '2.0', [shared])
+        self.assertEqual(files_db.find_owners([foo, shared, 'baz']),
+                         {foo: ['foo'], shared: ['bar', 'foo']})
+
+        # entries are migrated from the files
+        config.packagedb_backend = 'sqlite'
+        db = jhbuild.utils.packagedb.open_packagedb(dbfile, config)
+        self.assertTrue(isinstance(db, jhbuild.utils.packagedb.SQLitePackageDB))
+        self.assertTrue(db.check('foo', '1.0'))
+        self.assertEqual(db.get('foo').manifest, [foo, shared])
+        self.assertEqual(db.get('foo').metadata, files_db.get('foo').metadata)
+        self.assertEqual(db.get('bar').metadata['installed-date'],
+                         files_db.installdate('bar'))
+        self.assertEqual(db.find_owners([foo, shared, 'baz']),
+                         {foo: ['foo'], shared: ['bar', 'foo']})
+
+        db.add('baz', '3.0', [shared])
+        db.add('foo', '1.1', [foo])
+        other_db = jhbuild.utils.packagedb.open_packagedb(dbfile, config)
+        self.assertTrue(other_db.check('foo', '1.1'))
+        self.assertEqual(other_db.get('foo').metadata['configure-hash'],
+                         files_db.get('foo').metadata['configure-hash'])
+        self.assertEqual(other_db.find_owners([shared]), {shared: ['bar', 'baz']})
+        db.uninstall('foo')
+        self.assertFalse(os.path.exists(foo))
+        self.assertEqual(other_db.get('foo'), None)
+        self.assertEqual(other_db.find_owners([foo]), {})
+
+    def test_install_conflicts(self):
+        config = self.make_config()
+        dbfile = os.path.join(config.top_builddir, 'packagedb.xml')
+        db = jhbuild.utils.packagedb.PackageDB(dbfile, config)
+        filenames = [os.path.join(config.prefix, x) for x in ('foo', 'shared')]
+        for filename in filenames:
+            with open(filename, 'w') as fp:
+                fp.write('foo')
+        db.add('foo', '1.0', ['foo', 'shared'])
+        self.assertEqual(db.find_owners(filenames),
+                         {filenames[0]: ['foo'], filenames[1]: ['foo']})
+        db.add('bar', '1.0', [filenames[1], 'empty' + os.sep])
+        self.assertEqual(db.find_owners(['shared', 'empty']),
+                         {'shared': ['bar', 'foo'], 'empty': ['bar']})
+
+        module = Package('baz')
+        module.config = config
+        buildscript = mock.BuildScript(config, [module],
+                jhbuild.moduleset.ModuleSet(config, db=db))
+        module._check_install_conflicts(buildscript, ['baz', 'empty' + os.sep])
+        config.install_conflict_policy = 'error'
+        self.assertRaises(CommandError, module._check_install_conflicts,
+                          buildscript, ['baz', 'shared'])
+        config.install_conflict_policy = 'warn'
+        module._check_install_conflicts(buildscript, ['baz', 'shared'])
+
+        # shared files are only removed with their last owner
+        db.uninstall('foo')
+        self.assertFalse(os.path.exists(filenames[0]))
+        self.assertTrue(os.path.exists(filenames[1]))
+        self.assertEqual(db.find_owners(filenames), {filenames[1]: ['bar']})
+        db.uninstall('bar')
+        self.assertFalse(os.path.exists(filenames[1]))
+
+    def test_legacy_packagedb(self):
+        config = self.make_config()
+        dbfile = os.path.join(config.top_builddir, 'packagedb.xml')
+        os.makedirs(os.path.join(config.top_builddir, 'manifests'))
+        with open(dbfile, 'w') as fp:
+            fp.write('<packagedb><entry package="foo" version="1.0" '
+                     'installed="2010-01-01T00:00:00Z"/>'
+                     '<entry package="bar" version="1.0" '
+                     'installed="2010-01-01T00:00:00Z"/></packagedb>')
+        with open(os.path.join(config.top_builddir, 'manifests', 'foo'), 'w') as fp:
+            fp.write('\n')
+        db = jhbuild.utils.packagedb.PackageDB(dbfile, config)
+        self.assertTrue(db.check('foo', '1.0'))
+        # not installed anymore, as there is no manifest
+        self.assertFalse(db.check('bar'))
+        db.add('foo', '1.1', [])
+        self.assertTrue(db.check('foo', '1.1'))
+
+
+class InstallTestCase(JhbuildConfigTestCase):
+    '''Moving DESTDIR into the prefix'''
+
+    def test_process_install(self):
+        config = self.make_config()
+        module = Package('foo')
+        module.config = config
+        module.supports_install_destdir = True
+        dbfile = os.path.join(config.top_builddir, 'packagedb.xml')
+        db = jhbuild.utils.packagedb.PackageDB(dbfile, config)
+        buildscript = mock.BuildScript(config, [module],
+                jhbuild.moduleset.ModuleSet(config, db=db))
+
+        destdir = module.prepare_installroot(buildscript)
+        root = os.path.join(destdir, config.prefix[1:])
+        for path in ('lib/libfoo.so.1', 'lib/libfoo.la', 'share/foo/a/b',
+                     'share/foo/c', 'share/empty/', 'bin/foo'):
+            path = os.path.join(root, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if not path.endswith('/'):
+                with open(path, 'w') as fp:
+                    fp.write(path)
+        os.symlink('libfoo.so.1', os.path.join(root, 'lib', 'libfoo.so'))
+        # existing directory in the prefix, and file to be replaced
+        os.makedirs(os.path.join(config.prefix, 'lib'))
+        with open(os.path.join(config.prefix, 'lib', 'libfoo.so.1'), 'w') as fp:
+            fp.write('old')
+
+        module.process_install(buildscript, '1.0')
+        self.assertFalse(os.path.exists(destdir))
+        self.assertEqual(sorted(db.get('foo').manifest),
+                         ['bin/foo', 'lib/libfoo.so', 'lib/libfoo.so.1',
+                          'share/empty/', 'share/foo/a/b', 'share/foo/c'])
+        self.assertFalse(os.path.exists(os.path.join(config.prefix, 'lib', 'libfoo.la')))
+        self.assertEqual(os.readlink(os.path.join(config.prefix, 'lib', 'libfoo.so')),
+                         'libfoo.so.1')
+        with open(os.path.join(config.prefix, 'lib', 'libfoo.so.1')) as fp:
+            self.assertEqual(fp.read(), os.path.join(root, 'lib', 'libfoo.so.1'))
+        self.assertTrue(os.path.isfile(os.path.join(config.prefix, 'share', 'foo', 'a', 'b')))
+        self.assertTrue(os.path.isdir(os.path.join(config.prefix, 'share', 'empty')))
+
+    def test_preserve_unchanged(self):
+        config = self.make_config()
+        config.install_preserve_unchanged = True
+        module = Package('foo')
+        module.config = config
+        module.supports_install_destdir = True
+        buildscript = mock.BuildScript(config, [module],
+                jhbuild.moduleset.ModuleSet(config, db=mock.PackageDB()))
+
+        def install(files):
+            destdir = module.prepare_installroot(buildscript)
+            for path, content in files.items():
+                path = os.path.join(destdir, config.prefix[1:], path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as fp:
+                    fp.write(content)
+            module.process_install(buildscript, '1.0')
+
+        install({'include/foo.h': 'foo', 'include/bar.h': 'bar', 'lib/libfoo.so': 'a'})
+        unchanged = os.path.join(config.prefix, 'include', 'foo.h')
+        changed = os.path.join(config.prefix, 'include', 'bar.h')
+        samesize = os.path.join(config.prefix, 'lib', 'libfoo.so')
+        for filename in (unchanged, changed, samesize):
+            os.utime(filename, (1000000000, 1000000000))
+        inode = os.stat(unchanged).st_ino
+        install({'include/foo.h': 'foo', 'include/bar.h': 'bar 2', 'lib/libfoo.so': 'b'})
+        self.assertEqual(os.stat(unchanged).st_mtime, 1000000000)
+        self.assertEqual(os.stat(unchanged).st_ino, inode)
+        self.assertNotEqual(os.stat(changed).st_mtime, 1000000000)
+        self.assertNotEqual(os.stat(samesize).st_mtime, 1000000000)
+        with open(samesize) as fp:
+            self.assertEqual(fp.read(), 'b')
+
+
+class _ArtifactBranch:
+    def __init__(self, revision):
+        self.revision = revision
+
+    def tree_id(self):
+        return self.revision
+
+    def may_checkout(self, buildscript):
+        return True
+
+    def checkout(self, buildscript):
+        pass
+
+
+class _ArtifactModule(Package):
+    def get_artifact_config(self, buildscript):
+        return 'configure --prefix %s' % buildscript.config.prefix
+
+
+class _ArtifactBuildModule(jhbuild.modtypes.DownloadableModule, _ArtifactModule):
+    def get_srcdir(self, buildscript):
+        return buildscript.config.prefix
+
+    def do_configure(self, buildscript):
+        buildscript.set_action('Configuring', self)
+    do_configure.depends = ['checkout']
+
+    def do_build(self, buildscript):
+        buildscript.set_action('Building', self)
+    do_build.depends = ['configure']
+
+    def do_check(self, buildscript):
+        buildscript.set_action('Checking', self)
+    do_check.depends = ['build']
+
+    def do_install(self, buildscript):
+        buildscript.set_action('Installing', self)
+    do_install.depends = ['build']
+
+
+class ArtifactCacheTestCase(JhbuildConfigTestCase):
+    '''Installing modules from their build artifacts'''
+
+    def setUp(self):
+        super().setUp()
+        config = self.make_config()
+        config.artifact_cache = True
+        config.artifact_cache_dir = os.path.join(self.make_temp_dir(), 'artifacts')
+        self.module = _ArtifactModule('foo', branch=_ArtifactBranch('1.0'),
+                                      dependencies=['bar'])
+        self.module.config = config
+        self.module.supports_install_destdir = True
+        self.dbfile = os.path.join(config.top_builddir, 'packagedb.xml')
+        self.db = jhbuild.utils.packagedb.PackageDB(self.dbfile, config)
+        self.db.add('bar', '1.0', [], artifact_key='bar-key')
+        self.buildscript = mock.BuildScript(config, [self.module],
+                jhbuild.moduleset.ModuleSet(config, db=self.db))
+        self.buildscript.artifact_cache = jhbuild.utils.artifactcache.ArtifactCache.create(config)
+        self.config = config
+
+    def install(self):
+        destdir = self.module.prepare_installroot(self.buildscript)
+        path = os.path.join(destdir, self.config.prefix[1:], 'lib', 'libfoo.so')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write('foo')
+        self.module.process_install(self.buildscript, '1.0')
+
+    def test_restore(self):
+        self.assertFalse(self.module.extract_artifact(self.buildscript))
+        self.install()
+        key = self.db.get('foo').metadata['artifact-key']
+        self.assertTrue(self.buildscript.artifact_cache.has(key))
+
+        self.db.uninstall('foo')
+        self.assertFalse(os.path.exists(os.path.join(self.config.prefix, 'lib', 'libfoo.so')))
+        self.assertTrue(self.module.extract_artifact(self.buildscript))
+        self.module.install_artifact(self.buildscript)
+        with open(os.path.join(self.config.prefix, 'lib', 'libfoo.so')) as fp:
+            self.assertEqual(fp.read(), 'foo')
+        # the key is stored in the package database
+        db = jhbuild.utils.packagedb.PackageDB(self.dbfile, self.config)
+        self.assertEqual(db.get('foo').metadata['artifact-key'], key)
+        self.assertEqual(db.get('foo').manifest, ['lib/libfoo.so'])
+
+        # a new revision, or a dependency installed from another artifact,
+        # changes the key
+        self.module.branch.revision = '2.0'
+        self.assertFalse(self.module.extract_artifact(self.buildscript))
+        self.module.branch.revision = '1.0'
+        self.db.add('bar', '1.0', [], artifact_key='other-key')
+        self.assertFalse(self.module.extract_artifact(self.buildscript))
+
+    def test_restore_phases(self):
+        self.install()
+        self.db.uninstall('foo')
+        module = _ArtifactBuildModule('foo', branch=_ArtifactBranch('1.0'),
+                                      dependencies=['bar'])
+        module.config = self.config
+        module.supports_install_destdir = True
+        os.environ['JHBUILD_PREFIX'] = self.config.prefix
+        libfoo = os.path.join(self.config.prefix, 'lib', 'libfoo.so')
+
+        def build(targets):
+            self.config.build_targets = targets
+            buildscript = mock.BuildScript(self.config, [module],
+                    jhbuild.moduleset.ModuleSet(self.config, db=self.db))
+            self.assertEqual(buildscript.build(), 0)
+            return buildscript.actions
+
+        # the artifact is only used when the module is to be built
+        self.assertEqual(build(['checkout']), ['foo:Checking out'])
+        self.assertFalse(os.path.exists(libfoo))
+        self.assertEqual(build(['check', 'install']),
+                         ['foo:Checking out', 'foo:Configuring', 'foo:Building',
+                          'foo:Checking', 'foo:Installing'])
+        self.assertFalse(os.path.exists(libfoo))
+        self.assertEqual(build(['install']),
+                         ['foo:Checking out', 'foo:Restoring build artifact',
+                          'foo:Installing'])
+        self.assertTrue(os.path.exists(libfoo))
+        self.assertEqual(self.db.get('foo').manifest, ['lib/libfoo.so'])
+
+    def test_prune(self):
+        self.install()
+        cache = self.buildscript.artifact_cache
+        first = self.db.get('foo').metadata['artifact-key']
+        os.utime(cache.get_filename(first), (1000000000, 1000000000))
+        self.module.branch.revision = '2.0'
+        self.install()
+        second = self.db.get('foo').metadata['artifact-key']
+        self.assertTrue(cache.has(first))
+        cache.max_size = os.path.getsize(cache.get_filename(second))
+        cache.prune()
+        self.assertFalse(cache.has(first))
+        self.assertTrue(cache.has(second))
+
+
+class CompilerCacheTestCase(JhbuildConfigTestCase):
+    '''Running the compilers through ccache'''
+
+    def setUp(self):
+        super().setUp()
+        bindir = self.make_temp_dir()
+        ccache = os.path.join(bindir, 'ccache')
+        with open(ccache, 'w') as fp:
+            fp.write('#!/bin/sh\n'
+                     'printf "direct_cache_hit\\t3\\npreprocessed_cache_hit\\t1\\n'
+                     'cache_miss\\t5\\nstats_zeroed_timestamp\\t0\\n"\n')
+        os.chmod(ccache, 0o755)
+        os.environ['PATH'] = bindir + os.pathsep + os.environ['PATH']
+        os.environ.pop('CC', None)
+        os.environ.pop('CXX', None)
+        jhbuild.utils.compilercache._found.clear()
+        self.config.compiler_cache = 'ccache'
+
+    def tearDown(self):
+        jhbuild.utils.compilercache._found.clear()
+        super().tearDown()
+
+    def test_module_environment(self):
+        module = AutogenModule('foo')
+        module.config = self.config
+        self.assertEqual(module.extra_env, {'CC': 'ccache cc', 'CXX': 'ccache c++'})
+        self.config.module_extra_env = {'foo': {'CC': 'clang', 'CXX': 'ccache clang++'}}
+        self.assertEqual(module.extra_env['CC'], 'ccache clang')
+        self.assertEqual(module.extra_env['CXX'], 'ccache clang++')
+        self.config.compiler_cache = 'sccache'
+        self.assertEqual(module.extra_env, {'CC': 'clang', 'CXX': 'ccache clang++'})
+
+    def test_stats(self):
+        self.assertEqual(jhbuild.utils.compilercache.get_stats('ccache'), (4, 5))
+
+
+class _RevisionBranch(object):
+    def __init__(self, checkoutdir):
+        self.checkoutdir = checkoutdir
+        self.stamp = ['1']
+
+    def get_checkoutdir(self):
+        return self.checkoutdir
+
+    def get_revision_stamp(self):
+        return self.stamp
+
+
+class _DownloadHandler(http.server.BaseHTTPRequestHandler):
+    data = bytes(range(256)) * 4096
+
+    def do_GET(self):
+        self.server.ranges.append(self.headers.get('Range'))
+        if self.path != '/foo.tar.xz':
+            self.send_error(404)
+            return
+        offset = 0
+        if self.headers.get('Range'):
+            offset = int(self.headers['Range'][len('bytes='):-1])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+                    offset, len(self.data) - 1, len(self.data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(self.data) - offset))
+        self.end_headers()
+        self.wfile.write(self.data[offset:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadTestCase(JhbuildConfigTestCase):
+    '''Downloading tarballs'''
+
+    def setUp(self):
+        super().setUp()
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), _DownloadHandler)
+        self.server.ranges = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/foo.tar.xz' % self.server.server_port
+        self.filename = os.path.join(self.make_temp_dir(), 'foo.tar.xz')
+        self.buildscript = mock.BuildScript(self.config, [],
+                jhbuild.moduleset.ModuleSet(self.config, db=mock.PackageDB()))
+        self.hash = 'sha256:' + hashlib.sha256(_DownloadHandler.data).hexdigest()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        super().tearDown()
+
+    def test_download(self):
+        jhbuild.utils.download.download(self.buildscript, self.url, self.filename,
+                                        len(_DownloadHandler.data), self.hash)
+        with open(self.filename, 'rb') as fp:
+            self.assertEqual(fp.read(), _DownloadHandler.data)
+        self.assertEqual(self.server.ranges, [None])
+
+    def test_resume(self):
+        with open(self.filename + '.part', 'wb') as fp:
+            fp.write(_DownloadHandler.data[:1000])
+        jhbuild.utils.download.download(self.buildscript, self.url, self.filename,
+                                        None, self.hash)
+        with open(self.filename, 'rb') as fp:
+            self.assertEqual(fp.read(), _DownloadHandler.data)
+        self.assertEqual(self.server.ranges, ['bytes=1000-'])
+        self.assertFalse(os.path.exists(self.filename + '.part'))
+
+    def test_bad_hash(self):
+        self.assertRaises(BuildStateError, jhbuild.utils.download.download,
+                          self.buildscript, self.url, self.filename, None, 'md5:00')
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertFalse(os.path.exists(self.filename + '.part'))
+
+    def test_not_found(self):
+        # the module fails, not the whole build
+        self.assertRaises(BuildStateError, jhbuild.utils.download.download,
+                          self.buildscript, self.url.replace('foo', 'bar'),
+                          self.filename)
+        self.assertEqual(self.server.ranges, [None])
+
+    def test_write_error(self):
+        # the file cannot be written, or the URL is not supported
+        filename = os.path.join(self.make_temp_dir(), 'missing', 'foo.tar.xz')
+        self.assertRaises(BuildStateError, jhbuild.utils.download.download,
+                          self.buildscript, self.url, filename)
+        self.assertRaises(BuildStateError, jhbuild.utils.download.download,
+                          self.buildscript, 'foo.tar.xz', self.filename)
+
+
+class HTTPCacheTestCase(JhbuildConfigTestCase):
+    '''Index of the HTTP cache'''
+
+    def test_index(self):
+        cachedir = self.make_temp_dir()
+        with open(os.path.join(cachedir, 'foo.modules'), 'w') as fp:
+            fp.write('foo')
+        with open(os.path.join(cachedir, 'index.xml'), 'w') as fp:
+            fp.write('<cache><entry uri="http://example.com/foo.modules" '
+                     'local="foo.modules" expires="2000-01-01T00:00:00Z"/>'
+                     '<entry uri="http://example.com/gone" local="gone" '
+                     'expires="2000-01-01T00:00:00Z"/></cache>')
+        cache = jhbuild.utils.httpcache.Cache(cachedir)
+        self.assertEqual(cache.load('http://example.com/foo.modules', nonetwork=True),
+                         os.path.join(cachedir, 'foo.modules'))
+        self.assertEqual(list(cache.entries), ['http://example.com/foo.modules'])
+
+        # entries added by another process are merged in the index
+        other = jhbuild.utils.httpcache.Cache(cachedir)
+        uri = 'http://example.com/bar/foo.modules'
+        local = other._make_filename(uri)
+        self.assertTrue(local.endswith('-foo.modules'))
+        self.assertNotEqual(local, cache._make_filename('http://example.com/foo.modules'))
+        other.write_cache(jhbuild.utils.httpcache.CacheEntry(
+                uri, local, None, None, time.time() + 60), b'bar')
+        cache.write_cache(jhbuild.utils.httpcache.CacheEntry(
+                'http://example.com/baz', 'baz', None, None, 0), b'baz')
+        cache = jhbuild.utils.httpcache.Cache(cachedir)
+        self.assertEqual(cache.load(uri), os.path.join(cachedir, local))
+        self.assertEqual(sorted(cache.entries),
+                         ['http://example.com/bar/foo.modules', 'http://example.com/baz',
+                          'http://example.com/foo.modules'])
+
+
+class _ExecutingBuildScript(mock.BuildScript):
+    def execute(self, command, hint=None, cwd=None, extra_env=None):
+        subprocess.check_call(command, shell=isinstance(command, str), cwd=cwd)
+
+
+class GitMirrorTestCase(JhbuildConfigTestCase):
+    '''Git checkouts borrowing the objects of the DVCS mirror'''
+
+    def test_alternates(self):
+        config = self.make_config()
+        config.dvcs_mirror_dir = self.make_temp_dir()
+        config.dvcs_mirror_alternates = True
+        config.quiet_mode = True
+        upstream = os.path.join(self.make_temp_dir(), 'foo')
+        env = dict(os.environ, GIT_AUTHOR_NAME='jhbuild', GIT_AUTHOR_EMAIL='jhbuild@',
+                   GIT_COMMITTER_NAME='jhbuild', GIT_COMMITTER_EMAIL='jhbuild@')
+        os.makedirs(upstream)
+        for args in (['init', '-q'], ['commit', '-q', '--allow-empty', '-m', 'foo']):
+            subprocess.check_call(['git'] + args, cwd=upstream, env=env)
+        repository = jhbuild.versioncontrol.git.GitRepository(config, 'local', upstream)
+        branch = repository.branch('foo', module=upstream)
+        buildscript = _ExecutingBuildScript(config, [],
+                jhbuild.moduleset.ModuleSet(config, db=mock.PackageDB()))
+        branch.checkout(buildscript)
+
+        mirror = os.path.join(config.dvcs_mirror_dir, 'foo.git')
+        self.assertEqual(branch._get_alternates(),
+                         [os.path.join(mirror, 'objects')])
+        self.assertEqual(subprocess.check_output(
+                ['git', 'config', 'gc.pruneExpire'], cwd=mirror).strip(), b'never')
+
+        self.assertTrue(branch.dissociate())
+        self.assertEqual(branch._get_alternates(), [])
+        shutil.rmtree(mirror)
+        subprocess.check_output(['git', 'fsck', '--no-progress'],
+                                cwd=branch.get_checkoutdir(), stderr=subprocess.STDOUT)
+
+
+class GitCheckoutStateTestCase(JhbuildConfigTestCase):
+    '''Reading the state of git checkouts at once'''
+
+    def test_state(self):
+        config = self.make_config()
+        config.quiet_mode = True
+        upstream = os.path.join(self.make_temp_dir(), 'foo')
+        env = dict(os.environ, GIT_AUTHOR_NAME='jhbuild', GIT_AUTHOR_EMAIL='jhbuild@',
+                   GIT_COMMITTER_NAME='jhbuild', GIT_COMMITTER_EMAIL='jhbuild@')
+        os.makedirs(upstream)
+        for args in (['init', '-q', '-b', 'main'],
+                     ['commit', '-q', '--allow-empty', '-m', 'foo'],
+                     ['branch', 'stable'], ['tag', 'v1']):
+            subprocess.check_call(['git'] + args, cwd=upstream, env=env)
+        repository = jhbuild.versioncontrol.git.GitRepository(config, 'local', upstream)
+        branch = repository.branch('foo', module=upstream, revision='main')
+        buildscript = _ExecutingBuildScript(config, [],
+                jhbuild.moduleset.ModuleSet(config, db=mock.PackageDB()))
+        branch.checkout(buildscript)
+        if branch._get_state() is None:
+            raise unittest.SkipTest('git is too old')
+
+        commands = []
+        orig_get_output = jhbuild.versioncontrol.git.get_output
+
+        def get_output(cmd, *args, **kwargs):
+            commands.append(cmd)
+            return orig_get_output(cmd, *args, **kwargs)
+        jhbuild.versioncontrol.git.get_output = get_output
+        try:
+            self.assertEqual(branch.get_current_branch(), 'main')
+            self.assertTrue(branch.is_tracking_a_remote_branch('main'))
+            self.assertTrue(branch.is_local_branch('main'))
+            self.assertTrue(branch.is_local_branch('v1'))
+            self.assertTrue(branch.is_local_branch('origin/stable'))
+            self.assertFalse(branch._is_dirty(ignore_submodules=True))
+            self.assertEqual(branch.get_remote_branches_list(),
+                             ['origin/HEAD -> origin/main', 'origin/main',
+                              'origin/stable'])
+            self.assertEqual(len(commands), 2)
+
+            with open(os.path.join(branch.get_checkoutdir(), 'bar'), 'w') as fp:
+                fp.write('bar')
+            subprocess.check_call(['git', 'add', 'bar'], cwd=branch.get_checkoutdir())
+            self.assertTrue(branch._is_dirty(ignore_submodules=True))
+            subprocess.check_call(['git', 'reset', '-q', '--hard'], cwd=branch.get_checkoutdir())
+
+            # the state is read again after changing the checkout
+            branch._execute_git(buildscript, ['git', 'checkout', '-q', '--track',
+                                              '-b', 'stable', 'origin/stable'])
+            self.assertEqual(branch.get_current_branch(), 'stable')
+            self.assertTrue(branch.is_tracking_a_remote_branch('stable'))
+            branch._execute_git(buildscript, ['git', 'checkout', '-q', '--detach'])
+            self.assertEqual(branch.get_current_branch(), None)
+        finally:
+            jhbuild.versioncontrol.git.get_output = orig_get_output
+
+
+class UnpackTestCase(JhbuildConfigTestCase):
+    '''Unpacking tarballs'''
+
+    def test_unpack_stamp(self):
+        config = self.make_config()
+        config.tarballdir = self.make_temp_dir()
+        srcdir = os.path.join(self.make_temp_dir(), 'foo-1.0')
+        os.makedirs(os.path.join(srcdir, 'src'))
+        with open(os.path.join(srcdir, 'configure'), 'w') as fp:
+            fp.write('foo')
+        with open(os.path.join(srcdir, 'src', 'foo.c'), 'w') as fp:
+            fp.write('foo')
+        with tarfile.open(os.path.join(config.tarballdir, 'foo-1.0.tar.gz'), 'w:gz') as tar:
+            tar.add(srcdir, 'foo-1.0')
+        repository = jhbuild.versioncontrol.tarball.TarballRepository(config, 'local', 'file:///')
+        with open(os.path.join(config.tarballdir, 'foo-1.0.tar.gz'), 'rb') as fp:
+            source_hash = 'sha256:' + hashlib.sha256(fp.read()).hexdigest()
+        branch = repository.branch('foo', '1.0', module='file:///foo-1.0.tar.gz',
+                                   hash=source_hash)
+        buildscript = _ExecutingBuildScript(config, [],
+                jhbuild.moduleset.ModuleSet(config, db=mock.PackageDB()))
+        config.checkout_mode = 'clobber'
+        branch.checkout(buildscript)
+        self.assertTrue(os.path.exists(os.path.join(branch.srcdir, 'configure')))
+        self.assertEqual(sorted(os.listdir(branch.srcdir)), ['configure', 'src'])
+        self.assertEqual(branch._check_unpacked(True), True)
+
+        # the sources are not unpacked again, unless they were modified
+        tarball = os.path.join(config.tarballdir, 'foo-1.0.tar.gz')
+        os.rename(tarball, tarball + '.orig')
+        branch.checkout(buildscript)
+        self.assertTrue(os.path.exists(os.path.join(branch.srcdir, 'configure')))
+        with open(os.path.join(branch.srcdir, 'config.status'), 'w') as fp:
+            fp.write('foo')
+        self.assertEqual(branch._check_unpacked(False), True)
+        self.assertEqual(branch._check_unpacked(True), False)
+        os.remove(os.path.join(branch.srcdir, 'config.status'))
+        self.assertEqual(branch._check_unpacked(True), True)
+
+        # including files modified in place, in subdirectories
+        foo_c = os.path.join(branch.srcdir, 'src', 'foo.c')
+        st = os.stat(foo_c)
+        with open(foo_c, 'w') as fp:
+            fp.write('bar')
+        os.utime(foo_c, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+        self.assertEqual(branch._check_unpacked(True), False)
+        os.rename(tarball + '.orig', tarball)
+        branch.checkout(buildscript)
+        with open(foo_c) as fp:
+            self.assertEqual(fp.read(), 'foo')
+        self.assertEqual(branch._check_unpacked(True), True)
+
+        branch.patches = [('foo.patch', 1)]
+        self.assertEqual(branch._check_unpacked(False), False)
+
+
+class TarballStoreTestCase(JhbuildConfigTestCase):
+    '''Sharing tarballs between configurations'''
+
+    def test_store(self):
+        store = jhbuild.utils.tarballstore.TarballStore(self.make_temp_dir(), 0)
+        tarballdir = self.make_temp_dir()
+        hashes = []
+        for name in ('foo', 'bar'):
+            filename = os.path.join(tarballdir, name + '.tar.xz')
+            with open(filename, 'wb') as fp:
+                fp.write(name.encode('utf-8'))
+            hashes.append('sha256:' + hashlib.sha256(name.encode('utf-8')).hexdigest())
+            store.store(hashes[-1], filename)
+        self.assertTrue(store.has(hashes[0]))
+        self.assertFalse(store.restore('sha256:0123', os.path.join(tarballdir, 'baz.tar.xz')))
+
+        other_tarballdir = self.make_temp_dir()
+        filename = os.path.join(other_tarballdir, 'foo.tar.xz')
+        self.assertTrue(store.restore(hashes[0], filename))
+        self.assertTrue(os.path.samefile(filename, os.path.join(tarballdir, 'foo.tar.xz')))
+
+        # tarballs still linked from a tarballdir are kept
+        self.assertEqual(store.gc([]), (0, 0))
+        self.assertTrue(store.has(hashes[1]))
+
+        # only the tarballs no module refers to are removed
+        os.unlink(os.path.join(tarballdir, 'foo.tar.xz'))
+        os.unlink(os.path.join(other_tarballdir, 'foo.tar.xz'))
+        os.unlink(os.path.join(tarballdir, 'bar.tar.xz'))
+        self.assertEqual(store.gc([hashes[0]]), (1, 3))
+        self.assertTrue(store.has(hashes[0]))
+        self.assertFalse(store.has(hashes[1]))
+
+    def test_corrupted(self):
+        store = jhbuild.utils.tarballstore.TarballStore(self.make_temp_dir(), 0)
+        source_hash = 'sha256:' + hashlib.sha256(b'foo').hexdigest()
+        filename = store.get_filename(source_hash)
+        os.makedirs(os.path.dirname(filename))
+        with open(filename, 'wb') as fp:
+            fp.write(b'bar')
+
+        # a tarball not matching its hash is dropped from the store
+        localfile = os.path.join(self.make_temp_dir(), 'foo.tar.xz')
+        self.assertFalse(store.restore(source_hash, localfile))
+        self.assertFalse(os.path.exists(localfile))
+        self.assertFalse(store.has(source_hash))
+
+
+class RevisionCacheTestCase(JhbuildConfigTestCase):
+    '''Caching the revisions of the checkouts'''
+
+    def test_revisions(self):
+        temp_dir = self.make_temp_dir()
+        filename = os.path.join(temp_dir, 'revisions.json')
+        branch = _RevisionBranch(temp_dir)
+        cache = jhbuild.utils.revisioncache.RevisionCache(filename)
+        self.assertEqual(cache.get_revision(branch, lambda: 'abc'), 'abc')
+        self.assertEqual(cache.get_revision(branch, lambda: 'def'), 'abc')
+        self.assertEqual(cache.is_dirty(branch, lambda: True), True)
+        self.assertEqual(cache.is_dirty(branch, lambda: False), True)
+        cache.save()
+
+        # only the revision is kept, until the stamp changes
+        cache = jhbuild.utils.revisioncache.RevisionCache(filename)
+        self.assertEqual(cache.get_revision(branch, lambda: 'def'), 'abc')
+        self.assertEqual(cache.is_dirty(branch, lambda: False), False)
+        branch.stamp = ['2']
+        self.assertEqual(cache.get_revision(branch, lambda: 'def'), 'def')
+
+    def test_tree_ids(self):
+        class TreeIdBranch(object):
+            def __init__(self, tree_id):
+                self._tree_id = tree_id
+
+            def tree_id(self):
+                if self._tree_id is None:
+                    raise NotImplementedError
+                return self._tree_id
+
+        modules = [Package('foo', branch=TreeIdBranch('abc')),
+                   Package('bar', branch=TreeIdBranch(None)),
+                   Package('baz'),
+                   Package('qux', branch=TreeIdBranch('def'))]
+        self.assertEqual(
+            jhbuild.utils.revisioncache.get_tree_ids(self.config, modules, 2),
+            ['abc', None, None, 'def'])
+
+
+class BuildStatsTestCase(unittest.TestCase):
+    '''Reporting on the build history'''
+
+    def record(self, run, module, phase, wall, status=0):
+        return {'run': run, 'module': module, 'phase': phase, 'start': run,
+                'wall': wall, 'cpu': 0, 'status': status, 'revision': None}
+
+    def test_report(self):
+        records = [self.record(1, 'foo', 'build', 100),
+                   self.record(1, 'bar', 'build', 50),
+                   self.record(2, 'foo', 'build', 200),
+                   self.record(2, 'foo', 'install', 5),
+                   self.record(3, 'bar', 'build', 55),
+                   self.record(4, 'bar', 'build', 500, status=2),
+                   self.record(5, 'foo', 'checkout', 3)]
+        latest = jhbuild.commands.stats.get_latest_runs(records)
+        self.assertEqual([x['wall'] for x in latest['foo']], [200, 5])
+        self.assertEqual([x['wall'] for x in latest['bar']], [500])
+        # failed phases and small slow downs are not regressions
+        regressions = jhbuild.commands.stats.get_regressions(records, 25)
+        self.assertEqual([(x['wall'], y['wall']) for x, y in regressions],
+                         [(100, 200)])
+        self.assertEqual(jhbuild.utils.buildhistory.format_duration(3725), '1h02m05s')
+
+
 class EndToEndTest(JhbuildConfigTestCase):
 
     # FIXME: broken under Win32
@@ -780,6 +1890,53 @@ class UtilsTest(JhbuildConfigTestCase):
         self.assertTrue(jhbuild.utils.cmds.compare_version('2', '1.2.3.4'))
         self.assertFalse(jhbuild.utils.cmds.compare_version('1.2.3.4', '2'))
 
+    def test_jobserver(self):
+        from jhbuild.utils.jobserver import JobServer
+        if os.name != 'posix':
+            raise unittest.SkipTest('jobserver requires named pipes')
+        self.config.jobserver = True
+        self.config.jobs = 3
+        jobserver = JobServer.create(self.config)
+        try:
+            self.assertEqual(jobserver.tokens_in_use(), 0)
+            token = jobserver.acquire()
+            jobserver.acquire()
+            self.assertEqual(jobserver.tokens_in_use(), 2)
+            jobserver.release(token)
+            self.assertEqual(jobserver.tokens_in_use(), 1)
+            self.assertEqual(jobserver.peak, 2)
+            env = jobserver.get_environment({'MAKEFLAGS': 'V=1'})
+            self.assertEqual(env['MAKEFLAGS'],
+                             'V=1 -j3 --jobserver-auth=fifo:%s' % jobserver.path)
+            jobserver.release(None)
+
+            # the tokens of a child that crashed are put back
+            class _CrashingBuildScript:
+                def execute(self, command, cwd=None, extra_env=None):
+                    os.read(jobserver.readfd, 2)
+                    raise CommandError('killed')
+            self.assertRaises(CommandError, jobserver.run,
+                              _CrashingBuildScript(), 'make')
+            self.assertEqual(jobserver.tokens_in_use(), 0)
+        finally:
+            jobserver.close()
+        self.assertFalse(os.path.exists(jobserver.path))
+
+        self.config.jobserver = False
+        self.assertEqual(JobServer.create(self.config), None)
+
+    def test_get_url_host(self):
+        from jhbuild.versioncontrol import get_url_host
+        self.assertEqual(get_url_host('https://gitlab.gnome.org/GNOME/glib.git'),
+                         'gitlab.gnome.org')
+        self.assertEqual(get_url_host('http://127.0.0.1:8000/foo-1.0.tar.xz'),
+                         '127.0.0.1')
+        self.assertEqual(get_url_host('git@github.com:GNOME/jhbuild.git'),
+                         'github.com')
+        self.assertEqual(get_url_host('file:///srv/git/glib'), None)
+        self.assertEqual(get_url_host('/srv/git/glib'), None)
+        self.assertEqual(get_url_host(None), None)
+
 def get_installed_pkgconfigs(config):
     ''' overload jhbuild.utils.get_installed_pkgconfigs'''
     return {'syspkgalpha'   : '2',